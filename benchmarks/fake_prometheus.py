@@ -0,0 +1,196 @@
+# fake_prometheus.py
+# A local stand-in for the Prometheus HTTP API serving synthetic series for the query sets, so the collector
+# pipeline can be benchmarked without a cluster. Series shapes follow the entry types of the query sets.
+import os
+import sys
+import json
+import math
+import time
+import zlib
+import argparse
+import threading
+import yaml
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+from src.query_planner import QueryPlanner
+
+class FakePrometheus:
+    STEP_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+    def __init__(self, query_files, nodes=3, cardinality=4, latency=0.0, seed=42, port=0, history="7d"):
+        self.nodes = nodes
+        # Number of attribute values per node (per_node_per_attribute) or overall (per_attribute)
+        self.cardinality = cardinality
+        # Fixed delay added to every response, in seconds
+        self.latency = latency
+        self.seed = seed
+        self.history = self.parse_step(history)
+        self.planner = QueryPlanner()
+        self.types = self.load_types(query_files)
+        self.requests = 0
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self.get_handler())
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.url = f"http://127.0.0.1:{self.port}"
+
+    def load_types(self, query_files):
+        # Map every expression the collector may send (including the shared base of a threshold family)
+        # to the entry type it feeds, which decides the labels of the synthetic series
+        types = {}
+        for query_file in query_files:
+            with open(query_file) as f:
+                for entry in yaml.safe_load(f) or []:
+                    entry_type = str(entry.get("type", "")).strip()
+                    expr = self.planner.normalize_expr(entry.get("expr", ""))
+                    types.setdefault(self.planner.strip_outer_parens(expr), entry_type)
+                    split = self.planner.split_threshold(expr)
+                    if split:
+                        types.setdefault(split[0], entry_type)
+        return types
+
+    @classmethod
+    def parse_step(cls, step):
+        step = str(step).strip()
+        for unit in sorted(cls.STEP_UNITS, key=len, reverse=True):
+            if step.endswith(unit) and step[:-len(unit)].replace(".", "").isdigit():
+                return float(step[:-len(unit)]) * cls.STEP_UNITS[unit]
+        return float(step)
+
+    def get_series_labels(self, expr):
+        entry_type = self.types.get(self.planner.strip_outer_parens(self.planner.normalize_expr(expr)), "scalar")
+        nodes = [f"worker-{i:04d}.cluster.local" for i in range(self.nodes)]
+        attributes = [f"attr-{j}" for j in range(self.cardinality)]
+        if entry_type.endswith("per_node_per_attribute"):
+            return [{"node": node, "attribute": attribute} for node in nodes for attribute in attributes]
+        if entry_type.endswith("per_node"):
+            return [{"node": node} for node in nodes]
+        if entry_type.endswith("per_attribute"):
+            return [{"attribute": attribute} for attribute in attributes]
+        return [{}]
+
+    def get_series_seed(self, expr, labels):
+        return zlib.crc32(f"{self.seed}|{expr}|{sorted(labels.items())}".encode())
+
+    def get_value(self, expr, series_seed, timestamp):
+        # Deterministic for a given (expr, series, timestamp), so repeated runs produce identical payloads
+        value = (series_seed * 2654435761 + int(timestamp)) % 100003
+        if " bool " in expr:
+            return str(value % 2)
+        return str(value / 1000)
+
+    def query(self, params):
+        expr = params.get("query", "")
+        timestamp = float(params.get("time", time.time()))
+        if expr == "time()":
+            return {"resultType": "scalar", "result": [timestamp, str(timestamp)]}
+        if "kube_pod_start_time" in expr or "prometheus_tsdb_lowest_timestamp_seconds" in expr:
+            return {"resultType": "vector", "result": [{"metric": {}, "value": [timestamp, str(time.time() - self.history)]}]}
+        return {"resultType": "vector",
+                "result": [{"metric": labels, "value": [timestamp, self.get_value(expr, self.get_series_seed(expr, labels), timestamp)]}
+                           for labels in self.get_series_labels(expr)]}
+
+    def query_range(self, params):
+        expr = params["query"]
+        start, end, step = float(params["start"]), float(params["end"]), self.parse_step(params["step"])
+        timestamps = [start + i * step for i in range(int(math.floor((end - start) / step)) + 1)]
+        result = []
+        for labels in self.get_series_labels(expr):
+            series_seed = self.get_series_seed(expr, labels)
+            result.append({"metric": labels, "values": [[t, self.get_value(expr, series_seed, t)] for t in timestamps]})
+        return {"resultType": "matrix", "result": result}
+
+    def get_stats(self, expr, data, seconds):
+        # Shaped like Prometheus' stats=all; range selectors are counted as 20 raw samples per evaluated point
+        if data["resultType"] == "matrix":
+            points = sum(len(series["values"]) for series in data["result"])
+        else:
+            points = len(data["result"]) if data["resultType"] == "vector" else 1
+        factor = 20 if "[" in expr else 1
+        return {"timings": {"evalTotalTime": seconds, "execTotalTime": seconds},
+                "samples": {"totalQueryableSamples": points * factor, "peakSamples": max(1, points // max(1, len(data["result"]))) * factor}}
+
+    def tsdb_status(self):
+        now = time.time()
+        return {"headStats": {"minTime": int((now - self.history) * 1000), "maxTime": int(now * 1000)}}
+
+    def get_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def get_params(self):
+                url = urlparse(self.path)
+                params = parse_qs(url.query)
+                if self.command == "POST":
+                    length = int(self.headers.get("Content-Length", 0))
+                    params.update(parse_qs(self.rfile.read(length).decode()))
+                return url.path, {key: values[0] for key, values in params.items()}
+
+            def do_POST(self):
+                self.do_GET()
+
+            def do_GET(self):
+                path, params = self.get_params()
+                started = time.perf_counter()
+                if path == "/api/v1/query":
+                    data = fake.query(params)
+                elif path == "/api/v1/query_range":
+                    data = fake.query_range(params)
+                elif path.startswith("/api/v1/status/"):
+                    data = fake.tsdb_status()
+                else:
+                    self.send_error(404)
+                    return
+                if fake.latency:
+                    time.sleep(fake.latency)
+                if params.get("stats") == "all" and "resultType" in data:
+                    data["stats"] = fake.get_stats(params["query"], data, time.perf_counter() - started)
+                body = json.dumps({"status": "success", "data": data}).encode()
+                with fake.lock:
+                    fake.requests += 1
+                    fake.bytes_sent += len(body)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="fake-prometheus", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve synthetic Prometheus data for the collector query sets.")
+    parser.add_argument("--port", type=int, default=9090)
+    parser.add_argument("--nodes", type=int, default=3)
+    parser.add_argument("--cardinality", type=int, default=4, help="Attribute values per node or per attribute metric.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Delay added to every response, in seconds.")
+    parser.add_argument("--query-files", nargs="+", default=[os.path.join(REPO_ROOT, "querysets/ocp-platform/features-definition.yaml"),
+                                                             os.path.join(REPO_ROOT, "querysets/ocp-platform/labels-definition.yaml")])
+    args = parser.parse_args()
+
+    fake = FakePrometheus(args.query_files, nodes=args.nodes, cardinality=args.cardinality, latency=args.latency, port=args.port)
+    print(f"Serving synthetic Prometheus at {fake.url}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        fake.server.server_close()
+
+if __name__ == "__main__":
+    main()
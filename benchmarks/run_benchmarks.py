@@ -0,0 +1,190 @@
+# run_benchmarks.py
+# Runs the real main.py pipeline against the local synthetic Prometheus for a set of scenarios and records
+# throughput, peak RSS and per-stage timings. Results are written as JSON tagged with the git commit so runs
+# from different commits can be compared with --compare.
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import yaml
+from datetime import datetime, timedelta
+
+from fake_prometheus import FakePrometheus
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+QUERY_FILES = {
+    "features": ["querysets/ocp-platform/features-definition.yaml"],
+    "labels": ["querysets/ocp-platform/labels-definition.yaml"],
+}
+
+# nodes and cardinality shape the synthetic series, range is the collected duration for range scenarios
+SCENARIOS = {
+    "instant-small": {"mode": "instant", "nodes": 3, "cardinality": 4},
+    "instant-large": {"mode": "instant", "nodes": 250, "cardinality": 16},
+    "range-day": {"mode": "range", "nodes": 10, "cardinality": 4, "range": "1d", "step": "1m"},
+    "range-week": {"mode": "range", "nodes": 50, "cardinality": 8, "range": "7d", "step": "5m"},
+}
+DEFAULT_SCENARIOS = ["instant-small", "instant-large", "range-day"]
+# Fixed end of every range scenario so all commits collect exactly the same samples
+RANGE_END = datetime(2024, 1, 8)
+
+def get_git_info():
+    def git(*args):
+        return subprocess.run(["git", *args], cwd=REPO_ROOT, capture_output=True, text=True).stdout.strip()
+    return {"commit": git("rev-parse", "HEAD"), "subject": git("log", "-1", "--format=%s"),
+            "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+
+def write_config(path, scenario, url, workdir):
+    prometheus = {
+        "query_mode": scenario["mode"],
+        "interval": scenario.get("step", "0") if scenario["mode"] == "range" else "0",
+        "url": url,
+        "token": "benchmark",
+        "cache": {"enabled": False},
+        "query_sets": [{"name": "base", **QUERY_FILES}],
+    }
+    if scenario["mode"] == "range":
+        seconds = FakePrometheus.parse_step(scenario["range"])
+        prometheus["start_time"] = (RANGE_END - timedelta(seconds=seconds)).strftime("%Y-%m-%d %H:%M:%S")
+        prometheus["end_time"] = RANGE_END.strftime("%Y-%m-%d %H:%M:%S")
+    config = {
+        "prometheus": prometheus,
+        "destination": {"path": os.path.join(workdir, "out"), "file_format": scenario.get("file_format", "parquet"),
+                        "compression": "snappy"},
+        "instrumentation": {"summary": False, "output": os.path.join(workdir, "instrumentation.json")},
+    }
+    with open(path, "w") as f:
+        yaml.safe_dump(config, f)
+
+def run_once(scenario, fake):
+    workdir = tempfile.mkdtemp(prefix="collector-bench-")
+    try:
+        config_path = os.path.join(workdir, "config.yaml")
+        write_config(config_path, scenario, fake.url, workdir)
+        requests_before, bytes_before = fake.requests, fake.bytes_sent
+
+        with open(os.path.join(workdir, "collector.log"), "w") as log:
+            started = time.perf_counter()
+            process = subprocess.Popen([sys.executable, "main.py", "--config", config_path], cwd=REPO_ROOT,
+                                       stdout=log, stderr=subprocess.STDOUT, env={**os.environ, "LOG_LEVEL": "INFO"})
+            # wait4 reports the resource usage of this child alone; ru_maxrss is in KiB on Linux
+            _, status, usage = os.wait4(process.pid, 0)
+            wall = time.perf_counter() - started
+        process.returncode = os.waitstatus_to_exitcode(status)
+        with open(os.path.join(workdir, "collector.log")) as log:
+            log_text = log.read()
+        if process.returncode != 0:
+            raise RuntimeError(f"main.py exited with {process.returncode}:\n{log_text[-2000:]}")
+
+        with open(os.path.join(workdir, "instrumentation.json")) as f:
+            instrumentation = json.load(f)
+        queries = instrumentation["queries"].values()
+        samples = sum(stats["samples"] for stats in queries)
+        output_bytes = sum(os.path.getsize(os.path.join(root, name))
+                           for root, _, names in os.walk(os.path.join(workdir, "out")) for name in names)
+        return {
+            "wall_seconds": wall,
+            "cpu_seconds": usage.ru_utime + usage.ru_stime,
+            "peak_rss_mb": usage.ru_maxrss / 1024 if sys.platform != "darwin" else usage.ru_maxrss / 1024 / 1024,
+            "stages": {stage: stats["seconds"] for stage, stats in instrumentation["stages"].items()},
+            "requests": fake.requests - requests_before,
+            "response_mb": (fake.bytes_sent - bytes_before) / 1024 / 1024,
+            "samples": samples,
+            "samples_per_second": samples / wall,
+            "query_errors": sum(stats["errors"] for stats in queries),
+            "log_errors": log_text.count("[ERROR]"),
+            "output_mb": output_bytes / 1024 / 1024,
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def summarize(runs):
+    # Median of every numeric measurement across the repeats
+    median = {key: statistics.median(run[key] for run in runs) for key, value in runs[0].items() if not isinstance(value, dict)}
+    median["stages"] = {stage: statistics.median(run["stages"].get(stage, 0.0) for run in runs) for stage in runs[0]["stages"]}
+    return median
+
+def run_scenario(name, scenario, repeat, latency):
+    query_files = [os.path.join(REPO_ROOT, path) for paths in QUERY_FILES.values() for path in paths]
+    fake = FakePrometheus(query_files, nodes=scenario["nodes"], cardinality=scenario["cardinality"], latency=latency).start()
+    try:
+        # One unmeasured warm-up run so imports and the page cache do not skew the first repeat
+        run_once(scenario, fake)
+        runs = []
+        for index in range(repeat):
+            runs.append(run_once(scenario, fake))
+            print(f"  {name} run {index + 1}/{repeat}: {runs[-1]['wall_seconds']:.2f}s, "
+                  f"{runs[-1]['peak_rss_mb']:.0f} MiB peak RSS, {runs[-1]['samples_per_second']:.0f} samples/s")
+    finally:
+        fake.stop()
+    return {"params": {**scenario, "latency": latency, "repeat": repeat}, "runs": runs, "median": summarize(runs)}
+
+def print_results(results, baseline=None):
+    header = f"{'scenario':<16} {'wall s':>8} {'cpu s':>8} {'RSS MiB':>8} {'samples/s':>11} {'fetch':>7} {'parse':>7} {'commit':>7} {'write':>7}"
+    print(header)
+    for name, scenario in results["scenarios"].items():
+        median = scenario["median"]
+        stages = median["stages"]
+        print(f"{name:<16} {median['wall_seconds']:>8.2f} {median['cpu_seconds']:>8.2f} {median['peak_rss_mb']:>8.0f} "
+              f"{median['samples_per_second']:>11.0f} {stages.get('fetch', 0):>7.2f} {stages.get('parse', 0):>7.2f} "
+              f"{stages.get('commit', 0):>7.2f} {stages.get('write', 0):>7.2f}")
+        if median["log_errors"]:
+            print(f"{'':<16} warning: {median['log_errors']:.0f} errors logged per run")
+
+        if baseline and name in baseline["scenarios"]:
+            before = baseline["scenarios"][name]["median"]
+            changes = []
+            for key in ("wall_seconds", "cpu_seconds", "peak_rss_mb"):
+                if before.get(key):
+                    changes.append(f"{key} {(median[key] / before[key] - 1) * 100:+.1f}%")
+            for stage, seconds in stages.items():
+                if before.get("stages", {}).get(stage):
+                    changes.append(f"{stage} {(seconds / before['stages'][stage] - 1) * 100:+.1f}%")
+            print(f"{'':<16} vs {baseline['git']['commit'][:10]}: {', '.join(changes)}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the collector pipeline against a synthetic Prometheus.")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help=f"Scenario to run (default: {', '.join(DEFAULT_SCENARIOS)}).")
+    parser.add_argument("--nodes", type=int, help="Override the node count of every scenario.")
+    parser.add_argument("--cardinality", type=int, help="Override the attribute cardinality of every scenario.")
+    parser.add_argument("--range", help="Override the collected duration of range scenarios, e.g. '12h'.")
+    parser.add_argument("--step", help="Override the step of range scenarios, e.g. '30s'.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Delay added to every Prometheus response, in seconds.")
+    parser.add_argument("--file-format", choices=["parquet", "csv"], help="Override the output file format.")
+    parser.add_argument("--repeat", type=int, default=3, help="Measured runs per scenario; the median is reported.")
+    parser.add_argument("--output", default=os.path.join(REPO_ROOT, "benchmarks", "results"), help="Directory for the results JSON.")
+    parser.add_argument("--compare", help="Results JSON of an earlier run to compare against.")
+    args = parser.parse_args()
+
+    overrides = {"nodes": args.nodes, "cardinality": args.cardinality, "file_format": args.file_format}
+    git = get_git_info()
+    results = {"git": git, "timestamp": datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(),
+               "platform": platform.platform(), "cpu_count": os.cpu_count(), "scenarios": {}}
+
+    for name in args.scenario or DEFAULT_SCENARIOS:
+        scenario = {**SCENARIOS[name], **{key: value for key, value in overrides.items() if value is not None}}
+        if scenario["mode"] == "range":
+            scenario.update({key: value for key, value in (("range", args.range), ("step", args.step)) if value})
+        print(f"Running {name}: {scenario}")
+        results["scenarios"][name] = run_scenario(name, scenario, args.repeat, args.latency)
+
+    os.makedirs(args.output, exist_ok=True)
+    filename = os.path.join(args.output, f"{datetime.now():%Y%m%d-%H%M%S}_{git['commit'][:10]}{'-dirty' if git['dirty'] else ''}.json")
+    with open(filename, "w") as f:
+        json.dump(results, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    print(f"Results written to {filename}")
+
+if __name__ == "__main__":
+    main()
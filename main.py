@@ -1,48 +1,159 @@
 # main.py
 from src.metrics_processor import MetricsProcessor
 from src.prometheus_api import PrometheusAPI
+from src.query_cache import QueryCache
+from src.load_control import AdaptiveLimiter
+from src.instrumentation import Instrumentation
+from src.cluster_collector import ClusterCollector
 from src.config import Config
-from src.stats import FileStats
+import os
 import sys
+import signal
+import threading
+
+def handle_sigterm(signum, frame):
+    # Treat SIGTERM like CTRL + C so open output files are finalized before exiting
+    raise KeyboardInterrupt
 
 def main():
     # Initialize the Config class
     configuration = Config()
+    if configuration.is_stats_mode():
+        sys.exit(0 if configuration.get_stats() else 1)
+
     if not configuration.config:
         sys.exit("Failed to load configuration. Exiting...")
 
     logger = configuration.logger
 
-    if configuration.is_stats_mode():
-        configuration.get_stats()
-        sys.exit(0)
-
-    # Create the Prometheus API client
-    prom_api = PrometheusAPI(configuration.config["prometheus"]["url"], configuration.config["prometheus"]["token"], logger)
-
-    # Create the MetricsProcessor
-    processor = MetricsProcessor(prom_api,
-                                 configuration.config["prometheus"]["query_sets"], 
-                                 configuration.query_mode,
-                                 configuration.interval,
-                                 logger,
-                                 configuration.start_time,
-                                 configuration.end_time,
-                                 file_format=configuration.file_format,
-                                 destination_path=configuration.destination_path,
-                                 compression=configuration.compression)
+    # Range query results are cached on disk so re-runs over the same window skip Prometheus
+    cache = None
+    if configuration.query_mode == "range" and configuration.cache_enabled:
+        cache = QueryCache(configuration.cache_path,
+                           max_size=configuration.cache_max_size,
+                           max_age=configuration.cache_max_age,
+                           refresh=configuration.args.refresh,
+                           logger=logger)
+
+    # Parsed query sets and their query plan are cached across runs, keyed by the query files' content
+    query_set_cache = None
+    if configuration.query_set_cache_enabled:
+        query_set_cache = QueryCache(configuration.query_set_cache_path, max_size=16 * 1024 * 1024, max_age=30 * 86400, logger=logger)
+
+    # Per-query and per-stage timings of the collector itself
+    instrumentation = Instrumentation(logger)
+    if configuration.metrics_port:
+        instrumentation.serve(configuration.metrics_port, configuration.metrics_address)
+
+    # Every cycle is streamed to the sink, if configured, as soon as it is assembled; all clusters share it
+    sink = None
+    if configuration.sink_format:
+        from src.sinks import get_sink
+        sink = get_sink(configuration.sink_format, configuration.sink_target, logger)
+
+    # Clusters collected in one run each get their own client and processor. The processors share the query
+    # plan of the first one and, for merged output, its writers; partitioned output goes to cluster=<name>/.
+    clusters = configuration.clusters or [{"name": None, "url": configuration.config["prometheus"]["url"],
+                                           "token": configuration.config["prometheus"]["token"]}]
+    merged = bool(configuration.clusters) and configuration.cluster_output == "merged"
+    writers, writers_lock = ({}, threading.Lock()) if merged else (None, None)
+    processors = {}
+    for cluster in clusters:
+        cluster_logger = logger.getChild(cluster["name"]) if cluster["name"] else logger
+        destination_path = configuration.destination_path
+        if cluster["name"] and not merged:
+            destination_path = os.path.join(destination_path, f"cluster={cluster['name']}")
+
+        # Each Prometheus gets its own limiter, so one struggling cluster does not slow down the others
+        limiter = None
+        if configuration.adaptive_concurrency:
+            limiter = AdaptiveLimiter(configuration.max_in_flight, configuration.min_in_flight,
+                                      configuration.latency_target, logger=cluster_logger)
+
+        # Create the Prometheus API client
+        prom_api = PrometheusAPI(cluster["url"], cluster["token"], cluster_logger,
+                                 pool_size=configuration.pool_size,
+                                 connect_timeout=configuration.connect_timeout,
+                                 read_timeout=configuration.read_timeout,
+                                 retries=configuration.retries,
+                                 max_points=configuration.max_points_per_series,
+                                 cache=cache,
+                                 json_decoder=configuration.json_decoder,
+                                 instrumentation=instrumentation,
+                                 limiter=limiter)
+
+        # Create the MetricsProcessor
+        try:
+            cluster_processor = MetricsProcessor(prom_api,
+                                                 configuration.config["prometheus"]["query_sets"],
+                                                 configuration.query_mode,
+                                                 configuration.interval,
+                                                 cluster_logger,
+                                                 configuration.start_time,
+                                                 configuration.end_time,
+                                                 file_format=configuration.file_format,
+                                                 destination_path=destination_path,
+                                                 compression=configuration.compression,
+                                                 max_in_flight=configuration.max_in_flight,
+                                                 float_dtype=configuration.float_dtype,
+                                                 write_mode=configuration.write_mode,
+                                                 rotation=configuration.rotation,
+                                                 partitioning=configuration.partitioning,
+                                                 overrun_policy=configuration.overrun_policy,
+                                                 max_concurrent_cycles=configuration.max_concurrent_cycles,
+                                                 instrumentation=instrumentation,
+                                                 # With several clusters the collector reports the whole run once
+                                                 log_summary=configuration.instrumentation_summary and not configuration.clusters,
+                                                 instrumentation_output=None if configuration.clusters else configuration.instrumentation_output,
+                                                 checkpoint_enabled=configuration.checkpoint_enabled,
+                                                 collection_window=configuration.collection_window,
+                                                 time_range_max_age=configuration.time_range_max_age,
+                                                 resume=configuration.args.resume,
+                                                 since_last=configuration.args.since_last,
+                                                 cluster=cluster["name"] if merged else None,
+                                                 query_plan_from=next(iter(processors.values()), None),
+                                                 writers=writers,
+                                                 writers_lock=writers_lock,
+                                                 layout=configuration.layout,
+                                                 query_set_cache=query_set_cache,
+                                                 max_queries_per_cycle=configuration.max_queries_per_cycle,
+                                                 sink=sink,
+                                                 sink_cluster=cluster["name"],
+                                                 write_files=configuration.sink_files or not sink)
+            processors[cluster["name"]] = cluster_processor
+        except Exception as e:
+            if not configuration.clusters:
+                raise
+            logger.error(f"Skipping cluster '{cluster['name']}': {str(e)}")
+
+    if not processors:
+        sys.exit("No cluster could be initialized. Exiting...")
+    if configuration.clusters:
+        processor = ClusterCollector(processors, logger, instrumentation,
+                                     log_summary=configuration.instrumentation_summary,
+                                     instrumentation_output=configuration.instrumentation_output)
+    else:
+        processor = processors[None]
 
     if configuration.args.validate:
         # Only validate the Prometheus queries
-        processor.validate_queries()
+        if processor.validate_queries():
+            sys.exit(1)
+    elif configuration.args.profile_queries:
+        processor.profile_queries(as_json=configuration.args.json)
     else:
         # Run metrics processing on a scheduler
         # if interval = 0 then run metrics processing only once
+        signal.signal(signal.SIGTERM, handle_sigterm)
         try:
             processor.start(configuration.interval)
         except KeyboardInterrupt:
-            logger.info(f"CTRL + C (SIGINT) detected. Shutting down...")
+            logger.info(f"CTRL + C (SIGINT) or SIGTERM detected. Shutting down...")
             sys.exit(0)
+        finally:
+            if sink:
+                sink.close()
+            instrumentation.shutdown()
 
 if __name__ == "__main__":
     main()
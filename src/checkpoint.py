@@ -0,0 +1,93 @@
+import os
+import json
+import hashlib
+import logging
+from datetime import datetime, timezone
+
+class Checkpoint:
+    # Progress of a range collection, kept as JSON next to the output. After every collection window has
+    # been written, the checkpoint records the last collected timestamp overall and per query, so an
+    # interrupted run can resume from the last completed window and later runs can fetch only the delta.
+    # Windows in which queries failed are recorded too, and collected again by the next resumed run.
+    VERSION = 1
+
+    def __init__(self, path, url, fingerprint, step, logger=None):
+        self.path = path
+        self.url = url
+        self.fingerprint = fingerprint
+        self.step = step
+        self.logger = logger if logger else logging.getLogger(__name__)
+        self.state = None
+
+    @staticmethod
+    def get_fingerprint(queries):
+        # Identifies the query plan a checkpoint was written for
+        plan = [(query["expr"], query["kind"], query["step"]) for query in queries]
+        return hashlib.sha256(json.dumps(plan).encode()).hexdigest()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, "r") as f:
+            state = json.load(f)
+        if state.get("version") != self.VERSION:
+            raise ValueError(f"Unsupported checkpoint version {state.get('version')} in {self.path}")
+        if state["url"] != self.url:
+            raise ValueError(f"Checkpoint {self.path} was written for {state['url']}, not {self.url}")
+        if state["step"] != self.step:
+            raise ValueError(f"Checkpoint {self.path} was written with step {state['step']}s, not {self.step}s")
+        if state["fingerprint"] != self.fingerprint:
+            self.logger.warning(f"The query sets changed since checkpoint {self.path} was written. "
+                                f"Queries added since then are only collected from the resumed position on.")
+        self.state = state
+        return state
+
+    def get_next_start(self):
+        # First timestamp on the step grid after the last completed window
+        if self.state["completed_until"] is None:
+            return self.state["start"]
+        return self.state["completed_until"] + self.step
+
+    def begin(self, start_timestamp, end_timestamp):
+        # A fresh collection starts a new checkpoint; a resumed one only moves its end
+        if self.state is None:
+            self.state = {"version": self.VERSION, "url": self.url, "step": self.step, "start": start_timestamp,
+                          "completed_until": None, "windows_completed": 0, "failed_windows": [], "queries": {}}
+        self.state["end"] = end_timestamp
+        self.state["fingerprint"] = self.fingerprint
+        self.save()
+
+    def get_failed_windows(self):
+        # Windows to collect again, oldest first, as {"start", "end", "files"}; files are the output files
+        # (relative to the checkpoint's directory) holding the window's partial rows. Checkpoints of earlier versions
+        # recorded [start, end] pairs without files.
+        return [window if isinstance(window, dict) else {"start": window[0], "end": window[1], "files": []}
+                for window in self.state.get("failed_windows", [])]
+
+    def fail_window(self, window_start, window_end, files=()):
+        failed_windows = [window for window in self.get_failed_windows() if window["start"] != window_start]
+        failed_windows.append({"start": window_start, "end": window_end, "files": sorted(files)})
+        self.state["failed_windows"] = sorted(failed_windows, key=lambda window: window["start"])
+
+    def complete_window(self, window_start, window_end, progress, files=()):
+        # progress maps each query name to (last sample timestamp or None, failed). A window with failed queries
+        # is kept in failed_windows with the files it was written to; collected again, it leaves them once all
+        # its queries succeed.
+        self.state["failed_windows"] = [window for window in self.get_failed_windows() if window["start"] != window_start]
+        if any(failed for last_timestamp, failed in progress.values()):
+            self.fail_window(window_start, window_end, files)
+        self.state["completed_until"] = max(window_end, self.state["completed_until"] or window_end)
+        self.state["windows_completed"] += 1
+        for name, (last_timestamp, failed) in progress.items():
+            query = self.state["queries"].setdefault(name, {"last_timestamp": None})
+            if not failed and last_timestamp is not None:
+                query["last_timestamp"] = max(last_timestamp, query["last_timestamp"] or last_timestamp)
+        self.save()
+
+    def save(self):
+        self.state["updated_at"] = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        # Write to a temporary file first so a crash never leaves a truncated checkpoint behind
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,89 @@
+import json
+import logging
+import threading
+from src.instrumentation import Instrumentation
+
+class ClusterCollector:
+    # Runs the processors of several Prometheus clusters side by side, one worker thread per cluster, so a
+    # fleet is collected by a single job that takes as long as its slowest cluster. The processors share
+    # the loaded query sets, the query plan and the instrumentation; a failing cluster does not stop the others.
+    def __init__(self, processors, logger=None, instrumentation=None, log_summary=True, instrumentation_output=None):
+        # processors maps each cluster name to its MetricsProcessor
+        self.processors = processors
+        self.logger = logger if logger else logging.getLogger(__name__)
+        self.instrumentation = instrumentation if instrumentation else Instrumentation(logger)
+        self.log_summary = log_summary
+        self.instrumentation_output = instrumentation_output
+        self.failed = []
+
+    def run_cluster(self, name, processor, scheduler_interval):
+        try:
+            processor.start(scheduler_interval)
+            self.logger.info(f"Collection of cluster '{name}' finished.")
+        except Exception as e:
+            self.failed.append(name)
+            self.logger.error(f"Collection of cluster '{name}' failed due to {str(e)}")
+
+    def validate_cluster(self, name, processor, failed):
+        self.logger.info(f"Validating queries against cluster '{name}'.")
+        try:
+            failed.extend(f"{name}/{entry}" for entry in processor.validate_queries())
+        except Exception as e:
+            failed.append(name)
+            self.logger.error(f"Validation of cluster '{name}' failed due to {str(e)}")
+
+    def validate_queries(self):
+        # Clusters are probed side by side; returns the failed entries as cluster/entry
+        failed = []
+        threads = [threading.Thread(target=self.validate_cluster, args=(name, processor, failed), name=f"cluster-{name}")
+                   for name, processor in self.processors.items()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return failed
+
+    def profile_queries(self, as_json=False):
+        # One cluster after the other, so that they do not skew each other's latencies
+        profiles = {name: processor.get_query_profile() for name, processor in self.processors.items()}
+        if as_json:
+            print(json.dumps(profiles, indent=2, default=str))
+            return
+        for name, profile in profiles.items():
+            print(f"Cluster: {name}")
+            self.processors[name].print_query_profile(profile)
+
+    def stop(self):
+        for processor in self.processors.values():
+            processor.stop()
+
+    def start(self, scheduler_interval=0):
+        self.logger.info(f"Collecting {len(self.processors)} cluster(s): {', '.join(self.processors)}")
+        threads = []
+        for name, processor in self.processors.items():
+            thread = threading.Thread(target=self.run_cluster, args=(name, processor, scheduler_interval), name=f"cluster-{name}")
+            thread.start()
+            threads.append(thread)
+
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            # Let every cluster finish its cycle in progress so its files are complete
+            self.logger.info("Stopping all clusters after their current cycle...")
+            self.stop()
+            for thread in threads:
+                thread.join()
+            raise
+        finally:
+            # Shared writers of merged output are only closed once every cluster is done with them
+            for processor in self.processors.values():
+                processor.close_writers()
+                processor.shutdown()
+            if self.log_summary:
+                self.instrumentation.log_summary()
+            if self.instrumentation_output:
+                self.instrumentation.write_json(self.instrumentation_output)
+
+        if self.failed:
+            raise RuntimeError(f"Collection failed for cluster(s): {', '.join(self.failed)}")
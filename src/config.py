@@ -1,11 +1,11 @@
 # config.py
 import yaml
+import json
 import logging
 import argparse
 import os
 import sys
 from datetime import datetime
-from src.stats import FileStats
 
 class Config:
     def __init__(self):
@@ -15,6 +15,11 @@ class Config:
         # Set up the logger
         self.logger = self.setup_logger()
 
+        # Statistics of existing files do not need the Prometheus configuration
+        if self.is_stats_mode():
+            self.config = {}
+            return
+
         # Load the configuration
         self.config_file = self.args.config if self.args.config else "config.yaml"
         self.config = self.load_config()
@@ -28,14 +33,26 @@ class Config:
     def parse_args(self):
         parser = argparse.ArgumentParser()
         parser.add_argument("--validate", action="store_true", help="Only validate the Prometheus queries.")
+        parser.add_argument("--profile-queries", action="store_true",
+                            help="Evaluate every query once with Prometheus' evaluation statistics and rank them by the samples they touch.")
         parser.add_argument("--config", help="Config file to use. (default config.yaml)")
         parser.add_argument("--interval", type=str, help="Interval for metrics processing on a scheduler (e.g., '100s', '5m', '1h'). Not applicable with --validate")
         parser.add_argument("--output_path", help="Override the path to write files from configuration.")
         parser.add_argument("--output_format", choices=["csv", "parquet"], help="Override the file format from configuration. Options: parquet, csv.")
         parser.add_argument("--compression", choices=["", "GZIP", "snappy", "brotli"], 
                             help="Override the compression format from configuration. Options: 'GZIP', 'snappy', 'brotli'. Leave empty for no compression.")
-        parser.add_argument("--stats", action="store_true", help="Display statistics about a data file.")
-        parser.add_argument("--filename", type=str, help="Full path of the file for which to display statistics. Required if --stats is provided.")
+        parser.add_argument("--no-cache", action="store_true", help="Do not read or write the range query result cache or the compiled query sets.")
+        parser.add_argument("--refresh", action="store_true", help="Ignore cached range query results and re-fetch them from Prometheus.")
+        resume = parser.add_mutually_exclusive_group()
+        resume.add_argument("--resume", action="store_true", help="Resume an interrupted range collection from its checkpoint.")
+        resume.add_argument("--since-last", action="store_true", help="Range mode: collect only from the end of the previous collection up to now.")
+        parser.add_argument("--metrics-port", type=int, help="Serve the collector's own metrics at http://localhost:<port>/metrics.")
+        parser.add_argument("--metrics-address", type=str, help="Address the metrics endpoint binds to, e.g. 0.0.0.0 for all interfaces. Default: 127.0.0.1.")
+        parser.add_argument("--stats", action="store_true", help="Display statistics about a data file, or profile every file of a directory or glob.")
+        parser.add_argument("--filename", type=str, help="Full path of the file, directory or glob for which to display statistics. Required if --stats is provided.")
+        parser.add_argument("--profile", action="store_true", help="With --stats on a single file, profile its columns like a directory.")
+        parser.add_argument("--workers", type=int, help="Worker processes used to profile files with --stats. (default: number of CPUs)")
+        parser.add_argument("--json", action="store_true", help="Print --stats or --profile-queries results as JSON.")
         return parser.parse_args()
 
     def setup_logger(self):
@@ -52,7 +69,7 @@ class Config:
     def load_config(self):
         try:
             with open(self.config_file, "r") as f:
-                config = yaml.safe_load(f)
+                config = yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
                 self.logger.info("Successfully loaded the config YAML file.")
                 return config
         except Exception as e:
@@ -64,9 +81,55 @@ class Config:
         self.destination_path = self.config.get("destination", {}).get("path", "data/collection")
         self.file_format = self.config.get("destination", {}).get("file_format", "parquet")
         self.compression = self.config.get("destination", {}).get("compression", "")
+        self.float_dtype = self.config.get("destination", {}).get("float_dtype", "float64")
+        self.write_mode = self.config.get("destination", {}).get("write_mode", "rewrite")
+        if self.write_mode not in ["rewrite", "append"]:
+            self.logger.error("Invalid write_mode specified. Only 'rewrite' and 'append' are supported.")
+            sys.exit(1)
+
+        # File rotation and partitioned layout, both handled by the appending writers
+        rotation = self.config.get("destination", {}).get("rotation", {})
+        self.rotation = {}
+        try:
+            if rotation.get("period"):
+                self.rotation["period"] = self.parse_duration(str(rotation["period"]))
+        except ValueError as ve:
+            self.logger.error(f"Error parsing destination.rotation.period from config: {ve}")
+            sys.exit(1)
+        if rotation.get("max_rows"):
+            self.rotation["max_rows"] = int(rotation["max_rows"])
+        if rotation.get("max_size_mb"):
+            self.rotation["max_bytes"] = int(rotation["max_size_mb"] * 1024 * 1024)
+        self.partitioning = self.config.get("destination", {}).get("partitioning", "none")
+        if self.partitioning not in ["none", "hive"]:
+            self.logger.error("Invalid partitioning specified. Only 'none' and 'hive' are supported.")
+            sys.exit(1)
+        if (self.rotation or self.partitioning == "hive") and self.write_mode != "append":
+            self.logger.info("Rotation and partitioning write each cycle incrementally. Using write_mode 'append'.")
+            self.write_mode = "append"
+        self.layout = self.config.get("destination", {}).get("layout", "wide")
+        if self.layout not in ["wide", "long"]:
+            self.logger.error("Invalid layout specified. Only 'wide' and 'long' are supported.")
+            sys.exit(1)
+        # Streaming each cycle to a consumer, next to or instead of the files
+        sink = self.config.get("destination", {}).get("sink", {})
+        self.sink_format = sink.get("format")
+        self.sink_target = str(sink.get("target", "-"))
+        self.sink_files = sink.get("files", True)
+        if self.sink_format not in [None, "ndjson", "arrow"]:
+            self.logger.error("Invalid destination.sink.format specified. Supported options are 'ndjson' and 'arrow'.")
+            sys.exit(1)
+        if self.float_dtype not in ["float64", "float32"]:
+            self.logger.error("Invalid float_dtype specified. Only 'float64' and 'float32' are supported.")
+            sys.exit(1)
 
         # Validations for query_mode and time_range
         self.query_mode = self.config.get("prometheus", {}).get("query_mode", "instant")
+        if self.query_mode == "range" and self.write_mode != "append":
+            # Rewriting the growing file after every collection window costs quadratic time over long ranges
+            if "write_mode" in self.config.get("destination", {}):
+                self.logger.info("Range collections are written window by window. Using write_mode 'append'.")
+            self.write_mode = "append"
 
         # Parse the prometheus.interval
         interval_str = self.config.get("prometheus", {}).get("interval")
@@ -79,6 +142,106 @@ class Config:
             self.logger.error(str(ve))
             sys.exit(1)
 
+        # What the instant-mode scheduler does when a cycle takes longer than the interval
+        self.overrun_policy = self.config["prometheus"].get("overrun_policy", "skip")
+        if self.overrun_policy not in ["skip", "catch_up", "concurrent"]:
+            self.logger.error("Invalid overrun_policy specified. Supported options are 'skip', 'catch_up' and 'concurrent'.")
+            sys.exit(1)
+        self.max_concurrent_cycles = self.config["prometheus"].get("max_concurrent_cycles", 2)
+
+        # HTTP transport settings for the Prometheus client
+        self.pool_size = self.config["prometheus"].get("pool_size", 10)
+        self.retries = self.config["prometheus"].get("retries", 3)
+        self.max_in_flight = self.config["prometheus"].get("max_in_flight", 8)
+        self.max_points_per_series = self.config["prometheus"].get("max_points_per_series", 11000)
+        # Load shedding: the in-flight limit adapts to the server's latency and overload responses
+        adaptive = self.config["prometheus"].get("adaptive_concurrency", {})
+        self.adaptive_concurrency = adaptive.get("enabled", True)
+        self.min_in_flight = adaptive.get("min_in_flight", 1)
+        try:
+            self.latency_target = self.parse_duration(str(adaptive.get("latency_target", "30s")))
+        except ValueError as ve:
+            self.logger.error(f"Error parsing prometheus.adaptive_concurrency.latency_target from config: {ve}")
+            sys.exit(1)
+        self.max_queries_per_cycle = self.config["prometheus"].get("max_queries_per_cycle", 0)
+        if not isinstance(self.max_queries_per_cycle, int) or self.max_queries_per_cycle < 0:
+            self.logger.error("Invalid max_queries_per_cycle specified. Use a positive number of requests, or 0 for no limit.")
+            sys.exit(1)
+        self.json_decoder = self.config["prometheus"].get("json_decoder")
+        if self.json_decoder not in [None, "ijson", "orjson", "json"]:
+            self.logger.error("Invalid json_decoder specified. Supported options are 'ijson', 'orjson' and 'json'.")
+            sys.exit(1)
+        timeout = self.config["prometheus"].get("timeout", {})
+        try:
+            self.connect_timeout = self.parse_duration(str(timeout.get("connect", "5s")))
+            self.read_timeout = self.parse_duration(str(timeout.get("read", "2m")))
+        except ValueError as ve:
+            self.logger.error(f"Error parsing prometheus.timeout from config: {ve}")
+            sys.exit(1)
+
+        # Range query result cache, stored under the destination path
+        cache = self.config["prometheus"].get("cache", {})
+        self.cache_enabled = cache.get("enabled", True)
+        self.cache_path = cache.get("path", os.path.join(self.destination_path, ".cache", "query_range"))
+        self.cache_max_size = cache.get("max_size_mb", 512) * 1024 * 1024
+        try:
+            self.cache_max_age = self.parse_duration(str(cache.get("max_age", "7d")))
+        except ValueError as ve:
+            self.logger.error(f"Error parsing prometheus.cache.max_age from config: {ve}")
+            sys.exit(1)
+        # Start of the data discovered from Prometheus when no start_time is configured, reused per URL
+        try:
+            self.time_range_max_age = self.parse_duration(str(cache.get("time_range_max_age", "1d")))
+        except ValueError as ve:
+            self.logger.error(f"Error parsing prometheus.cache.time_range_max_age from config: {ve}")
+            sys.exit(1)
+        # Parsed query sets and their query plan, reused while the query files are unchanged
+        self.query_set_cache_enabled = cache.get("query_sets", True)
+        self.query_set_cache_path = os.path.join(self.destination_path, ".cache", "query_sets")
+
+        # Self-instrumentation of the collector
+        instrumentation = self.config.get("instrumentation", {})
+        self.instrumentation_summary = instrumentation.get("summary", True)
+        self.metrics_port = instrumentation.get("metrics_port")
+        self.metrics_address = instrumentation.get("metrics_address", "127.0.0.1")
+        self.instrumentation_output = instrumentation.get("output")
+
+        # Range collections are written window by window and checkpointed after each one
+        checkpoint = self.config["prometheus"].get("checkpoint", {})
+        self.checkpoint_enabled = checkpoint.get("enabled", True)
+        try:
+            self.collection_window = self.parse_duration(str(checkpoint.get("window", "1d")))
+        except ValueError as ve:
+            self.logger.error(f"Error parsing prometheus.checkpoint.window from config: {ve}")
+            sys.exit(1)
+
+        # Several Prometheus clusters collected in one run, each by its own worker
+        self.clusters = []
+        for cluster in self.config["prometheus"].get("clusters") or []:
+            name = str(cluster.get("name", "")).strip()
+            if not name or not all(char.isalnum() or char in "-_." for char in name):
+                self.logger.error(f"Invalid cluster name '{name}'. Use letters, digits, '-', '_' and '.'.")
+                sys.exit(1)
+            if name in [known["name"] for known in self.clusters]:
+                self.logger.error(f"Duplicate cluster name '{name}' under prometheus.clusters.")
+                sys.exit(1)
+            # The token defaults to prometheus.token
+            token = cluster.get("token", self.config["prometheus"].get("token"))
+            if not cluster.get("url") or not token:
+                self.logger.error(f"Cluster '{name}' needs a 'url' and a 'token' (or a prometheus.token to fall back to).")
+                sys.exit(1)
+            self.clusters.append({"name": name, "url": cluster["url"], "token": token})
+        if not self.clusters and not self.config["prometheus"].get("url"):
+            self.logger.error("Either prometheus.url or prometheus.clusters is required.")
+            sys.exit(1)
+        self.cluster_output = self.config.get("destination", {}).get("cluster_output", "partition")
+        if self.cluster_output not in ["partition", "merged"]:
+            self.logger.error("Invalid cluster_output specified. Only 'partition' and 'merged' are supported.")
+            sys.exit(1)
+        if self.clusters and self.cluster_output == "merged" and self.write_mode != "append":
+            self.logger.info("Merged cluster output writes every cluster into shared files. Using write_mode 'append'.")
+            self.write_mode = "append"
+
         self.start_time = None
         self.end_time = None
 
@@ -113,6 +276,19 @@ class Config:
             self.output_format = self.args.output_format
         if self.args.interval:
             self.interval = self.parse_duration(self.args.interval)
+        if (self.args.resume or self.args.since_last) and (self.query_mode != "range" or not self.checkpoint_enabled):
+            self.logger.warning("--resume and --since-last only apply to range mode with checkpoints enabled. Ignoring.")
+        if self.args.metrics_port:
+            self.metrics_port = self.args.metrics_port
+        if self.args.metrics_address:
+            self.metrics_address = self.args.metrics_address
+        if self.args.no_cache:
+            self.cache_enabled = False
+            self.query_set_cache_enabled = False
+        if self.args.output_path and "path" not in self.config["prometheus"].get("cache", {}):
+            self.cache_path = os.path.join(self.destination_path, ".cache", "query_range")
+        if self.args.output_path:
+            self.query_set_cache_path = os.path.join(self.destination_path, ".cache", "query_sets")
         
         # Post-override validations
         if self.file_format not in ["csv", "parquet"]:
@@ -133,21 +309,41 @@ class Config:
         return self.args.filename
 
     def get_stats(self):
+        # Returns whether every file could be read, for the exit status
+        # Imported here so collection runs do not pay for loading pandas and pyarrow up front
+        from src.stats import FileStats, DatasetStats
+        path = self.get_filename_for_stats()
         try:
-            stats_obj = FileStats(self.get_filename_for_stats())
-            stats_obj.print_summary()
-        except FileNotFoundError:
-            self.logger.error(f"The file '{self.get_filename_for_stats()}' does not exist. Please provide a valid file path.")
+            if os.path.isfile(path) and not self.args.profile:
+                stats_obj = FileStats(path)
+                if self.args.json:
+                    print(json.dumps(stats_obj.summarize(), indent=2, default=str))
+                else:
+                    stats_obj.print_summary()
+                return True
+
+            # Directories and globs are profiled across worker processes into one report
+            dataset = DatasetStats(path, workers=self.args.workers, logger=self.logger)
+            self.logger.info(f"Profiling {len(dataset.files)} file(s) with {min(dataset.workers, len(dataset.files))} worker(s).")
+            report = dataset.profile()
+            if self.args.json:
+                dataset.print_json(report)
+            else:
+                dataset.print_report(report)
+            return not report["failed_files"]
+        except FileNotFoundError as e:
+            self.logger.error(f"{str(e)} Please provide a valid file path.")
         except Exception as e:
             self.logger.error(f"An error occurred: {str(e)}")
+        return False
 
     def parse_duration(self, duration_str):
-        multipliers = {'s': 1, 'm': 60, 'h': 3600}
+        multipliers = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
 
         if not duration_str:
             raise ValueError("Duration string cannot be empty or None")
 
-        # If the string is just a number (without s, m, h suffix), assume seconds
+        # If the string is just a number (without s, m, h, d suffix), assume seconds
         if duration_str.isdigit():
             return int(duration_str)
 
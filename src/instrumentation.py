@@ -0,0 +1,197 @@
+import time
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class Instrumentation:
+    # Collects the collector's own timings: per-query wall time, response size, series and sample counts,
+    # and the duration of each cycle stage (fetch, parse, commit, emit, write, cycle). Exposed as a summary
+    # table at the end of a run and, optionally, as a /metrics endpoint in Prometheus exposition format.
+    PREFIX = "metrics_collector"
+    STAGES = ("fetch", "parse", "commit", "emit", "write", "cycle")
+
+    def __init__(self, logger=None):
+        self.logger = logger if logger else logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.queries = {}
+        self.query_names = {}
+        self.stages = {}
+        self.skipped_cycles = 0
+        self.carried_queries = 0
+        self.last_cycle_timestamp = None
+        self.server = None
+
+    def register_query(self, expr, name):
+        # Queries are reported by the name of the first entry using them rather than by the full PromQL
+        self.query_names.setdefault(str(expr), name)
+
+    def get_query_name(self, expr):
+        return self.query_names.get(str(expr), str(expr))
+
+    def record_query(self, expr, seconds, response_bytes=0, series=0, samples=0, error=False):
+        with self.lock:
+            stats = self.queries.setdefault(str(expr), {"requests": 0, "errors": 0, "seconds": 0.0, "max_seconds": 0.0,
+                                                       "bytes": 0, "series": 0, "samples": 0})
+            stats["requests"] += 1
+            stats["seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+            if error:
+                stats["errors"] += 1
+                return
+            stats["bytes"] += response_bytes
+            stats["series"] = series
+            stats["samples"] += samples
+
+    def record_stage(self, stage, seconds):
+        with self.lock:
+            stats = self.stages.setdefault(stage, {"count": 0, "seconds": 0.0, "max_seconds": 0.0, "last_seconds": 0.0})
+            stats["count"] += 1
+            stats["seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+            stats["last_seconds"] = seconds
+            if stage == "cycle":
+                self.last_cycle_timestamp = time.time()
+
+    def record_skipped_cycles(self, count):
+        with self.lock:
+            self.skipped_cycles += count
+
+    def record_carried_queries(self, count):
+        with self.lock:
+            self.carried_queries += count
+
+    @contextmanager
+    def timer(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage(stage, time.perf_counter() - started)
+
+    def summary(self, limit=20):
+        with self.lock:
+            queries = sorted(self.queries.items(), key=lambda item: item[1]["seconds"], reverse=True)
+            stages = [(stage, dict(self.stages[stage])) for stage in self.STAGES if stage in self.stages]
+            skipped_cycles = self.skipped_cycles
+            carried_queries = self.carried_queries
+
+        lines = ["Collector timings by stage:",
+                 f"{'stage':<8} {'count':>6} {'total s':>10} {'avg s':>9} {'max s':>9}"]
+        for stage, stats in stages:
+            lines.append(f"{stage:<8} {stats['count']:>6} {stats['seconds']:>10.3f} "
+                         f"{stats['seconds'] / stats['count']:>9.3f} {stats['max_seconds']:>9.3f}")
+        if skipped_cycles:
+            lines.append(f"Skipped cycles: {skipped_cycles}")
+        if carried_queries:
+            lines.append(f"Query results carried forward: {carried_queries}")
+
+        lines.append(f"Slowest queries ({min(limit, len(queries))} of {len(queries)}):")
+        lines.append(f"{'query':<48} {'requests':>8} {'errors':>6} {'total s':>9} {'max s':>8} {'KiB':>9} {'series':>7} {'samples':>9}")
+        for expr, stats in queries[:limit]:
+            name = self.get_query_name(expr)
+            name = name if len(name) <= 48 else name[:45] + "..."
+            lines.append(f"{name:<48} {stats['requests']:>8} {stats['errors']:>6} {stats['seconds']:>9.3f} {stats['max_seconds']:>8.3f} "
+                         f"{stats['bytes'] / 1024:>9.1f} {stats['series']:>7} {stats['samples']:>9}")
+        return "\n".join(lines)
+
+    def log_summary(self):
+        if self.queries or self.stages:
+            self.logger.info(self.summary())
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "stages": {stage: dict(stats) for stage, stats in self.stages.items()},
+                "queries": {self.get_query_name(expr): dict(stats) for expr, stats in self.queries.items()},
+                "skipped_cycles": self.skipped_cycles,
+                "carried_queries": self.carried_queries,
+            }
+
+    def write_json(self, path):
+        # Machine-readable dump of the same measurements, e.g. for benchmark runs
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        self.logger.info(f"Wrote collector timings to {path}")
+
+    def escape(self, value):
+        return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+    def render(self):
+        # Prometheus text exposition format (version 0.0.4)
+        prefix = self.PREFIX
+        with self.lock:
+            queries = [(self.escape(self.get_query_name(expr)), dict(stats)) for expr, stats in self.queries.items()]
+            stages = [(stage, dict(stats)) for stage, stats in self.stages.items()]
+            skipped_cycles = self.skipped_cycles
+            carried_queries = self.carried_queries
+            last_cycle_timestamp = self.last_cycle_timestamp
+
+        lines = []
+        query_metrics = [
+            ("query_requests_total", "counter", "Requests sent to Prometheus per query.", "requests"),
+            ("query_errors_total", "counter", "Failed requests per query.", "errors"),
+            ("query_duration_seconds_total", "counter", "Wall time spent on each query, including retries.", "seconds"),
+            ("query_duration_seconds_max", "gauge", "Slowest single request per query.", "max_seconds"),
+            ("query_response_bytes_total", "counter", "Response body bytes received per query.", "bytes"),
+            ("query_series", "gauge", "Series returned by the latest result of each query.", "series"),
+            ("query_samples_total", "counter", "Samples received per query.", "samples"),
+        ]
+        for name, metric_type, help_text, field in query_metrics:
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {metric_type}")
+            for query_name, stats in queries:
+                lines.append(f"{prefix}_{name}{{query=\"{query_name}\"}} {stats[field]}")
+
+        lines.append(f"# HELP {prefix}_stage_duration_seconds Time spent in each stage of a collection cycle.")
+        lines.append(f"# TYPE {prefix}_stage_duration_seconds summary")
+        for stage, stats in stages:
+            lines.append(f"{prefix}_stage_duration_seconds_sum{{stage=\"{stage}\"}} {stats['seconds']}")
+            lines.append(f"{prefix}_stage_duration_seconds_count{{stage=\"{stage}\"}} {stats['count']}")
+        lines.append(f"# HELP {prefix}_stage_last_duration_seconds Duration of the latest run of each stage.")
+        lines.append(f"# TYPE {prefix}_stage_last_duration_seconds gauge")
+        for stage, stats in stages:
+            lines.append(f"{prefix}_stage_last_duration_seconds{{stage=\"{stage}\"}} {stats['last_seconds']}")
+
+        lines.append(f"# HELP {prefix}_skipped_cycles_total Scheduled cycles skipped because earlier cycles overran.")
+        lines.append(f"# TYPE {prefix}_skipped_cycles_total counter")
+        lines.append(f"{prefix}_skipped_cycles_total {skipped_cycles}")
+        lines.append(f"# HELP {prefix}_carried_queries_total Query results reused from an earlier cycle because the query was not due.")
+        lines.append(f"# TYPE {prefix}_carried_queries_total counter")
+        lines.append(f"{prefix}_carried_queries_total {carried_queries}")
+        if last_cycle_timestamp is not None:
+            lines.append(f"# HELP {prefix}_last_cycle_timestamp_seconds Unix time at which the latest cycle completed.")
+            lines.append(f"# TYPE {prefix}_last_cycle_timestamp_seconds gauge")
+            lines.append(f"{prefix}_last_cycle_timestamp_seconds {last_cycle_timestamp}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, address="127.0.0.1"):
+        # Only local scrapers reach the endpoint unless a wider address (e.g. 0.0.0.0) is given
+        instrumentation = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = instrumentation.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                instrumentation.logger.debug(f"/metrics request from {self.client_address[0]}: {format % args}")
+
+        self.server = ThreadingHTTPServer((address, port), MetricsHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="metrics-endpoint", daemon=True).start()
+        self.logger.info(f"Serving collector metrics at http://{address}:{port}/metrics")
+
+    def shutdown(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
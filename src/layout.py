@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+# Output written with destination.layout 'long' has one row per sample:
+#   run_id, timestamp, [cluster], node, metric, attribute, value
+# node, metric and attribute are dictionary encoded (pandas categoricals, Arrow dictionaries in Parquet).
+# node is the nodeN alias used by the wide layout and is null for cluster-level metrics; attribute is null
+# for metrics without attributes.
+LONG_CATEGORICAL_COLUMNS = ("run_id", "cluster", "node", "metric", "attribute")
+LONG_INDEX_COLUMNS = ("run_id", "timestamp", "cluster")
+
+def get_wide_name(node, metric, attribute):
+    # Same column names as the wide layout: per_node_per_attribute columns are named by node and attribute,
+    # per_node columns by node and metric, per_attribute columns by metric and attribute
+    if node is not None and attribute is not None:
+        return f"{node}_{attribute}"
+    if node is not None:
+        return f"{node}_{metric}"
+    if attribute is not None:
+        return f"{metric}_{attribute}"
+    return metric
+
+def to_wide(df):
+    # Pivot long-layout rows back to the wide layout: one row per timestamp (and run and cluster) and one
+    # column per node, metric and attribute, in the order the columns first appear. Boolean metrics come
+    # back as 0.0/1.0 floats.
+    parts = ["node", "metric", "attribute"]
+    # Name every distinct (node, metric, attribute) once rather than every row
+    groups = df.groupby(parts, observed=True, dropna=False, sort=False).ngroup().to_numpy()
+    first_rows = df.loc[~pd.Series(groups).duplicated().to_numpy(), parts].astype(object)
+    names = np.array([get_wide_name(*(None if pd.isna(part) else part for part in row))
+                      for row in first_rows.itertuples(index=False)], dtype=object)
+
+    index = [column for column in LONG_INDEX_COLUMNS if column in df.columns]
+    long_df = pd.DataFrame({column: df[column].astype(object) if column != "timestamp" else df[column] for column in index})
+    long_df["column"] = names[groups]
+    long_df["value"] = df["value"].to_numpy()
+    wide = long_df.pivot_table(index=index, columns="column", values="value", aggfunc="last", dropna=False)
+    wide = wide.reindex(columns=list(dict.fromkeys(names)))
+    wide.columns.name = None
+    return wide.reset_index()
+
+def read_wide(path, **kwargs):
+    # Read a long-layout Parquet or CSV file (or Parquet dataset directory) straight into the wide shape
+    if str(path).endswith(".csv"):
+        return to_wide(pd.read_csv(path, parse_dates=["timestamp"], **kwargs))
+    return to_wide(pd.read_parquet(path, **kwargs))
@@ -0,0 +1,117 @@
+import time
+import logging
+import threading
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class CycleAborted(Exception):
+    pass
+
+
+class QueryBudget:
+    # Gate on the requests of one collection cycle (or range window). It is a hard cap on the requests sent to
+    # Prometheus, retries and split range windows included; requests over the budget are never sent. Once
+    # Prometheus turns out to be unreachable the cycle is aborted and sends nothing more, and retries stop
+    # waiting as soon as the collector is stopping. A limit of 0 is unlimited.
+    def __init__(self, limit=0, stop_event=None):
+        self.limit = limit
+        self.spent = 0
+        self.refused = 0
+        self.stop_event = stop_event
+        # Why the cycle was aborted, if it was
+        self.aborted = None
+        self.lock = threading.Lock()
+
+    def spend(self):
+        with self.lock:
+            if self.aborted:
+                raise CycleAborted(self.aborted)
+            if self.limit and self.spent >= self.limit:
+                self.refused += 1
+                raise QueryBudgetExceeded(f"Query budget of {self.limit} requests per cycle exhausted")
+            self.spent += 1
+
+    def abort(self, reason):
+        with self.lock:
+            if not self.aborted:
+                self.aborted = reason
+
+    def stopping(self):
+        return self.stop_event is not None and self.stop_event.is_set()
+
+    def wait(self, delay):
+        # Backoff before a retry, cut short when the collector is stopping
+        if self.stop_event is not None:
+            self.stop_event.wait(delay)
+        else:
+            time.sleep(delay)
+
+
+class AdaptiveLimiter:
+    # AIMD control of the requests in flight toward one Prometheus. Every response slower than latency_target,
+    # every 429/503/504 and every read timeout halves the concurrency limit and spaces out the start of new
+    # requests; every other response raises the limit by 1/limit (about one per round trip of the whole limit)
+    # and shortens the spacing, up to max_limit with no spacing. Connection failures say nothing about the
+    # server's load and are left out. Requests that were already in flight when the limit was lowered do not
+    # lower it again.
+    def __init__(self, max_limit, min_limit=1, latency_target=30, decrease_factor=0.5, max_delay=10, logger=None):
+        self.max_limit = max(1, int(max_limit))
+        self.min_limit = max(1, min(int(min_limit), self.max_limit))
+        self.latency_target = latency_target
+        self.decrease_factor = decrease_factor
+        self.max_delay = max_delay
+        self.logger = logger if logger else logging.getLogger(__name__)
+        self.limit = float(self.max_limit)
+        self.in_flight = 0
+        # Minimum time between two request starts while backing off
+        self.delay = 0.0
+        self.next_start = 0.0
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        # Blocks until a request may be sent; returns its start time for release()
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.delay
+        if start > now:
+            time.sleep(start - now)
+        return time.monotonic()
+
+    def release(self, started, overloaded=False, measured=True):
+        # Requests that never reached Prometheus (measured False) free their slot without adjusting the limit
+        latency = time.monotonic() - started
+        with self.condition:
+            self.in_flight -= 1
+            if overloaded or (measured and latency > self.latency_target):
+                self.decrease(started, latency, overloaded)
+            elif measured:
+                self.increase()
+            self.condition.notify_all()
+
+    def decrease(self, started, latency, overloaded):
+        if started < self.last_decrease:
+            return
+        self.last_decrease = time.monotonic()
+        self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+        self.delay = min(self.max_delay, max(0.1, self.delay * 2))
+        reason = "an overload response" if overloaded else f"a {latency:.1f}s response"
+        self.logger.warning(f"Prometheus is under pressure ({reason}). Lowering concurrency to {int(self.limit)} "
+                            f"with {self.delay:.1f}s between requests.")
+
+    def increase(self):
+        if self.limit >= self.max_limit and not self.delay:
+            return
+        previous = int(self.limit)
+        self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        self.delay = self.delay / 2 if self.delay > 0.01 else 0.0
+        if int(self.limit) == self.max_limit and previous < self.max_limit:
+            self.logger.info(f"Prometheus recovered. Back to {self.max_limit} requests in flight.")
+        elif int(self.limit) > previous:
+            self.logger.debug(f"Raising concurrency to {int(self.limit)}.")
@@ -1,60 +1,154 @@
 import os
+import json
 import yaml
 import time
+import hashlib
 import inspect
-import pandas as pd
+import importlib
+import threading
+import numpy as np
 from datetime import datetime
+from src.query_executor import QueryExecutor
+from src.query_planner import QueryPlanner
+from src.scheduler import FixedRateScheduler
+from src.instrumentation import Instrumentation
+from src.checkpoint import Checkpoint
+from src.prometheus_api import PrometheusUnreachable
+from src.load_control import QueryBudget, QueryBudgetExceeded, CycleAborted
+
+# pandas and pyarrow dominate startup time, so they are only imported once a cycle's results are
+# assembled or written (see preload_output_modules). --validate never imports them.
+OUTPUT_MODULES = ("pandas", "src.writers", "src.layout")
+# Time range discovery looks back at most this far (seconds)
+MAX_DISCOVERY_HISTORY = 365 * 86400
+# libyaml's parser is several times faster than the pure Python one
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+class RangeSeries:
+    # Samples of one range column, kept as parallel timestamp and value arrays
+    def __init__(self, points):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        self.timestamps = points[:, 0]
+        self.values = points[:, 1]
+
+    def extend(self, points):
+        other = RangeSeries(points)
+        self.timestamps = np.concatenate([self.timestamps, other.timestamps])
+        self.values = np.concatenate([self.values, other.values])
 
 class MetricsProcessor:
     def __init__(self, prom_api, query_sets, query_mode, interval, logger, start_time=None, end_time=None,
-                 destination_path="data/collection", file_format="parquet", compression='snappy'):
+                 destination_path="data/collection", file_format="parquet", compression='snappy', max_in_flight=8,
+                 float_dtype="float64", write_mode="rewrite", rotation=None, partitioning="none",
+                 overrun_policy="skip", max_concurrent_cycles=2, instrumentation=None, log_summary=True,
+                 instrumentation_output=None, checkpoint_enabled=True, collection_window=86400, time_range_max_age=86400,
+                 resume=False, since_last=False, cluster=None, query_plan_from=None, writers=None, writers_lock=None,
+                 layout="wide", query_set_cache=None, max_queries_per_cycle=0, sink=None, sink_cluster=None, write_files=True):
         self.prom_api = prom_api
         self.logger = logger
+        self.executor = QueryExecutor(max_in_flight, logger)
+        # Requests sent to Prometheus per instant cycle or range window at most; 0 is unlimited
+        self.max_queries_per_cycle = max_queries_per_cycle
         self.destination_path = destination_path
         if not os.path.exists(self.destination_path):
             os.makedirs(self.destination_path)
-        self.query_sets = self.load_query_sets(query_sets)
-        self.df = pd.DataFrame()
+        self.df = None
         self.timestamp = time.strftime("%Y%m%d-%H%M%S")
         self.node_mapping = {}
         self.row_data = {}
+        self.column_parts = {}
+        # 'wide' writes one column per row_data key, 'long' one (timestamp, node, metric, attribute, value) row per sample
+        self.layout = layout
+        self.evaluation_time = None
+        self.cycle_timestamps = None
+        self.row_timestamps = None
         self.reset_row_data()
         self.logger.debug("MetricsProcessor initialized.")
         self.start_time = start_time
         self.end_time = end_time
         self.file_format = file_format
         self.compression = compression
+        self.float_dtype = np.dtype(float_dtype)
+        self.write_mode = write_mode
+        self.rotation = rotation
+        self.partitioning = partitioning
+        # Merged multi-cluster output shares the writers, and their lock, between the processors of all clusters
+        self.owns_writers = writers is None
+        self.writers = writers if writers is not None else {}
+        self.writers_lock = writers_lock if writers_lock else threading.Lock()
+        # Written as a 'cluster' column when set
+        self.cluster = cluster
+        # Optional StreamSink receiving every cycle's rows; write_files False only streams
+        self.sink = sink
+        self.sink_cluster = sink_cluster
+        self.write_files = write_files
+        self.stopping = threading.Event()
+        self.overrun_policy = overrun_policy
+        self.max_concurrent_cycles = max_concurrent_cycles
+        self.cycle_lock = threading.Lock()
+        self.instrumentation = instrumentation if instrumentation else Instrumentation(logger)
+        self.log_summary = log_summary
+        self.instrumentation_output = instrumentation_output
         self.query_mode = query_mode
         self.interval = interval
+        # Range collections are fetched and written in windows of this length
+        self.collection_window = collection_window
+        self.time_range_max_age = time_range_max_age
+        self.resume = resume
+        self.since_last = since_last
+        self.checkpoint = None
+        # Windows of the previous run with failed queries, collected again by --resume and --since-last
+        self.retry_windows = []
+        # Output files written by the range window in progress
+        self.window_files = set()
+        # Last successful result of each query with an 'every' cadence, as (evaluation time, result)
+        self.carried_results = {}
+        # Overlapping instant cycles fetch concurrently and share the carried results
+        self.carried_lock = threading.Lock()
+
+        self.query_planner = QueryPlanner(self.logger)
+        self.query_set_cache = query_set_cache
+        if query_plan_from:
+            # Clusters collected in one run load the query sets and build the plan only once
+            self.query_sets = query_plan_from.query_sets
+            self.query_plan = self.bind_query_plan(query_plan_from.query_plan)
+        else:
+            self.query_sets, self.query_plan = self.compile_query_sets(query_sets)
+        self.register_query_names()
 
         if self.query_mode == 'range':
-            self.start_time, self.end_time = self.get_time_range_from_prometheus()
+            if checkpoint_enabled:
+                # The leading underscore keeps dataset readers (pyarrow, Spark) from taking the checkpoint for data
+                checkpoint_name = f"_metrics_combined.{self.cluster}.checkpoint.json" if self.cluster else "_metrics_combined.checkpoint.json"
+                self.checkpoint = Checkpoint(os.path.join(self.destination_path, checkpoint_name),
+                                             self.prom_api.url, Checkpoint.get_fingerprint(self.query_plan["queries"]),
+                                             self.interval, self.logger)
+            self.start_time, self.end_time = self.get_time_range()
             if not self.start_time or not self.end_time:
                 raise Exception("Could not determine time range from Prometheus")
         else:
             self.start_time = None
             self.end_time = None
 
-
     def load_query_sets(self, query_sets):
         loaded_query_sets = {"features": [], "labels": []}
         for query_set in query_sets:
             if "features" in query_set:
                 for query_file in query_set["features"]:
                     with open(query_file, "r") as f:
-                        loaded_query_sets["features"].extend(yaml.safe_load(f))
+                        loaded_query_sets["features"].extend(yaml.load(f, Loader=YAML_LOADER))
             if "labels" in query_set:
                 for query_file in query_set["labels"]:
                     with open(query_file, "r") as f:
-                        loaded_query_sets["labels"].extend(yaml.safe_load(f))
+                        loaded_query_sets["labels"].extend(yaml.load(f, Loader=YAML_LOADER))
         self.logger.debug(f"Loaded query sets: {loaded_query_sets}")
         return loaded_query_sets
 
     def reset_row_data(self):
         self.row_data={"run_id":self.timestamp}
 
-    def fetch_metrics(self, metric):
-        self.logger.info(f"Validating entry format.")
+    def validate_entry(self, metric):
+        # An entry needs the name, type and expr keys
         try:
             if metric.get("name") is None:
                 raise Exception(f"Missing the 'name' key",f"{metric}")
@@ -62,94 +156,281 @@ class MetricsProcessor:
                 raise Exception(f"Entry '{metric['name']}' missing the 'type' key")        
             if metric.get("expr") is None:
                 raise Exception(f"Entry '{metric['name']}' missing the 'expr' key")    
+            cadence = self.get_cadence(metric)
+            if cadence is not None and cadence <= 0:
+                raise Exception(f"Entry '{metric['name']}' has a non-positive 'every' value")
         except Exception as e:
-            self.logger.error(f"[{inspect.stack()[0][3]}] Invalid entry. {str(e)}")
+            self.logger.error(f"[{inspect.stack()[1][3]}] Invalid entry. {str(e)}")
+            return False
+        return True
+
+    def get_handler(self, metric):
+        if metric["type"] == "scalar":
+            return self.process_scalar_metrics
+        elif metric["type"] == "boolean":
+            return self.process_boolean_metrics
+        elif metric["type"] == "boolean_per_node":
+            return self.process_boolean_per_node_metrics
+        elif metric["type"] == "scalar_per_attribute":
+            return self.process_scalar_per_attribute_metrics
+        # NOTE: These need to be at the end of the elif
+        elif metric["type"].endswith("per_node"):
+            return self.process_per_node_metrics
+        elif metric["type"].endswith("per_node_per_attribute"):
+            return self.process_per_node_per_attribute_metrics
+        return None
+
+    def get_query_kind(self, metric):
+        # Boolean handlers always evaluate an instant vector, even in range mode
+        if metric["type"] in ("boolean", "boolean_per_node"):
+            return "instant"
+        if self.query_mode == "range":
+            return "range"
+        # per_node_per_attribute is only collected in range mode
+        if metric["type"].endswith("per_node_per_attribute"):
             return None
-        
-        self.logger.info(f"Validating queries.")
-        try:
-            if self.query_mode == 'range':
-                result = self.prom_api.query_range(metric["expr"], start=self.start_time, end=self.end_time)
-                if result and result[0].get("values"):
-                    values = result[0]["values"]
-                    self.logger.info(f"Fetched data for {metric['name']}: {values[0]}")
-                    return values[0][1]
-                else:
-                    self.logger.warning(f"No data returned for metric {metric['name']} in range mode.")
-            else:
-                result = self.prom_api.query(metric["expr"])
-                if result and result[0].get("value"):
-                    value = result[0]["value"]
-                    self.logger.info(f"Fetched data for {metric['name']}: {value}")
-                    return value[1]
-                else:
-                    self.logger.warning(f"No data returned for metric {metric['name']} in instant mode.")
-        except Exception as e:
-            self.logger.error(f"[{inspect.stack()[0][3]}] Failed to fetch data for metric {metric['name']} due to {str(e)}")
+        return "instant"
+
+    def get_cadence(self, metric):
+        # Seconds between two fetches of an entry with an 'every' key (e.g. '1h'); None runs it every cycle.
+        # Range collections fetch every query for every window.
+        if metric.get("every") is None or self.query_mode == "range":
             return None
+        try:
+            return self.prom_api.parse_step(metric["every"])
+        except ValueError:
+            raise Exception(f"Entry '{metric['name']}' has an invalid 'every' value: {metric['every']}")
 
-    def process_metrics(self, skill_name):
-        for metric in self.query_sets[skill_name]:
-            # validate the entry has the required keys
-            self.logger.debug(f"Validating entry format for {metric}")
-            try:
-                if metric.get("name") is None:
-                    raise Exception(f"Missing the 'name' key",f"{metric}")
-                if metric.get("type") is None:
-                    raise Exception(f"Entry '{metric['name']}' missing the 'type' key")        
-                if metric.get("expr") is None:
-                    raise Exception(f"Entry '{metric['name']}' missing the 'expr' key")    
-            except Exception as e:
-                self.logger.error(f"[{inspect.stack()[0][3]}] Invalid entry. {str(e)}")
-                return None
+    def fetch_query(self, query, evaluation_time=None, window=None, budget=None):
+        if query["kind"] == "range":
+            start, end = window if window else (self.start_time, self.end_time)
+            return self.prom_api.query_range(query["expr"], start=start, end=end, step=query["step"], budget=budget)
+        return self.prom_api.query(query["expr"], evaluation_time=evaluation_time, budget=budget)
+
+    def build_query_plan(self, skill_names=("features", "labels")):
+        entries = []
+        for skill_name in skill_names:
+            for metric in self.query_sets[skill_name]:
+                # validate the entry has the required keys
+                if not self.validate_entry(metric):
+                    break
+
+                handler = self.get_handler(metric)
+                kind = self.get_query_kind(metric)
+                if handler is None or kind is None:
+                    self.logger.debug(f"Skipping metric: {metric['name']}, type: {metric['type']}")
+                    continue
+                step = self.interval if kind == "range" else None
+                entries.append((metric, handler, kind, step))
+
+        plan = self.query_planner.plan(entries)
+        # Each unique query is named after the first entry using it
+        cadences = {}
+        for metric, handler, query_index, comparison in plan["entries"]:
+            plan["queries"][query_index].setdefault("name", metric["name"])
+            cadences.setdefault(query_index, []).append(self.get_cadence(metric))
+        # A query shared by entries with different cadences runs at the fastest of them
+        for query_index, query_cadences in cadences.items():
+            plan["queries"][query_index]["every"] = None if None in query_cadences else min(query_cadences)
+        return plan
+
+    def bind_query_plan(self, plan):
+        # Plans shared by another processor or read from the cache refer to their handlers by name
+        entries = [(metric, getattr(self, handler if isinstance(handler, str) else handler.__name__), query_index, comparison)
+                   for metric, handler, query_index, comparison in plan["entries"]]
+        return {"queries": plan["queries"], "entries": entries}
+
+    def register_query_names(self):
+        for metric, handler, query_index, comparison in self.query_plan["entries"]:
+            self.instrumentation.register_query(self.query_plan["queries"][query_index]["expr"], metric["name"])
+
+    def get_query_set_key(self, query_sets):
+        # Keyed by the content of every query file and of the code validating and planning them, so an edited
+        # query set or an upgraded collector never picks up a stale plan
+        paths = [inspect.getsourcefile(QueryPlanner), __file__]
+        paths += [query_file for query_set in query_sets for skill_name in ("features", "labels") for query_file in query_set.get(skill_name, [])]
+        parts = [self.query_mode, self.interval]
+        for path in paths:
+            with open(path, "rb") as f:
+                parts.extend([os.path.abspath(path), hashlib.sha256(f.read()).hexdigest()])
+        return self.query_set_cache.get_key(*parts)
+
+    def compile_query_sets(self, query_sets):
+        # Parsing, validating and planning the query sets is skipped while their files are unchanged
+        key = self.get_query_set_key(query_sets) if self.query_set_cache else None
+        compiled = self.query_set_cache.get(key) if key else None
+        if compiled:
+            self.logger.debug(f"Loaded the compiled query sets from the cache.")
+            # The cache stores JSON, which has no tuples; comparisons are (op, threshold) pairs used as dict keys
+            plan = compiled["query_plan"]
+            for query in plan["queries"]:
+                query["comparisons"] = [tuple(comparison) for comparison in query["comparisons"]]
+            plan["entries"] = [(metric, handler, query_index, tuple(comparison) if comparison else None)
+                               for metric, handler, query_index, comparison in plan["entries"]]
+            return compiled["query_sets"], self.bind_query_plan(plan)
+
+        self.query_sets = self.load_query_sets(query_sets)
+        query_plan = self.build_query_plan()
+        if key:
+            # Bound handlers cannot be stored; keep their names
+            entries = [(metric, handler.__name__, query_index, comparison) for metric, handler, query_index, comparison in query_plan["entries"]]
+            self.query_set_cache.put(key, {"query_sets": self.query_sets, "query_plan": {"queries": query_plan["queries"], "entries": entries}})
+        return self.query_sets, query_plan
+
+    def get_due_queries(self, evaluation_time, window=None):
+        # A query with a cadence is due on the first cycle of each of its periods, counted from the epoch, so a
+        # cycle starting a second late does not push it back by a whole interval. Range windows fetch every
+        # range query, but the instant queries of a range collection are evaluated once and reused by every window.
+        due = []
+        with self.carried_lock:
+            for query_index, query in enumerate(self.query_plan["queries"]):
+                last = self.carried_results.get(query_index)
+                if window:
+                    if query["kind"] == "range" or last is None:
+                        due.append(query_index)
+                elif not query.get("every") or last is None or evaluation_time // query["every"] != last[0] // query["every"]:
+                    due.append(query_index)
+        return due
+
+    def is_carried(self, query, window=None):
+        # Whether the query's last successful result is kept for later cycles or windows
+        return bool(query.get("every")) or (window is not None and query["kind"] != "range")
+
+    def fetch_results(self, evaluation_time, window=None):
+        # Fetch every unique query concurrently. All instant queries of a cycle are evaluated at the same timestamp.
+        # Instant cycles only fetch the queries that are due and carry the last result of the others forward.
+        # Queries are sent in query-set order; once the cycle's query budget is spent, the remaining ones are
+        # shed and fall back to their carried result when they have one. A Prometheus that refuses the connection
+        # ends the cycle: its remaining queries are not sent.
+        queries = self.query_plan["queries"]
+        due = self.get_due_queries(evaluation_time, window)
+        budget = QueryBudget(self.max_queries_per_cycle, self.stopping)
+        fetched = dict(zip(due, self.executor.map(lambda query_index: self.fetch_query(queries[query_index], evaluation_time, window, budget), due)))
+        results = []
+        with self.carried_lock:
+            for query_index, query in enumerate(queries):
+                if query_index not in fetched:
+                    results.append((self.carried_results[query_index][1], None))
+                    continue
+                result, error = fetched[query_index]
+                if isinstance(error, QueryBudgetExceeded) and query_index in self.carried_results:
+                    results.append((self.carried_results[query_index][1], None))
+                    continue
+                # A failed query stays due; overlapping cycles never replace a result with an older one
+                last = self.carried_results.get(query_index)
+                if error is None and self.is_carried(query, window) and (last is None or last[0] <= evaluation_time):
+                    self.carried_results[query_index] = (evaluation_time, result)
+                results.append((result, error))
+        if len(due) < len(queries):
+            self.logger.debug(f"Fetched {len(due)} of {len(queries)} queries; the others are carried forward.")
+            self.instrumentation.record_carried_queries(len(queries) - len(due))
+        if budget.refused:
+            shed = sum(isinstance(error, QueryBudgetExceeded) for result, error in fetched.values())
+            self.logger.warning(f"The query budget of {budget.limit} requests per cycle was exhausted: {shed} queries were not sent.")
+        if budget.aborted:
+            failed = sum(isinstance(error, (PrometheusUnreachable, CycleAborted)) for result, error in fetched.values())
+            self.logger.warning(f"{budget.aborted}. Ending the cycle: {failed} queries failed or were not sent.")
 
+        # Threshold families share one fetched base vector; evaluate all their comparisons locally
+        evaluated = {}
+        for query_index, (query, (result, error)) in enumerate(zip(queries, results)):
+            if query["comparisons"] and error is None:
+                for comparison, derived in self.query_planner.evaluate_comparisons(result, query["comparisons"]).items():
+                    evaluated[(query_index, comparison)] = derived
+        return results, evaluated
+
+    def dispatch_results(self, results, evaluated):
+        # Parse in query-set order so that row_data columns and node numbering stay deterministic
+        for metric, handler, query_index, comparison in self.query_plan["entries"]:
+            result, error = results[query_index]
+            if isinstance(error, QueryBudgetExceeded):
+                self.logger.debug(f"Skipping {metric['name']}: its query was shed by the query budget.")
+                continue
+            if isinstance(error, (PrometheusUnreachable, CycleAborted)):
+                self.logger.debug(f"Skipping {metric['name']}: Prometheus is unreachable.")
+                continue
+            if error is not None:
+                self.logger.error(f"[{handler.__name__}] Failed to fetch data for {metric['name']} with query {metric['expr']} due to {str(error)}")
+                continue
+            if comparison is not None:
+                result = evaluated[(query_index, comparison)]
             self.logger.debug(f"Processing metric: {metric['name']}, type: {metric['type']}")
-            if metric["type"] == "scalar":
-                self.process_scalar_metrics(metric)
-            elif metric["type"] == "boolean":
-                self.process_boolean_metrics(metric)
-            elif metric["type"] == "boolean_per_node":
-                self.process_boolean_per_node_metrics(metric)
-            elif metric["type"] == "scalar_per_attribute":
-                self.process_scalar_per_attribute_metrics(metric)
-            # NOTE: These need to be at the end of the elif
-            elif metric["type"].endswith("per_node"):
-                self.process_per_node_metrics(metric)
-            elif metric["type"].endswith("per_node_per_attribute"):
-                self.process_per_node_per_attribute_metrics(metric)
-
-    def process_per_node_per_attribute_metrics(self, metric):
+            handler(metric, result)
+
+    def process_metrics(self, evaluation_time=None, window=None):
+        self.evaluation_time = evaluation_time if evaluation_time is not None else round(time.time())
+        with self.instrumentation.timer("fetch"):
+            results, evaluated = self.fetch_results(self.evaluation_time, window)
+        with self.instrumentation.timer("parse"):
+            self.dispatch_results(results, evaluated)
+        return results
+
+    def commit_and_save(self, collection):
+        with self.instrumentation.timer("commit"):
+            df = self.commit_to_memory()
+        if self.sink:
+            with self.instrumentation.timer("emit"):
+                self.emit(df)
+        if self.write_files:
+            with self.instrumentation.timer("write"):
+                self.save(collection)
+
+    def emit(self, df):
+        # Clusters sharing a sink are told apart by a cluster column, even when their files are partitioned
+        if self.sink_cluster is not None and "cluster" not in df.columns:
+            import pandas as pd
+            cluster = pd.Series(np.full(len(df), self.sink_cluster, dtype=object), index=df.index, name="cluster")
+            df = pd.concat([df.iloc[:, :2], cluster, df.iloc[:, 2:]], axis=1, copy=False)
+        self.sink.emit(df)
+
+    def run_cycle(self, evaluation_time):
+        # Fetching only shares the carried results, under their own lock, so overlapping cycles serialize
+        # parsing and writing but not fetching
+        with self.instrumentation.timer("cycle"):
+            with self.instrumentation.timer("fetch"):
+                results, evaluated = self.fetch_results(evaluation_time)
+            with self.cycle_lock:
+                self.evaluation_time = evaluation_time
+                self.reset_row_data() # reset array to prevent data leaking between runs
+                with self.instrumentation.timer("parse"):
+                    self.dispatch_results(results, evaluated)
+                self.commit_and_save("combined")
+        self.logger.info(f"Processing completed for the cycle at {datetime.fromtimestamp(evaluation_time)}.")
+
+    def process_per_node_per_attribute_metrics(self, metric, result):
         self.logger.debug(f"Processing per_node_per_attribute metrics for {metric['name']}.")
         try:
             if self.query_mode == "range":
-                results = self.prom_api.query_range(metric["expr"], start=self.start_time, end=self.end_time, step=self.interval)
-                for item in results:
+                for item in result:
                     node_name = self.get_node_map(item['metric']['node'])
                     attribute_values = []
 
                     for attribute, value in item['metric'].items():
                         if attribute == "":
                             continue
-                    # Exclude 'node' attribute because we already consider node in row_data key
-                    if attribute != 'node':
-                        value = value.replace('-','_').replace('.','_')
-                        attribute_values.append(value)
-                # Join all attribute values with underscore to create final attribute name
-                attribute_key = '_'.join(attribute_values) if attribute_values else 'default'
-                              
-                self.row_data[f"{node_name}_{attribute_key}"] = item['value'][1]
+                        # Exclude 'node' attribute because we already consider node in row_data key
+                        if attribute != 'node':
+                            value = value.replace('-','_').replace('.','_')
+                            attribute_values.append(value)
+                    # Join all attribute values with underscore to create final attribute name
+                    attribute_key = '_'.join(attribute_values) if attribute_values else 'default'
+
+                    # Wide columns of this type are named without the metric, so entries with the same attribute
+                    # values share a column; the long layout keeps the metrics apart
+                    key = f"{node_name}_{metric['name']}_{attribute_key}" if self.layout == "long" else f"{node_name}_{attribute_key}"
+                    self.describe_column(key, node_name, metric["name"], attribute_key)
+                    self.add_range_series(key, item['values'])
         except Exception as e:
             self.logger.error(f"[{inspect.stack()[0][3]}] Failed to fetch data for query {metric['expr']} due to {str(e)}")
 
-    def process_scalar_metrics(self, metric):
+    def process_scalar_metrics(self, metric, result):
         self.logger.debug(f"Processing scalar metrics for {metric['name']}.")
+        self.describe_column(metric["name"], metric=metric["name"])
         try:
             if self.query_mode == "range":
-                results = self.prom_api.query_range(metric["expr"], start=self.start_time, end=self.end_time, step=self.interval)
-                values = [point[1] for series in results for point in series['values']]
-                self.row_data[metric["name"]] = values
+                for series in result:
+                    self.add_range_series(metric["name"], series['values'])
             else:
-                result = self.prom_api.query(metric["expr"])
                 if result:
                     value = result[0]["value"][1]
                     self.row_data[metric["name"]] = value
@@ -159,41 +440,47 @@ class MetricsProcessor:
     def get_node_map(self, node_name):
         return self.node_mapping.setdefault(node_name,"node"+str(len(self.node_mapping)+1))
 
-    def process_per_node_metrics(self, metric):
+    def describe_column(self, key, node=None, metric=None, attribute=None):
+        # The node, metric and attribute a wide column is named after; they become the rows of the long layout
+        self.column_parts.setdefault(key, (node, metric, attribute))
+
+    def add_range_series(self, key, points):
+        # Keep sample timestamps so commit_to_memory can align series by time rather than position
+        if key in self.row_data:
+            self.row_data[key].extend(points)
+        else:
+            self.row_data[key] = RangeSeries(points)
+
+    def process_per_node_metrics(self, metric, result):
         self.logger.debug(f"Processing per_node metrics for {metric['name']}.")
         try:
             if self.query_mode == "range":
-                results = self.prom_api.query_range(metric["expr"], start=self.start_time, end=self.end_time, step=self.interval)
-                
-                for item in results:
+                for item in result:
                     if item['metric']['node'] == "":
                         continue
 
-                    node_key = f"{self.get_node_map(item['metric']['node'])}_{metric['name']}"
+                    node_name = self.get_node_map(item['metric']['node'])
+                    node_key = f"{node_name}_{metric['name']}"
+                    self.describe_column(node_key, node_name, metric["name"])
 
-                    # Extract values from the range results
-                    values = [point[1] for point in item['values']]
-                    if node_key in self.row_data:
-                        self.row_data[node_key].extend(values)
-                    else:
-                        self.row_data[node_key] = values
+                    self.add_range_series(node_key, item['values'])
 
             else:
-                result = self.prom_api.query(metric["expr"])
                 for item in result:
                     if item['metric']['node'] == "":
                         continue
 
-                    node_key = f"{self.get_node_map(item['metric']['node'])}_{metric['name']}"
+                    node_name = self.get_node_map(item['metric']['node'])
+                    node_key = f"{node_name}_{metric['name']}"
+                    self.describe_column(node_key, node_name, metric["name"])
                     self.row_data[node_key] = item['value'][1]
 
         except Exception as e:
             self.logger.error(f"[{inspect.stack()[0][3]}] Failed to fetch data for {metric['name']} with query {metric['expr']} due to {str(e)}")
 
-    def process_boolean_per_node_metrics(self, metric):
+    def process_boolean_per_node_metrics(self, metric, result):
         self.logger.debug(f"Processing boolean_per_node metrics for {metric['name']}.")
         try:
-            result = self.prom_api.query(metric['expr'])
             for item in result:
                 # skip if empty node entry
                 if item['metric']['node'] == "":
@@ -201,27 +488,26 @@ class MetricsProcessor:
                 node_name = self.get_node_map(item['metric']['node'])
                 metric_name = metric['name']
                 value = result[0]["value"][1]
+                self.describe_column(f"{node_name}_{metric_name}", node_name, metric_name)
                 self.row_data[f"{node_name}_{metric_name}"] = False if value == '0' else True
         except Exception as e:
             self.logger.error(f"[{inspect.stack()[0][3]}] Failed to fetch data for {metric['name']} with query {metric['expr']} due to {str(e)}")
 
-    def process_boolean_metrics(self, metric):
+    def process_boolean_metrics(self, metric, result):
         self.logger.debug(f"Processing boolean metrics for {metric['name']}.")
+        self.describe_column(metric["name"], metric=metric["name"])
         try:
-            result = self.prom_api.query(metric["expr"])
             if result:
                 value = result[0]["value"][1]
                 self.row_data[metric["name"]] = False if value == '0' else True
         except Exception as e:
             self.logger.error(f"[{inspect.stack()[0][3]}] Failed to fetch data for query {metric['expr']} due to {str(e)}")
 
-    def process_scalar_per_attribute_metrics(self, metric):
+    def process_scalar_per_attribute_metrics(self, metric, result):
         self.logger.debug(f"Processing scalar_per_attribute metrics for {metric['name']}.")
         try:
             if self.query_mode == "range":
-                results = self.prom_api.query_range(metric["expr"], start=self.start_time, end=self.end_time, step=self.interval)
-
-                for item in results:
+                for item in result:
                     attribute_values = []
 
                     for attribute, value in item['metric'].items():
@@ -231,17 +517,11 @@ class MetricsProcessor:
                     # Join all attribute values with underscore to create final attribute key
                     attribute_key = '_'.join(attribute_values) if attribute_values else 'default'
                     metric_key = f"{metric['name']}_{attribute_key}"
+                    self.describe_column(metric_key, metric=metric["name"], attribute=attribute_key)
 
-                    # Extract values from the range results
-                    values = [point[1] for point in item['values']]
-                    if metric_key in self.row_data:
-                        self.row_data[metric_key].extend(values)
-                    else:
-                        self.row_data[metric_key] = values
+                    self.add_range_series(metric_key, item['values'])
 
             else:
-                result = self.prom_api.query(metric["expr"])
-
                 for item in result:
                     attribute_values = []
 
@@ -252,35 +532,128 @@ class MetricsProcessor:
                     # Join all attribute values with underscore to create final attribute key
                     attribute_key = '_'.join(attribute_values) if attribute_values else 'default'
                     metric_key = f"{metric['name']}_{attribute_key}"
+                    self.describe_column(metric_key, metric=metric["name"], attribute=attribute_key)
                     self.row_data[metric_key] = item['value'][1]
 
         except Exception as e:
             self.logger.error(f"[{inspect.stack()[0][3]}] Failed to fetch data for {metric['name']} with query {metric['expr']} due to {str(e)}")
 
     
+    def parse_samples(self, values):
+        # Prometheus encodes sample values as strings ("1.5", "NaN", "+Inf"); parse them in one pass
+        try:
+            return np.asarray(values, dtype=self.float_dtype)
+        except (TypeError, ValueError):
+            return None
+
+    def align_timestamps(self, timestamps):
+        # Snap range timestamps onto the step grid of the query window so float noise cannot split a row
+        if self.query_mode != "range":
+            return timestamps
+        start = round(self.start_time.timestamp())
+        return start + np.round((timestamps - start) / self.interval) * self.interval
+
+    def build_time_index(self):
+        series = [value for value in self.row_data.values() if isinstance(value, RangeSeries)]
+        if not series:
+            return np.array([self.evaluation_time if self.evaluation_time is not None else round(time.time())], dtype=np.float64)
+        return np.unique(self.align_timestamps(np.concatenate([value.timestamps for value in series])))
+
+    def build_column(self, value, time_index):
+        length = len(time_index)
+        if isinstance(value, RangeSeries):
+            # Outer join onto the shared time index; timestamps a series does not cover stay NaN
+            column = np.full(length, np.nan, dtype=self.float_dtype)
+            column[np.searchsorted(time_index, self.align_timestamps(value.timestamps))] = value.values
+            return column
+
+        if isinstance(value, bool):
+            return np.full(length, value, dtype=bool)
+
+        sample = self.parse_samples(value) if isinstance(value, str) else None
+        if sample is None:
+            return np.full(length, value, dtype=object)
+        return np.full(length, sample, dtype=self.float_dtype)
+
     def commit_to_memory(self):
+        import pandas as pd
+        from src.layout import LONG_CATEGORICAL_COLUMNS
         self.logger.debug(f"Saving data to DataFrame.")
 
-        # Convert row_data to a list of dictionaries for DataFrame conversion
-        data = []
-        keys = self.row_data.keys()
-        max_len = max(len(v) if isinstance(v, list) else 1 for v in self.row_data.values())
-        
-        for i in range(max_len):
-            row = {}
-            for key in keys:
-                val = self.row_data[key]
-                if isinstance(val, list):
-                    row[key] = val[i] if i < len(val) else None  # use None if index exceeds list length
-                else:
-                    row[key] = val
-            data.append(row)
+        # Assemble row_data directly into typed columns: range series are joined on one sorted
+        # time index and instant values are broadcast across it
+        time_index = self.build_time_index()
+        self.cycle_timestamps = time_index
+        if self.layout == "long":
+            df = self.build_long_frame(time_index)
+        else:
+            columns = {}
+            for key, value in self.row_data.items():
+                columns[key] = self.build_column(value, time_index)
+                if key == "run_id":
+                    columns["timestamp"] = pd.to_datetime(time_index, unit="s", utc=True)
+                    if self.cluster:
+                        columns["cluster"] = np.full(len(time_index), self.cluster, dtype=object)
+            self.row_timestamps = time_index
+            df = pd.DataFrame(columns, copy=False)
 
-        df = pd.DataFrame(data)
-        self.df = pd.concat([self.df, df])
+        if self.write_mode == "append" or not self.write_files:
+            # Appending writers persist every cycle and a sink-only run writes no file, so no history is kept in memory
+            self.df = df
+        elif self.layout == "long":
+            # Concatenating frames with different categories falls back to strings; encode them again
+            self.df = pd.concat([self.df, df], ignore_index=True)
+            for column in LONG_CATEGORICAL_COLUMNS:
+                if column in self.df:
+                    self.df[column] = self.df[column].astype("category")
+        else:
+            self.df = pd.concat([self.df, df])
 
         self.logger.debug(f"Appended {df.shape} DataFrame to class. Shape in memory {self.df.shape}")
+        return df
+
+    def build_long_frame(self, time_index):
+        # One row per sample instead of one column per key. Range series contribute only the samples they
+        # have, so missing points cost nothing, and the schema does not change when nodes come and go.
+        # Instant values are broadcast over the time index exactly like their wide columns.
+        import pandas as pd
+        keys = [key for key in self.row_data if key != "run_id"]
+        timestamps, values, key_codes = [], [], []
+        for code, key in enumerate(keys):
+            value = self.row_data[key]
+            if isinstance(value, RangeSeries):
+                key_timestamps, key_values = self.align_timestamps(value.timestamps), value.values
+            else:
+                key_timestamps, key_values = time_index, self.build_column(value, time_index)
+                if key_values.dtype == object:
+                    key_values = pd.to_numeric(key_values, errors="coerce")
+            timestamps.append(key_timestamps)
+            values.append(np.asarray(key_values, dtype=self.float_dtype))
+            key_codes.append(np.full(len(key_timestamps), code, dtype=np.int32))
+        timestamps = np.concatenate(timestamps) if keys else np.empty(0, dtype=np.float64)
+        values = np.concatenate(values) if keys else np.empty(0, dtype=self.float_dtype)
+        key_codes = np.concatenate(key_codes) if keys else np.empty(0, dtype=np.int32)
+
+        # Rows in time order, so time-partitioned writers receive contiguous slices
+        order = np.argsort(timestamps, kind="stable")
+        timestamps, values, key_codes = timestamps[order], values[order], key_codes[order]
 
+        # Dictionary-encode node, metric and attribute: every key maps to one code per column
+        columns = {"run_id": pd.Categorical.from_codes(np.zeros(len(timestamps), dtype=np.int8), [self.timestamp]),
+                   "timestamp": pd.to_datetime(timestamps, unit="s", utc=True)}
+        if self.cluster:
+            columns["cluster"] = pd.Categorical.from_codes(np.zeros(len(timestamps), dtype=np.int8), [self.cluster])
+        parts = [self.column_parts.get(key, (None, key, None)) for key in keys]
+        for position, column in enumerate(("node", "metric", "attribute")):
+            labels = [part[position] for part in parts]
+            categories = list(dict.fromkeys(label for label in labels if label is not None))
+            lookup = {label: code for code, label in enumerate(categories)}
+            codes = np.array([lookup.get(label, -1) for label in labels], dtype=np.int32)
+            columns[column] = pd.Categorical.from_codes(codes[key_codes] if keys else key_codes, categories)
+        columns["value"] = values
+
+        self.row_timestamps = timestamps
+        return pd.DataFrame(columns, copy=False)
 
     def save_to_parquet(self, collection):
         self.logger.debug(f"Preparing to save {collection} data to a Parquet file.")
@@ -300,86 +673,383 @@ class MetricsProcessor:
         self.df.to_csv(filename, index=False)
         self.logger.debug(f"Saved {collection} DataFrame to {filename}.")
 
+    def get_writer(self, collection):
+        from src.writers import ParquetAppendWriter, CSVAppendWriter
+        if collection not in self.writers:
+            if self.file_format == "parquet":
+                self.writers[collection] = ParquetAppendWriter(self.destination_path, collection, self.timestamp, self.compression,
+                                                               self.logger, self.rotation, self.partitioning)
+            else:
+                self.writers[collection] = CSVAppendWriter(self.destination_path, collection, self.timestamp,
+                                                           self.logger, self.rotation, self.partitioning)
+        return self.writers[collection]
+
+    def close_writers(self):
+        with self.writers_lock:
+            for writer in self.writers.values():
+                writer.close()
+
+    def stop(self):
+        # Ends start() after the cycle or window in progress
+        self.stopping.set()
+
+    def shutdown(self):
+        # Queries still queued are cancelled, so an interrupted run does not wait for them on exit
+        self.executor.shutdown()
+        self.prom_api.close()
+
+    def save(self, collection):
+        if self.file_format not in ["parquet", "csv"]:
+            self.logger.error(f"Unsupported output format: {self.file_format}. Data not saved.")
+        elif self.write_mode == "append" and self.layout == "long" and self.df.empty:
+            # Nothing was collected; an empty long frame has no usable schema for the file either
+            self.logger.debug(f"No samples to append for {collection}.")
+        elif self.write_mode == "append":
+            period = self.rotation.get("period") if self.rotation else None
+            with self.writers_lock:
+                writer = self.get_writer(collection)
+                if self.query_mode == "range" and (self.partitioning == "hive" or period):
+                    # Route range rows to partitions and rotation periods by their own sample time
+                    timestamps = self.row_timestamps
+                    hours = timestamps // 3600
+                    periods = timestamps // period if period else hours
+                    breaks = np.flatnonzero((np.diff(hours) != 0) | (np.diff(periods) != 0)) + 1
+                    for rows in np.split(np.arange(len(timestamps)), breaks):
+                        if len(rows):
+                            writer.write(self.df.iloc[rows], timestamps[rows[0]])
+                            self.window_files.add(writer.filename)
+                else:
+                    writer.write(self.df, self.cycle_timestamps[0])
+                    self.window_files.add(writer.filename)
+        elif self.file_format == "parquet":
+            self.save_to_parquet(collection)
+        else:
+            self.save_to_csv(collection)
+
+    def get_time_range(self):
+        # --resume continues an interrupted collection up to its original end; --since-last collects
+        # from the end of the previous collection up to now
+        if self.checkpoint and (self.resume or self.since_last):
+            state = self.checkpoint.load()
+            if state is None:
+                self.logger.warning(f"No checkpoint found at {self.checkpoint.path}. Collecting the full time range.")
+            else:
+                start_time = datetime.fromtimestamp(self.checkpoint.get_next_start())
+                if self.since_last:
+                    end_time = datetime.fromtimestamp(time.time() // self.interval * self.interval)
+                else:
+                    end_time = datetime.fromtimestamp(state["end"])
+                self.logger.info(f"Time range determined from checkpoint: Start - {start_time}, End - {end_time}")
+                self.retry_windows = self.checkpoint.get_failed_windows()
+                if self.retry_windows:
+                    self.logger.info(f"Collecting {len(self.retry_windows)} window(s) with failed queries again.")
+                return start_time, end_time
+
+        # The checkpoint is only written by start(), so --validate and --profile-queries leave it untouched
+        return self.get_time_range_from_prometheus()
+
+    def get_collection_windows(self):
+        # Step-aligned windows of at most collection_window seconds covering the whole time range
+        window = max(self.interval, self.collection_window // self.interval * self.interval)
+        start_timestamp = round(self.start_time.timestamp())
+        # The last window ends on the step grid, so a later --since-last continues on the same grid
+        end_timestamp = start_timestamp + (round(self.end_time.timestamp()) - start_timestamp) // self.interval * self.interval
+        windows = []
+        window_start = start_timestamp
+        while window_start <= end_timestamp:
+            window_end = min(window_start + window - self.interval, end_timestamp)
+            windows.append((datetime.fromtimestamp(window_start), datetime.fromtimestamp(window_end)))
+            window_start = window_end + self.interval
+        return windows
+
+    def collect_window(self, window):
+        # Fetch, parse and write one window; returns its results and the files (relative to the destination
+        # path) its rows were written to
+        with self.instrumentation.timer("cycle"):
+            self.reset_row_data()  # reset array to prevent data leaking between runs
+            self.window_files = set()
+            results = self.process_metrics(window=window)
+            self.commit_and_save("combined")
+        self.logger.info(f"Collected window {window[0]} to {window[1]}.")
+        return results, sorted(os.path.relpath(filename, self.destination_path) for filename in self.window_files)
+
+    def complete_window(self, window, results, files):
+        if self.checkpoint:
+            self.checkpoint.complete_window(round(window[0].timestamp()), round(window[1].timestamp()),
+                                            self.get_query_progress(results), files)
+
+    def collect_retry_windows(self):
+        # The failed windows of the previous run are collected again first. Once their new rows are in a complete
+        # file, their partial rows are dropped from the files of the earlier run, so every timestamp appears once.
+        retried = []
+        for failed_window in self.retry_windows:
+            window = (datetime.fromtimestamp(failed_window["start"]), datetime.fromtimestamp(failed_window["end"]))
+            if self.stopping.is_set():
+                self.logger.info(f"Stopped before window {window[0]} to {window[1]}. Use --resume to continue.")
+                break
+            retried.append((failed_window, window, *self.collect_window(window)))
+        if not retried:
+            return
+
+        self.close_writers()
+        from src.writers import remove_time_range
+        for failed_window, window, results, files in retried:
+            for filename in failed_window["files"]:
+                path = os.path.join(self.destination_path, filename)
+                if os.path.exists(path):
+                    dropped = remove_time_range(path, failed_window["start"], failed_window["end"], self.compression)
+                    self.logger.debug(f"Dropped {dropped} partial rows of window {window[0]} to {window[1]} from {path}.")
+            self.complete_window(window, results, files)
+
+    def get_query_progress(self, results):
+        # Last sample timestamp per query, for the checkpoint
+        progress = {}
+        for query, (result, error) in zip(self.query_plan["queries"], results):
+            if error is not None:
+                progress[query["name"]] = (None, True)
+            elif query["kind"] == "range":
+                timestamps = [series["values"][-1, 0] for series in result if len(series["values"])]
+                progress[query["name"]] = (float(max(timestamps)) if timestamps else None, False)
+            else:
+                progress[query["name"]] = (self.evaluation_time, False)
+        return progress
+
     def get_time_range_from_prometheus(self):
 
         if self.start_time and self.end_time:
             self.logger.info(f"Time range determined from Config: Start - {self.start_time}, End - {self.end_time}")
             return self.start_time, self.end_time
         try:
-            min_time_query = "min(min_over_time(kube_pod_start_time[365d]))"
-            max_time_query = "time()"
+            # A configured start or end is kept; only the missing one is discovered
+            end_timestamp, head_start = self.get_head_time_range()
+            start_time = self.start_time or datetime.fromtimestamp(self.get_data_start(end_timestamp, head_start))
+            end_time = self.end_time or datetime.fromtimestamp(end_timestamp)
+            self.logger.info(f"Time range determined from Prometheus: Start - {start_time}, End - {end_time}")
+            return start_time, end_time
+        except Exception as e:
+            self.logger.error(f"Error fetching time range from Prometheus: {e}")
+            return None, None
+
+    def get_head_time_range(self):
+        # The TSDB head statistics give the newest sample and a time at which data certainly exists.
+        # An empty head reports minTime > maxTime.
+        try:
+            head = self.prom_api.get_status("tsdb")["data"]["headStats"]
+            if head["minTime"] <= head["maxTime"]:
+                return head["maxTime"] / 1000, head["minTime"] / 1000
+        except Exception as e:
+            self.logger.debug(f"TSDB status unavailable ({e}). Using the Prometheus server time as the end.")
+        end_timestamp = float(self.prom_api.query("time()")[0])
+        return end_timestamp, end_timestamp
 
-            start_time_response = self.prom_api.query(min_time_query)
-            end_time_response = self.prom_api.query(max_time_query)
+    def get_data_start(self, end_timestamp, head_start):
+        # The oldest data rarely moves by more than the retention advancing, so it is looked up once per
+        # Prometheus URL and time_range_max_age rather than on every run
+        cache = self.prom_api.cache
+        key = cache.get_key(self.prom_api.url, "time_range") if cache else None
+        cached = cache.get(key) if key else None
+        if cached and time.time() - cached["discovered_at"] < self.time_range_max_age:
+            self.logger.debug(f"Start of the data served from cache: {datetime.fromtimestamp(cached['start'])}")
+            return cached["start"]
 
-            if not start_time_response or not end_time_response:
-                self.logger.error(f"Failed to fetch time range from Prometheus.")
-                return None, None
+        start_timestamp = self.discover_data_start(end_timestamp, head_start)
+        if key:
+            cache.put(key, {"start": start_timestamp, "discovered_at": time.time()})
+        return start_timestamp
 
-            start_time_value = float(start_time_response[0]['value'][1])
-            end_time_value = float(end_time_response[0])
+    def discover_data_start(self, end_timestamp, head_start):
+        # Prometheus exports the lowest timestamp of its own TSDB; a single cheap instant query
+        result = self.prom_api.query("min(prometheus_tsdb_lowest_timestamp_seconds)", evaluation_time=round(end_timestamp))
+        if result and 0 < float(result[0]["value"][1]) <= end_timestamp:
+            self.logger.debug("Start of the data read from prometheus_tsdb_lowest_timestamp_seconds.")
+            return max(float(result[0]["value"][1]), end_timestamp - MAX_DISCOVERY_HISTORY)
 
-            if start_time_value and end_time_value:
-                start_time_datetime = datetime.fromtimestamp(start_time_value)
-                end_time_datetime = datetime.fromtimestamp(end_time_value)
-                self.logger.info(f"Time range determined from Prometheus: Start - {start_time_datetime}, End - {end_time_datetime}")
-                return start_time_datetime, end_time_datetime
+        # Otherwise (remote storage, federation) binary search the oldest time any target was scraped, down to the
+        # collection step. Each probe is an instant query touching a single lookback window.
+        def has_data(timestamp):
+            return bool(self.prom_api.query("count(up)", evaluation_time=round(timestamp)))
+
+        low, high = end_timestamp - MAX_DISCOVERY_HISTORY, head_start
+        if has_data(low):
+            return low
+        probes = 1
+        while high - low > self.interval:
+            middle = (low + high) / 2
+            if has_data(middle):
+                high = middle
             else:
-                self.logger.error(f"Failed to fetch time range from Prometheus.")
-                return None, None
-        except Exception as e:
-            self.logger.error(f"Error fetching time range from Prometheus: {e}")
-            return None, None
+                low = middle
+            probes += 1
+        self.logger.debug(f"Start of the data found with {probes} instant queries.")
+        return high
+
+    def get_probe_time(self):
+        # Probes evaluate at the end of the configured time range, where range mode has data, or now
+        return round(self.end_time.timestamp()) if self.end_time else round(time.time())
 
     def validate_queries(self):
-        for item in ["features", "labels"]:
-            for metric in self.query_sets[item]:
+        # A single instant evaluation per expression, all in parallel, is enough to check that an entry parses
+        # and returns data: whatever evaluates at one timestamp evaluates over a range as well
+        evaluation_time = self.get_probe_time()
+        failed = []
+        metrics = []
+        for skill_name in ("features", "labels"):
+            for metric in self.query_sets[skill_name]:
+                if self.validate_entry(metric):
+                    metrics.append(metric)
+                else:
+                    failed.append(str(metric.get("name")))
+        exprs = list(dict.fromkeys(self.query_planner.normalize_expr(metric["expr"]) for metric in metrics))
+        self.logger.info(f"Validating {len(metrics)} entries with {len(exprs)} instant queries at {datetime.fromtimestamp(evaluation_time)}.")
+        results = dict(zip(exprs, self.executor.map(lambda expr: self.prom_api.query(expr, evaluation_time=evaluation_time), exprs)))
+
+        empty = 0
+        for metric in metrics:
+            result, error = results[self.query_planner.normalize_expr(metric["expr"])]
+            if error is not None:
+                self.logger.error(f"[{inspect.stack()[0][3]}] Query of {metric['name']} failed due to {str(error)}")
+                failed.append(metric["name"])
+            elif not result:
+                self.logger.warning(f"No data returned for {metric['name']}.")
+                empty += 1
+            else:
+                # Scalar results such as time() are a single [timestamp, value] pair
+                series = len(result) if isinstance(result[0], dict) else 1
+                self.logger.info(f"Validated {metric['name']}: {series} series.")
+        total = sum(len(self.query_sets[skill_name]) for skill_name in ("features", "labels"))
+        self.logger.info(f"Validated {total} entries: {len(failed)} failed, {empty} without data.")
+        return failed
+
+    def get_query_profile(self):
+        # Evaluates every unique query of the plan the way it is collected (range queries over one collection
+        # window at the end of the time range), with Prometheus' evaluation statistics
+        evaluation_time = self.get_probe_time()
+        window = None
+        if self.query_mode == "range":
+            length = max(self.interval, self.collection_window // self.interval * self.interval)
+            window = (max(self.start_time, datetime.fromtimestamp(evaluation_time - length)), self.end_time)
+        entries = {}
+        for metric, handler, query_index, comparison in self.query_plan["entries"]:
+            entries.setdefault(query_index, []).append(metric["name"])
+
+        queries = []
+        # One query at a time, so that the latencies are not inflated by the other queries
+        for query_index, query in enumerate(self.query_plan["queries"]):
+            row = {"name": query["name"], "entries": entries[query_index], "kind": query["kind"], "expr": query["expr"]}
+            try:
+                if query["kind"] == "range":
+                    row.update(self.prom_api.profile_query(query["expr"], start=window[0], end=window[1], step=query["step"]))
+                else:
+                    row.update(self.prom_api.profile_query(query["expr"], evaluation_time=evaluation_time))
+            except Exception as e:
+                self.logger.error(f"[{inspect.stack()[0][3]}] Failed to profile {query['name']} due to {str(e)}")
+                row["error"] = str(e)
+            queries.append(row)
+
+        # Most samples touched first; queries the server reported no statistics for rank by latency after
+        # them, and failed queries come last
+        def rank(row):
+            if "error" in row:
+                return (2, 0, 0)
+            if row["total_samples"] is None:
+                return (1, 0, -row["seconds"])
+            return (0, -row["total_samples"], -row["seconds"])
+
+        queries.sort(key=rank)
+        return {"evaluation_time": datetime.fromtimestamp(evaluation_time), "window": window, "queries": queries}
+
+    def print_query_profile(self, profile):
+        if profile["window"]:
+            print(f"Range queries over {profile['window'][0]} to {profile['window'][1]}, instant queries at {profile['evaluation_time']}")
+        else:
+            print(f"Instant queries at {profile['evaluation_time']}")
+        print(f"{'rank':>4} {'query':<48} {'kind':<7} {'series':>7} {'points':>9} {'samples':>12} {'peak':>10} {'exec s':>8} {'wall s':>8} {'bytes':>10}")
+
+        def cell(value, spec=""):
+            return "" if value is None else format(value, spec)
+
+        for rank, row in enumerate(profile["queries"], 1):
+            if "error" in row:
+                print(f"{rank:>4} {row['name']:<48} {row['kind']:<7} failed: {row['error']}")
+            else:
+                print(f"{rank:>4} {row['name']:<48} {row['kind']:<7} {row['series']:>7} {row['points']:>9} {cell(row['total_samples']):>12} "
+                      f"{cell(row['peak_samples']):>10} {cell(row['eval_seconds'], '.3f'):>8} {row['seconds']:>8.3f} {row['bytes']:>10}")
+            if len(row["entries"]) > 1:
+                print(f"{'':>4} {'':<48} shared by {', '.join(row['entries'][1:])}")
+        total = sum(row.get("total_samples") or 0 for row in profile["queries"])
+        print(f"Total samples touched: {total}")
+
+    def profile_queries(self, as_json=False):
+        profile = self.get_query_profile()
+        if as_json:
+            print(json.dumps(profile, indent=2, default=str))
+        else:
+            self.print_query_profile(profile)
+
+    def preload_output_modules(self):
+        # Import pandas and the writers in the background while the first queries are in flight, so their
+        # import time overlaps with network I/O instead of adding to it
+        def preload():
+            for module in OUTPUT_MODULES:
                 try:
-                    self.fetch_metrics(metric)
-                except Exception as e:
-                    self.logger.error(f"[{inspect.stack()[0][3]}] Failed to validate metric {metric['name']} due to {str(e)}")    
+                    importlib.import_module(module)
+                except ImportError as e:
+                    self.logger.debug(f"Could not preload {module}: {e}")
+        threading.Thread(target=preload, name="preload", daemon=True).start()
+
+    def report_instrumentation(self):
+        if self.log_summary:
+            self.instrumentation.log_summary()
+        if self.instrumentation_output:
+            self.instrumentation.write_json(self.instrumentation_output)
 
     def start(self, scheduler_interval=0):
         self.logger.debug(f"Starting MetricsProcessor with query sets: {self.query_sets}")
+        self.preload_output_modules()
 
         # If query_mode is set to range, the script should process the time range specified by time_range
         if self.query_mode == 'range':
-            self.reset_row_data()  # reset array to prevent data leaking between runs
-            for skill_name in ["features", "labels"]:
-                self.process_metrics(skill_name)
-            
-            self.commit_to_memory()
-            if self.file_format == "parquet":
-                self.save_to_parquet("combined")
-            elif self.file_format == "csv":
-                self.save_to_csv("combined")
-            else:
-                self.logger.error(f"Unsupported output format: {self.file_format}. Data not saved.")
-            
+            windows = self.get_collection_windows()
+            if not windows and not self.retry_windows:
+                self.logger.info(f"Nothing to collect: the collection is already up to date until {self.end_time}.")
+                self.shutdown()
+                return
+            if windows:
+                self.logger.info(f"Collecting {windows[0][0]} to {windows[-1][1]} in {len(windows)} window(s).")
+            if self.checkpoint:
+                self.checkpoint.begin(round(self.start_time.timestamp()), round(self.end_time.timestamp()))
+
+            try:
+                self.collect_retry_windows()
+                for window in windows:
+                    if self.stopping.is_set():
+                        self.logger.info(f"Stopped before window {window[0]} to {window[1]}. Use --resume to continue.")
+                        break
+                    results, files = self.collect_window(window)
+                    self.complete_window(window, results, files)
+            finally:
+                if self.owns_writers:
+                    self.close_writers()
+                self.report_instrumentation()
+                self.shutdown()
+
             self.logger.info(f"Processing completed for the time range specified. Interval: {self.interval}s")
             return  # Exit the function
 
         # If query_mode is set to another value (e.g., instant), the script should repeatedly execute in intervals
-        print(f"MetricsProcessor with interval={scheduler_interval}s")
-
-        while True:
-            self.reset_row_data() # reset array to prevent data leaking between runs
+        self.logger.info(f"MetricsProcessor with interval={scheduler_interval}s")
 
-            for skill_name in ["features", "labels"]:
-                self.process_metrics(skill_name)
-
-            self.commit_to_memory()
-            if self.file_format == "parquet":
-                self.save_to_parquet("combined")
-            elif self.file_format == "csv":
-                self.save_to_csv("combined")
-            else:
-                self.logger.error(f"Unsupported output format: {self.file_format}. Data not saved.")
-    
-            self.logger.info("Processing completed for the current cycle.")
-            self.logger.info(f"Next interval begins in {scheduler_interval} seconds, waiting for the next cycle.")
+        try:
             if (scheduler_interval == 0):
                 # When interval == 0 then run only once
-                break
+                self.run_cycle(round(time.time()))
             else:
-                time.sleep(scheduler_interval)
+                scheduler = FixedRateScheduler(scheduler_interval, self.overrun_policy, self.max_concurrent_cycles, self.logger,
+                                               instrumentation=self.instrumentation, stop_event=self.stopping)
+                scheduler.run(self.run_cycle)
+        finally:
+            # Appending writers must be closed to finalize their files; shared ones are closed by their owner
+            if self.owns_writers:
+                self.close_writers()
+            self.report_instrumentation()
+            self.shutdown()
@@ -1,39 +1,247 @@
+import re
 import requests
 import urllib3
 import time
+import random
 import logging
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from src.response_decoder import RangeResponseDecoder
+
+class PrometheusUnreachable(requests.exceptions.ConnectionError):
+    pass
+
 
 class PrometheusAPI:
-    def __init__(self, url, token, logger=None):
+    # Expressions longer than this are sent as a POST form to stay clear of URL length limits
+    MAX_GET_QUERY_LENGTH = 2048
+    RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+    # Responses telling that the server (or a query frontend in front of it) is overloaded or timed out
+    OVERLOAD_STATUS_CODES = (429, 503, 504)
+    MAX_BACKOFF = 30
+    # A server that refuses connections is tried again this many times before the cycle is given up
+    UNREACHABLE_RETRIES = 1
+    STEP_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800, "y": 31536000}
+    # Part of every cache key, so entries written with an older result layout are never read back
+    CACHE_FORMAT = "ndarray-v1"
+
+    def __init__(self, url, token, logger=None, pool_size=10, connect_timeout=5, read_timeout=120,
+                 retries=3, backoff_factor=0.5, max_points=11000, split_workers=4, cache=None, instrumentation=None,
+                 json_decoder=None, limiter=None):
         self.url = url
         self.token = token
         urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
         self.headers = {"Authorization": "Bearer " + token}
         self.logger = logger if logger else logging.getLogger(__name__)
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.session = self.create_session(pool_size)
+        # Prometheus rejects range queries returning more than 11,000 points per series
+        self.max_points = max_points
+        self.split_pool = ThreadPoolExecutor(max_workers=split_workers, thread_name_prefix="range")
+        self.cache = cache
+        self.instrumentation = instrumentation
+        self.decoder = RangeResponseDecoder(self.logger, json_decoder)
+        # Optional AdaptiveLimiter gating every request sent to this Prometheus
+        self.limiter = limiter
+
+    def create_session(self, pool_size):
+        # A single pooled session keeps connections warm between queries and cycles
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers.update(self.headers)
+        session.headers["Accept-Encoding"] = "gzip"
+        session.verify = False  # Ignore SSL errors if the Prometheus instance uses self-signed SSL
+        return session
+
+    def close(self):
+        # Split range requests still queued are cancelled; the requests in flight finish on their own
+        self.split_pool.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+    def get_backoff(self, attempt):
+        # Exponential backoff with full jitter
+        return random.uniform(0, min(self.MAX_BACKOFF, self.backoff_factor * (2 ** attempt)))
+
+    def get_retry_after(self, response, attempt):
+        # Honour the server's Retry-After (in seconds) on 429 and 503, within MAX_BACKOFF
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return max(self.get_backoff(attempt), min(self.MAX_BACKOFF, int(retry_after)))
+        return self.get_backoff(attempt)
+
+    def is_unreachable(self, error):
+        # Refused connections, unresolvable hosts and connect timeouts: the request never reached Prometheus
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return True
+        reason = getattr(error.args[0], "reason", None) if error.args else None
+        return isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+    def send(self, endpoint, params, use_post, stream):
+        # One attempt, gated by the limiter. Only 429/503/504 and read timeouts tell it that Prometheus is overloaded.
+        started = self.limiter.acquire() if self.limiter else None
+        overloaded, measured = False, True
+        try:
+            if use_post:
+                response = self.session.post(endpoint, data=params, timeout=self.timeout, stream=stream)
+            else:
+                response = self.session.get(endpoint, params=params, timeout=self.timeout, stream=stream)
+            overloaded = response.status_code in self.OVERLOAD_STATUS_CODES
+            return response
+        except requests.exceptions.ReadTimeout:
+            overloaded = True
+            raise
+        except requests.exceptions.ConnectionError:
+            measured = False
+            raise
+        finally:
+            if self.limiter:
+                self.limiter.release(started, overloaded, measured)
+
+    def request(self, path, params=None, stream=False, budget=None):
+        endpoint = self.url + path
+        use_post = params is not None and len(params.get("query", "")) > self.MAX_GET_QUERY_LENGTH
+
+        for attempt in range(self.retries + 1):
+            if budget:
+                budget.spend()
+            # Read timeouts are not retried: a query that timed out is not sent again to a server that is already struggling
+            try:
+                response = self.send(endpoint, params, use_post, stream)
+            except requests.exceptions.ConnectionError as e:
+                unreachable = self.is_unreachable(e)
+                last_attempt = attempt == self.retries or (budget and budget.stopping())
+                if unreachable and (last_attempt or attempt >= self.UNREACHABLE_RETRIES):
+                    # Still unreachable after a backoff: sending the rest of the cycle would only fail the same way
+                    error = PrometheusUnreachable(f"Could not connect to {self.url}: {e}")
+                    if budget:
+                        budget.abort(str(error))
+                    raise error from e
+                if last_attempt:
+                    raise
+                self.logger.warning(f"Connection error on {path} (attempt {attempt + 1}/{self.retries + 1}): {e}")
+                delay = self.get_backoff(attempt)
+            else:
+                if response.status_code not in self.RETRY_STATUS_CODES or attempt == self.retries or (budget and budget.stopping()):
+                    return response
+                self.logger.warning(f"Prometheus returned {response.status_code} on {path} (attempt {attempt + 1}/{self.retries + 1})")
+                delay = self.get_retry_after(response, attempt)
+                response.close()
+            if budget:
+                budget.wait(delay)
+            else:
+                time.sleep(delay)
+
+    def raise_for_status(self, response):
+        # Prometheus explains rejected queries (parse errors, timeouts, too many samples) in the body
+        try:
+            response.raise_for_status()
+        except requests.exceptions.HTTPError as e:
+            try:
+                error = response.json().get("error")
+            except ValueError:
+                error = None
+            if not error:
+                raise
+            raise requests.exceptions.HTTPError(f"{e}: {error}", response=response) from e
 
-    def query(self, query):
+    def record_query(self, query, started, response_bytes=0, result=None):
+        # Report wall time (including retries), payload size and result size to the instrumentation
+        if not self.instrumentation:
+            return
+        seconds = time.perf_counter() - started
+        if result is None:
+            self.instrumentation.record_query(query, seconds, error=True)
+            return
+        samples = sum(len(series["values"]) if "values" in series else 1 for series in result)
+        self.instrumentation.record_query(query, seconds, response_bytes, len(result), samples)
+
+    def query(self, query, evaluation_time=None, budget=None):
         params = {
             "query": str(query),
-            "time": round(time.time())
+            "time": evaluation_time if evaluation_time is not None else round(time.time())
         }
 
         self.logger.debug(f"Executing query: {params['query']} at time: {params['time']}")
 
-        response = requests.get(
-            self.url + "/api/v1/query",
-            params=params,
-            headers=self.headers,
-            verify=False  # Ignore SSL errors if the Prometheus instance uses self-signed SSL
-        )
-
-        response.raise_for_status()
+        started = time.perf_counter()
+        response_bytes, result = 0, None
+        try:
+            response = self.request("/api/v1/query", params, budget=budget)
+            self.raise_for_status(response)
+            response_bytes = len(response.content)
+            result = response.json()["data"]["result"]
+        finally:
+            self.record_query(query, started, response_bytes, result)
         self.logger.debug("Query executed successfully.")
-        return response.json()["data"]["result"]
+        return result
+
+    def parse_step(self, step):
+        # Accept the same step formats as Prometheus: plain seconds or a duration such as '15m'
+        if isinstance(step, (int, float)):
+            return step
+        match = re.fullmatch(r"(\d+(?:\.\d+)?)(ms|s|m|h|d|w|y)?", str(step).strip())
+        if not match:
+            raise ValueError(f"Invalid range query step: {step}")
+        return float(match.group(1)) * self.STEP_UNITS[match.group(2) or "s"]
 
-    def query_range(self, query, start, end, step="15m"):
+    def split_range(self, start_timestamp, end_timestamp, step_seconds):
+        # Sub-windows start on the original step grid and never share a sample
+        window = step_seconds * (self.max_points - 1)
+        windows = []
+        window_start = start_timestamp
+        while window_start <= end_timestamp:
+            window_end = min(window_start + window, end_timestamp)
+            windows.append((window_start, window_end))
+            window_start = window_end + step_seconds
+        return windows
+
+    def merge_range_results(self, window_results):
+        # Stitch sub-window results back together per series, in window order,
+        # dropping any sample already seen at a window boundary
+        merged = {}
+        for result in window_results:
+            for series in result:
+                key = tuple(sorted(series["metric"].items()))
+                values = series["values"]
+                if key not in merged:
+                    merged[key] = {"metric": series["metric"], "values": [values]}
+                    continue
+                chunks = merged[key]["values"]
+                last_timestamp = next((chunk[-1, 0] for chunk in reversed(chunks) if len(chunk)), None)
+                if last_timestamp is not None:
+                    values = values[values[:, 0] > last_timestamp]
+                chunks.append(values)
+        for series in merged.values():
+            series["values"] = np.concatenate(series["values"])
+        return list(merged.values())
+
+    def query_range(self, query, start, end, step="15m", budget=None):
         start_timestamp = round(start.timestamp())
         end_timestamp = round(end.timestamp())
 
+        windows = self.split_range(start_timestamp, end_timestamp, self.parse_step(step))
+        if len(windows) <= 1:
+            return self.query_range_window(query, start_timestamp, end_timestamp, step, budget)
+
+        self.logger.debug(f"Splitting range query into {len(windows)} windows of at most {self.max_points} points: {query}")
+        futures = [self.split_pool.submit(self.query_range_window, query, window_start, window_end, step, budget)
+                   for window_start, window_end in windows]
+        return self.merge_range_results([future.result() for future in futures])
+
+    def query_range_window(self, query, start_timestamp, end_timestamp, step, budget=None):
+        cache_key = None
+        if self.cache and self.cache.is_cacheable(end_timestamp):
+            cache_key = self.cache.get_key(self.url, query, start_timestamp, end_timestamp, step, self.CACHE_FORMAT)
+            result = self.cache.get(cache_key)
+            if result is not None:
+                self.logger.debug(f"Range query served from cache: {query} from {start_timestamp} to {end_timestamp}")
+                return result
+
         params = {
             "query": str(query),
             "start": start_timestamp,
@@ -42,25 +250,55 @@ class PrometheusAPI:
         }
 
         self.logger.debug(f"Executing range query: {params['query']} from {params['start']} to {params['end']} with step: {params['step']}")
-        response = requests.get(
-            self.url + "/api/v1/query_range",
-            params=params,
-            headers=self.headers,
-            verify=False  # Ignore SSL errors if the Prometheus instance uses self-signed SSL
-        )
-
-        response.raise_for_status()
+        started = time.perf_counter()
+        response, response_bytes, result = None, 0, None
+        try:
+            response = self.request("/api/v1/query_range", params, stream=self.decoder.streaming, budget=budget)
+            self.raise_for_status(response)
+            result, response_bytes = self.decoder.decode(response)
+        finally:
+            if response is not None:
+                response.close()
+            self.record_query(query, started, response_bytes, result)
         self.logger.debug("Range query executed successfully.")
-        return response.json()["data"]["result"]
+        if cache_key:
+            self.cache.put(cache_key, result)
+        return result
+
+    def profile_query(self, query, evaluation_time=None, start=None, end=None, step=None):
+        # Evaluates the query once with Prometheus' evaluation statistics (stats=all), as a range query when
+        # start and end are given. Bypasses the cache and the instrumentation. The statistics are None when the
+        # server does not report them (Prometheus before 2.35 and some query frontends).
+        if start is not None:
+            path = "/api/v1/query_range"
+            params = {"query": str(query), "start": round(start.timestamp()), "end": round(end.timestamp()), "step": step}
+        else:
+            path = "/api/v1/query"
+            params = {"query": str(query), "time": evaluation_time if evaluation_time is not None else round(time.time())}
+        params["stats"] = "all"
+
+        self.logger.debug(f"Profiling query: {params['query']}")
+        started = time.perf_counter()
+        response = self.request(path, params)
+        seconds = time.perf_counter() - started
+        self.raise_for_status(response)
+        data = response.json()["data"]
+
+        if data["resultType"] == "matrix":
+            series, points = len(data["result"]), sum(len(item["values"]) for item in data["result"])
+        elif data["resultType"] == "vector":
+            series = points = len(data["result"])
+        else:
+            series = points = 1
+        stats = data.get("stats") or {}
+        samples = stats.get("samples", {})
+        return {"series": series, "points": points, "bytes": len(response.content), "seconds": seconds,
+                "total_samples": samples.get("totalQueryableSamples"), "peak_samples": samples.get("peakSamples"),
+                "eval_seconds": stats.get("timings", {}).get("execTotalTime")}
 
     def get_status(self, status_type):
-        endpoint = f"{self.url}/api/v1/status/{status_type}"
         self.logger.debug(f"Fetching {status_type} status from Prometheus.")
-        response = requests.get(
-            endpoint, 
-            headers=self.headers,
-            verify=False  # Ignore SSL errors if the Prometheus instance uses self-signed SSL
-        )
+        response = self.request(f"/api/v1/status/{status_type}")
 
         if response.status_code != 200:
             raise Exception(f"Failed to fetch {status_type} status from Prometheus. Status code: {response.status_code}")
@@ -0,0 +1,150 @@
+import os
+import json
+import time
+import zlib
+import struct
+import hashlib
+import logging
+import threading
+import numpy as np
+
+class QueryCache:
+    # Entries are JSON documents whose numpy arrays are stored as raw float64 after the document, so reading
+    # the cache never runs code (unlike pickle), whoever can write to its directory
+    FILE_SUFFIX = ".bin"
+    MAGIC = b"QCv2"
+    ARRAY_KEY = "__ndarray__"
+
+    def __init__(self, path, max_size=512 * 1024 * 1024, max_age=7 * 86400, settle_time=600, refresh=False, logger=None):
+        self.path = path
+        self.max_size = max_size
+        self.max_age = max_age
+        # Samples this close to "now" may still change (late scrapes, rule evaluation lag) and are never cached
+        self.settle_time = settle_time
+        # When refreshing, cached entries are ignored but fresh results are still written
+        self.refresh = refresh
+        self.logger = logger if logger else logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        self.size = 0
+        self.evict()
+
+    def get_key(self, *parts):
+        return hashlib.sha256("\x00".join(str(part) for part in parts).encode()).hexdigest()
+
+    def get_filename(self, key):
+        return os.path.join(self.path, key + self.FILE_SUFFIX)
+
+    def is_cacheable(self, end_timestamp):
+        return end_timestamp < time.time() - self.settle_time
+
+    def encode(self, value):
+        arrays = []
+        offset = 0
+
+        def encode_value(value):
+            nonlocal offset
+            if isinstance(value, np.ndarray):
+                array = value.astype("<f8").reshape(-1)
+                arrays.append(array)
+                offset += array.size
+                return {self.ARRAY_KEY: [offset - array.size, list(value.shape)]}
+            if isinstance(value, dict):
+                return {key: encode_value(item) for key, item in value.items()}
+            if isinstance(value, (list, tuple)):
+                return [encode_value(item) for item in value]
+            return value
+
+        document = json.dumps(encode_value(value), separators=(",", ":")).encode()
+        samples = np.concatenate(arrays).tobytes() if arrays else b""
+        return self.MAGIC + struct.pack("<Q", len(document)) + document + samples
+
+    def decode(self, data):
+        # Tuples come back as lists
+        header = len(self.MAGIC) + 8
+        (length,) = struct.unpack_from("<Q", data, len(self.MAGIC))
+        document = json.loads(data[header:header + length])
+        samples = np.frombuffer(data, dtype="<f8", offset=header + length).copy()
+
+        def decode_value(value):
+            if isinstance(value, dict):
+                if self.ARRAY_KEY in value:
+                    offset, shape = value[self.ARRAY_KEY]
+                    return samples[offset:offset + int(np.prod(shape))].reshape(shape)
+                return {key: decode_value(item) for key, item in value.items()}
+            if isinstance(value, list):
+                return [decode_value(item) for item in value]
+            return value
+
+        return decode_value(document)
+
+    def get(self, key):
+        if self.refresh:
+            return None
+        filename = self.get_filename(key)
+        try:
+            if time.time() - os.path.getmtime(filename) > self.max_age:
+                return None
+            with open(filename, "rb") as f:
+                data = zlib.decompress(f.read())
+            if not data.startswith(self.MAGIC):
+                # Written by an older collector; the next put replaces it
+                return None
+            value = self.decode(data)
+            # Touch the entry so size-based eviction drops the least recently used files first
+            os.utime(filename)
+            return value
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            self.logger.warning(f"Ignoring unreadable cache entry {filename}: {e}")
+            return None
+
+    def put(self, key, value):
+        filename = self.get_filename(key)
+        try:
+            data = zlib.compress(self.encode(value))
+        except (TypeError, ValueError) as e:
+            self.logger.warning(f"Not caching an entry that cannot be stored: {e}")
+            return
+        tmp_filename = f"{filename}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_filename, "wb") as f:
+                f.write(data)
+            os.replace(tmp_filename, filename)
+        except OSError as e:
+            self.logger.warning(f"Failed to write cache entry {filename}: {e}")
+            return
+
+        with self.lock:
+            self.size += len(data)
+            over_limit = self.size > self.max_size
+        if over_limit:
+            self.evict()
+
+    def evict(self):
+        with self.lock:
+            now = time.time()
+            entries = []
+            for entry in os.scandir(self.path):
+                if not entry.name.endswith(self.FILE_SUFFIX):
+                    continue
+                stat = entry.stat()
+                if now - stat.st_mtime > self.max_age:
+                    os.remove(entry.path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+            # Drop the least recently used entries until the cache fits in max_size
+            entries.sort()
+            self.size = sum(size for _, size, _ in entries)
+            removed = 0
+            while entries and self.size > self.max_size:
+                _, size, path = entries.pop(0)
+                os.remove(path)
+                self.size -= size
+                removed += 1
+
+            if removed:
+                self.logger.debug(f"Evicted {removed} query cache entries. Cache size: {self.size} bytes")
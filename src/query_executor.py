@@ -0,0 +1,26 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+class QueryExecutor:
+    def __init__(self, max_in_flight=8, logger=None):
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.logger = logger if logger else logging.getLogger(__name__)
+        self.pool = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="query")
+
+    def map(self, fn, items):
+        # Every item is submitted up front; the pool size bounds how many run at once.
+        # Results come back in submission order as (result, error) pairs so callers can
+        # merge them deterministically regardless of completion order.
+        futures = [self.pool.submit(fn, item) for item in items]
+        self.logger.debug(f"Submitted {len(futures)} queries with max_in_flight={self.max_in_flight}")
+
+        results = []
+        for future in futures:
+            try:
+                results.append((future.result(), None))
+            except Exception as e:
+                results.append((None, e))
+        return results
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,157 @@
+import re
+import logging
+import operator
+import numpy as np
+
+class QueryPlanner:
+    QUOTES = ("\"", "'", "`")
+    OPENING = "([{,"
+    CLOSING = ")]},"
+    BRACKETS = {"(": ")", "[": "]", "{": "}"}
+    COMPARISONS = {"==": operator.eq, "!=": operator.ne, ">=": operator.ge,
+                   "<=": operator.le, ">": operator.gt, "<": operator.lt}
+    THRESHOLD_PATTERN = re.compile(r"(.*\S)\s*(==|!=|>=|<=|>|<)\s*bool\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)", re.S)
+    # Anything at the top level of the base that binds looser than (or as loose as) the comparison
+    TOP_LEVEL_OPERATORS = re.compile(r"==|!=|>=|<=|>|<|\b(?:and|or|unless)\b")
+
+    def __init__(self, logger=None):
+        self.logger = logger if logger else logging.getLogger(__name__)
+
+    def normalize_expr(self, expr):
+        # Collapse whitespace outside string literals so that copies of the same PromQL that only
+        # differ in formatting (YAML block scalars, trailing spaces, indentation) share one query
+        normalized = []
+        quote = None
+        pending_space = False
+        chars = iter(str(expr).strip())
+        for char in chars:
+            if quote:
+                normalized.append(char)
+                if char == "\\" and quote != "`":
+                    normalized.append(next(chars, ""))
+                elif char == quote:
+                    quote = None
+                continue
+
+            if char.isspace():
+                pending_space = True
+                continue
+
+            if pending_space and normalized:
+                previous = normalized[-1]
+                if not (previous in self.OPENING or char in self.CLOSING or (previous == ")" and char == "(")):
+                    normalized.append(" ")
+            pending_space = False
+
+            normalized.append(char)
+            if char in self.QUOTES:
+                quote = char
+        return "".join(normalized)
+
+    def top_level(self, expr):
+        # Return expr with everything nested in brackets or string literals blanked out
+        depth = 0
+        quote = None
+        top = []
+        chars = iter(expr)
+        for char in chars:
+            if quote:
+                if char == "\\" and quote != "`":
+                    next(chars, "")
+                elif char == quote:
+                    quote = None
+                top.append(" ")
+            elif char in self.QUOTES:
+                quote = char
+                top.append(" ")
+            elif char in self.BRACKETS:
+                depth += 1
+                top.append(" ")
+            elif char in self.BRACKETS.values():
+                depth -= 1
+                top.append(" ")
+            else:
+                top.append(char if depth == 0 else " ")
+        return "".join(top)
+
+    def strip_outer_parens(self, expr):
+        # Remove parentheses wrapping the whole expression: "(a > bool 1)" but not "(a) + (b)"
+        while expr.startswith("(") and expr.endswith(")") and not self.top_level(expr).strip():
+            expr = expr[1:-1].strip()
+        return expr
+
+    def split_threshold(self, expr):
+        # Split "<base> <op> bool <number>" into its parts when the comparison applies to the whole base
+        match = self.THRESHOLD_PATTERN.fullmatch(self.strip_outer_parens(expr))
+        if not match:
+            return None
+        base = match.group(1).strip()
+        if self.TOP_LEVEL_OPERATORS.search(self.top_level(base)):
+            return None
+        return self.strip_outer_parens(base), (match.group(2), float(match.group(3)))
+
+    def evaluate_comparisons(self, result, comparisons):
+        # Evaluate every "<op> bool <threshold>" of a family against one fetched base vector or matrix.
+        # Sample values are gathered once into a single array and compared in one vectorized pass each.
+        # Range results carry (n, 2) [timestamp, value] arrays; the derived series keep that layout.
+        is_range = bool(result) and "values" in result[0]
+        if is_range:
+            lengths = [len(series["values"]) for series in result]
+            values = np.concatenate([series["values"][:, 1] for series in result])
+        else:
+            samples = [series["value"] for series in result]
+            values = np.array([float(sample[1]) for sample in samples], dtype=np.float64)
+        # Comparisons with the bool modifier drop the metric name, like Prometheus does
+        metrics = [{k: v for k, v in series["metric"].items() if k != "__name__"} for series in result]
+
+        evaluated = {}
+        for comparison in comparisons:
+            op, threshold = comparison
+            matches = self.COMPARISONS[op](values, threshold)
+            if is_range:
+                flags = np.split(matches.astype(np.float64), np.cumsum(lengths)[:-1])
+                derived = [{"metric": metric, "values": np.column_stack((series["values"][:, 0], series_flags))}
+                           for metric, series, series_flags in zip(metrics, result, flags)]
+            else:
+                flags = np.where(matches, "1", "0").tolist()
+                derived = [{"metric": metric, "value": [sample[0], flag]} for metric, sample, flag in zip(metrics, samples, flags)]
+            evaluated[comparison] = derived
+        return evaluated
+
+    def plan(self, entries):
+        # entries is a list of (metric, handler, kind, step). Each unique (expr, kind, step) becomes one
+        # query; every entry keeps the index of the query whose result it is dispatched from, plus the
+        # comparison to evaluate locally when it belongs to a family sharing the same base expression.
+        normalized = []
+        family_sizes = {}
+        for metric, handler, kind, step in entries:
+            expr = self.normalize_expr(metric["expr"])
+            split = self.split_threshold(expr)
+            base = split[0] if split else self.strip_outer_parens(expr)
+            family_sizes[(base, kind, step)] = family_sizes.get((base, kind, step), 0) + 1
+            normalized.append((expr, split))
+
+        queries = []
+        planned_entries = []
+        index = {}
+        local_evaluations = 0
+        for (metric, handler, kind, step), (expr, split) in zip(entries, normalized):
+            comparison = None
+            if split and family_sizes[(split[0], kind, step)] > 1:
+                expr, comparison = split
+                local_evaluations += 1
+            elif family_sizes.get((self.strip_outer_parens(expr), kind, step), 0) > 1:
+                expr = self.strip_outer_parens(expr)
+
+            key = (expr, kind, step)
+            if key not in index:
+                index[key] = len(queries)
+                queries.append({"expr": expr, "kind": kind, "step": step, "comparisons": []})
+            if comparison and comparison not in queries[index[key]]["comparisons"]:
+                queries[index[key]]["comparisons"].append(comparison)
+            planned_entries.append((metric, handler, index[key], comparison))
+
+        saved = len(planned_entries) - len(queries)
+        self.logger.info(f"Query plan: {len(planned_entries)} entries, {len(queries)} unique queries ({saved} saved by deduplication, "
+                         f"{local_evaluations} thresholds evaluated locally).")
+        return {"queries": queries, "entries": planned_entries}
@@ -0,0 +1,105 @@
+import json
+import logging
+import numpy as np
+from array import array
+
+# Optional faster decoders. ijson parses the response incrementally while it is being received;
+# orjson decodes a complete body faster than the standard library.
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+class CountingReader:
+    # File-like wrapper counting the decoded body bytes handed to the incremental parser
+    def __init__(self, raw):
+        self.raw = raw
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self.raw.read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+class RangeResponseDecoder:
+    # Decodes /api/v1/query_range responses into a list of {"metric": labels, "values": array} where
+    # values is an (n, 2) float64 array of [timestamp, value] rows. With ijson the body is parsed as it
+    # streams in and samples are appended straight into a packed float buffer per series, so no nested
+    # Python lists of [ts, "string"] pairs are ever built for the whole response.
+    SAMPLE_PREFIX = "data.result.item.values.item.item"
+    SERIES_PREFIX = "data.result.item"
+    METRIC_PREFIX = "data.result.item.metric."
+    BACKENDS = ("ijson", "orjson", "json")
+
+    def __init__(self, logger=None, backend=None):
+        self.logger = logger if logger else logging.getLogger(__name__)
+        available = [name for name, module in (("ijson", ijson), ("orjson", orjson), ("json", json)) if module]
+        if backend and backend not in available:
+            self.logger.warning(f"JSON decoder '{backend}' is not installed. Using '{available[0]}' instead.")
+            backend = None
+        self.backend = backend if backend else available[0]
+        self.logger.debug(f"Decoding range query responses with {self.backend}.")
+
+    @property
+    def streaming(self):
+        # Whether the response should be requested with stream=True
+        return self.backend == "ijson"
+
+    def decode(self, response):
+        # Returns the result list and the number of body bytes decoded
+        if self.streaming:
+            return self.decode_stream(response)
+        return self.decode_body(response)
+
+    def check_status(self, status, error):
+        if status != "success":
+            raise ValueError(f"Prometheus returned status '{status}': {error}")
+
+    def decode_stream(self, response):
+        response.raw.decode_content = True  # let urllib3 undo the gzip transfer encoding
+        reader = CountingReader(response.raw)
+        result = []
+        status, error = None, None
+        metric, samples = None, None
+        metric_prefix_length = len(self.METRIC_PREFIX)
+
+        for prefix, event, value in ijson.parse(reader, use_float=True):
+            if prefix == self.SAMPLE_PREFIX:
+                # Each sample is [<unix time as number>, "<value as string>"]; both land in the same
+                # buffer, which becomes the [timestamp, value] rows of the series without a copy
+                samples.append(value if event == "number" else float(value))
+            elif prefix == self.SERIES_PREFIX:
+                if event == "start_map":
+                    metric, samples = {}, array("d")
+                elif event == "end_map":
+                    result.append({"metric": metric, "values": np.frombuffer(samples, dtype=np.float64).reshape(-1, 2)})
+            elif event == "string" and prefix.startswith(self.METRIC_PREFIX):
+                metric[prefix[metric_prefix_length:]] = value
+            elif prefix == "status":
+                status = value
+            elif prefix == "error":
+                error = value
+
+        self.check_status(status, error)
+        return result, reader.bytes_read
+
+    def decode_body(self, response):
+        body = response.content
+        payload = orjson.loads(body) if self.backend == "orjson" else json.loads(body)
+        self.check_status(payload.get("status"), payload.get("error"))
+
+        # Convert one series at a time and drop its Python objects right away
+        series_list = payload["data"]["result"]
+        series_list.reverse()
+        result = []
+        while series_list:
+            series = series_list.pop()
+            values = np.asarray(series["values"], dtype=np.float64).reshape(-1, 2)
+            result.append({"metric": series["metric"], "values": values})
+        return result, len(body)
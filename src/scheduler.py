@@ -0,0 +1,89 @@
+import math
+import time
+import logging
+import threading
+from datetime import datetime
+
+class FixedRateScheduler:
+    # Starts cycles on a fixed grid aligned to the interval (e.g. :00, :15, :30, :45 for 15m), so the
+    # cadence does not drift by the time each cycle takes. The grid timestamp is handed to the cycle as
+    # its evaluation time. When a cycle overruns its slot, the policy decides what happens next:
+    #   skip       - drop the missed ticks and wait for the next grid point
+    #   catch_up   - run one cycle immediately for the latest missed tick, then continue on the grid
+    #   concurrent - start every tick in its own thread, up to max_concurrent cycles at once
+    POLICIES = ("skip", "catch_up", "concurrent")
+
+    def __init__(self, interval, overrun_policy="skip", max_concurrent=2, logger=None, instrumentation=None, stop_event=None):
+        if overrun_policy not in self.POLICIES:
+            raise ValueError(f"Unsupported overrun policy: {overrun_policy}")
+        self.interval = interval
+        self.overrun_policy = overrun_policy
+        self.max_concurrent = max(1, max_concurrent)
+        self.logger = logger if logger else logging.getLogger(__name__)
+        self.threads = []
+        self.instrumentation = instrumentation
+        # Setting the event ends run() after the cycle in progress
+        self.stop_event = stop_event if stop_event else threading.Event()
+
+    def get_tick(self, now):
+        # Latest grid point at or before now
+        return math.floor(now / self.interval) * self.interval
+
+    def wait_until(self, tick):
+        delay = tick - time.time()
+        if delay > 0:
+            self.logger.info(f"Next cycle begins at {datetime.fromtimestamp(tick)}, waiting {delay:.1f} seconds.")
+            self.stop_event.wait(delay)
+
+    def run(self, cycle):
+        # The first cycle runs right away for the current grid point. It started part-way into its slot, so
+        # the following ticks are aligned to the next grid point after it ends and never count as missed.
+        tick = self.get_tick(time.time())
+        first = True
+        try:
+            while not self.stop_event.is_set():
+                if self.overrun_policy == "concurrent":
+                    self.start_concurrent(cycle, tick)
+                else:
+                    cycle(round(tick))
+
+                tick += self.interval
+                now = time.time()
+                if first:
+                    first = False
+                    tick = self.get_tick(now) + self.interval
+                elif self.overrun_policy != "concurrent" and now > tick:
+                    latest = self.get_tick(now)
+                    missed = int((latest - tick) // self.interval) + 1
+                    if self.overrun_policy == "catch_up":
+                        self.logger.warning(f"Cycle overran its interval and missed {missed} tick(s). Running one catch-up cycle.")
+                        self.record_skipped(missed - 1)
+                        tick = latest
+                        continue
+                    self.logger.warning(f"Cycle overran its interval. Skipping {missed} tick(s).")
+                    self.record_skipped(missed)
+                    tick = latest + self.interval
+                self.wait_until(tick)
+        finally:
+            for thread in self.threads:
+                thread.join()
+
+    def start_concurrent(self, cycle, tick):
+        self.threads = [thread for thread in self.threads if thread.is_alive()]
+        if len(self.threads) >= self.max_concurrent:
+            self.logger.warning(f"{len(self.threads)} cycles still running. Skipping the cycle for {datetime.fromtimestamp(tick)}.")
+            self.record_skipped(1)
+            return
+        thread = threading.Thread(target=self.run_safely, args=(cycle, round(tick)), name=f"cycle-{round(tick)}")
+        thread.start()
+        self.threads.append(thread)
+
+    def record_skipped(self, count):
+        if self.instrumentation and count:
+            self.instrumentation.record_skipped_cycles(count)
+
+    def run_safely(self, cycle, evaluation_time):
+        try:
+            cycle(evaluation_time)
+        except Exception as e:
+            self.logger.error(f"Cycle for {datetime.fromtimestamp(evaluation_time)} failed due to {str(e)}")
@@ -0,0 +1,129 @@
+import os
+import sys
+import stat
+import socket
+import logging
+import threading
+from abc import ABC, abstractmethod
+import pyarrow as pa
+from src.writers import conform_table, evolve_schema
+
+class StreamSink(ABC):
+    # Streams every cycle's rows, as soon as they are assembled, to a consumer reading stdout ('-'), a FIFO or
+    # file path, or a Unix domain socket ('unix:/path/to/socket') that the consumer listens on. A consumer that
+    # is not there (no reader on the FIFO, nothing listening on the socket, a closed connection) only costs
+    # the cycles it misses: the target is opened again on the next cycle.
+    def __init__(self, target, logger=None):
+        self.target = target
+        self.logger = logger if logger else logging.getLogger(__name__)
+        self.file = None
+        self.socket = None
+        self.disabled = False
+        # Clusters collected side by side share one sink; each cycle is written as a whole
+        self.lock = threading.Lock()
+
+    def open_target(self):
+        if self.target == "-":
+            return sys.stdout.buffer
+        if self.target.startswith("unix:"):
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.connect(self.target[len("unix:"):])
+            return self.socket.makefile("wb")
+        if os.path.exists(self.target) and stat.S_ISFIFO(os.stat(self.target).st_mode):
+            # Opening a FIFO blocks until a reader opens it; fail right away instead of stalling the cycle
+            fd = os.open(self.target, os.O_WRONLY | os.O_NONBLOCK)
+            os.set_blocking(fd, True)
+            return os.fdopen(fd, "wb")
+        return open(self.target, "ab")
+
+    def emit(self, df):
+        with self.lock:
+            if self.disabled:
+                return
+            try:
+                if self.file is None:
+                    self.file = self.open_target()
+                self.write_frame(df)
+                self.file.flush()
+            except OSError as e:
+                self.reset()
+                if self.target == "-":
+                    self.disabled = True
+                    self.logger.error(f"Standard output was closed ({e}). No further cycles are streamed.")
+                else:
+                    self.logger.warning(f"Could not stream the cycle to {self.target}: {e}. Retrying on the next cycle.")
+
+    @abstractmethod
+    def write_frame(self, df):
+        pass
+
+    def reset(self):
+        # Drop the connection quietly; the next cycle opens the target again
+        if self.file is not None and self.file is not sys.stdout.buffer:
+            try:
+                self.file.close()
+            except OSError:
+                pass
+        if self.socket is not None:
+            self.socket.close()
+        self.file = None
+        self.socket = None
+
+    def close(self):
+        with self.lock:
+            self.reset()
+
+
+class NDJSONSink(StreamSink):
+    # One JSON object per row and line; timestamps in ISO 8601, missing values as null
+    def write_frame(self, df):
+        text = df.to_json(orient="records", lines=True, date_format="iso", date_unit="s")
+        if not text.endswith("\n"):
+            text += "\n"
+        self.file.write(text.encode())
+
+
+class ArrowStreamSink(StreamSink):
+    # Arrow IPC stream with one record batch per cycle. A stream has a single schema, so when a cycle brings new
+    # columns the stream is ended and a new one, with the wider schema, follows on the same target; consumers
+    # call pyarrow.ipc.open_stream again after the end of each stream.
+    def __init__(self, target, logger=None):
+        super().__init__(target, logger)
+        self.writer = None
+        self.schema = None
+
+    def write_frame(self, df):
+        table = pa.Table.from_pandas(df, preserve_index=False).replace_schema_metadata(None)
+        if self.schema is None:
+            self.schema = table.schema
+        try:
+            table = conform_table(table, self.schema)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            self.schema = evolve_schema(self.schema, table)
+            self.logger.info(f"Schema changed; starting a new Arrow stream with {len(self.schema)} columns.")
+            self.end_stream()
+            table = conform_table(table, self.schema)
+
+        if self.writer is None:
+            self.writer = pa.ipc.new_stream(self.file, self.schema)
+        self.writer.write_table(table)
+
+    def end_stream(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def reset(self):
+        # A reconnected consumer needs the schema again, so the next cycle starts a new stream
+        if self.writer is not None:
+            try:
+                self.end_stream()
+            except (OSError, pa.ArrowException):
+                self.writer = None
+        super().reset()
+
+
+SINKS = {"ndjson": NDJSONSink, "arrow": ArrowStreamSink}
+
+def get_sink(sink_format, target, logger=None):
+    return SINKS[sink_format](target, logger)
@@ -1,9 +1,19 @@
 import os
+import csv
+import io
+import glob
+import json
+import numpy as np
 import pandas as pd
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
 import pyarrow.parquet as pq
 
 class FileStats:
+    # Row counts, columns and storage details are answered from the Parquet footer or a chunked scan of
+    # the CSV; the full file is only loaded into pandas (df) for statistics that need the data itself.
+    CSV_CHUNK_SIZE = 16 * 1024 * 1024
+
     def __init__(self, file_path):
         self.file_path = file_path
         self.file_format = file_path.split('.')[-1]
@@ -13,6 +23,8 @@ class FileStats:
             raise FileNotFoundError(f"{file_path} does not exist.")
         
         self._data = None  # Cached data
+        self._metadata = None  # Cached Parquet footer
+        self._csv_scan = None  # Cached CSV header and row count
 
     @property
     def df(self):
@@ -31,15 +43,75 @@ class FileStats:
     def get_location(self):
         return os.path.abspath(self.file_path)
 
+    @property
+    def metadata(self):
+        if self._metadata is None:
+            self._metadata = pq.read_metadata(self.file_path)
+        return self._metadata
+
+    def scan_csv(self):
+        # Header from the first line, rows by counting line breaks in fixed-size chunks
+        if self._csv_scan is None:
+            with open(self.file_path, "rb") as f:
+                header = next(csv.reader(io.TextIOWrapper(io.BytesIO(f.readline()), encoding="utf-8")), [])
+                rows = 0
+                last_byte = b"\n"
+                while True:
+                    chunk = f.read(self.CSV_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    rows += chunk.count(b"\n")
+                    last_byte = chunk[-1:]
+                # A last line without a trailing line break is still a row
+                if last_byte != b"\n":
+                    rows += 1
+            self._csv_scan = (header, rows)
+        return self._csv_scan
+
     def get_num_columns(self):
-        return len(self.df.columns)
+        return len(self.get_column_names())
 
     def get_num_rows(self):
+        if self.file_format == "parquet":
+            return self.metadata.num_rows
+        if self.file_format == "csv":
+            return self.scan_csv()[1]
         return len(self.df)
 
     def get_column_names(self):
+        if self.file_format == "parquet":
+            schema = self.metadata.schema.to_arrow_schema()
+            # Skip index columns stored by pandas, which pandas restores as the index rather than as columns
+            pandas_metadata = schema.pandas_metadata or {}
+            index_columns = [column for column in pandas_metadata.get("index_columns", []) if isinstance(column, str)]
+            return [name for name in schema.names if name not in index_columns]
+        if self.file_format == "csv":
+            return self.scan_csv()[0]
         return list(self.df.columns)
 
+    def get_num_row_groups(self):
+        if self.file_format == "parquet":
+            return self.metadata.num_row_groups
+        return None
+
+    def get_column_storage(self):
+        # Compressed and uncompressed bytes and encodings per column, summed over all row groups
+        if self.file_format != "parquet":
+            return None
+        metadata = self.metadata
+        storage = {}
+        for row_group_index in range(metadata.num_row_groups):
+            row_group = metadata.row_group(row_group_index)
+            for column_index in range(row_group.num_columns):
+                column = row_group.column(column_index)
+                stats = storage.setdefault(column.path_in_schema, {"compressed": 0, "uncompressed": 0, "encodings": set()})
+                stats["compressed"] += column.total_compressed_size
+                stats["uncompressed"] += column.total_uncompressed_size
+                stats["encodings"].update(column.encodings)
+        for stats in storage.values():
+            stats["encodings"] = sorted(stats["encodings"])
+        return storage
+
     def get_date_created(self):
         timestamp = os.path.getctime(self.file_path)
         return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
@@ -47,8 +119,10 @@ class FileStats:
     def get_compression(self):
         if self.file_format == "parquet":
             # Using PyArrow to detect compression
-            meta_data = pq.read_metadata(self.file_path)
-            
+            meta_data = self.metadata
+            if meta_data.num_row_groups == 0 or meta_data.num_columns == 0:
+                return None
+
             # Get the compression from the first column chunk of the first row group
             compression = meta_data.row_group(0).column(0).compression
             return compression if compression else None
@@ -66,9 +140,227 @@ class FileStats:
             "Compression Type": self.get_compression() if self.file_format == "parquet" else "N/A",
             "colume name": self.get_column_names()
         }
+        if self.file_format == "parquet":
+            storage = self.get_column_storage()
+            stats["Row Groups"] = self.get_num_row_groups()
+            stats["Uncompressed Size (bytes)"] = sum(column["uncompressed"] for column in storage.values())
+            stats["Column Storage"] = storage
         return stats
 
     def print_summary(self):
         summary = self.summarize()
         for key, value in summary.items():
+            if key == "Column Storage":
+                print(f"{key}: {'column':<48} {'compressed':>12} {'uncompressed':>12}  encodings")
+                for column, stats in value.items():
+                    print(f"  {column:<48} {stats['compressed']:>12} {stats['uncompressed']:>12}  {','.join(stats['encodings'])}")
+                continue
             print(f"{key}: {value}")
+
+
+class ColumnProfile:
+    # Mergeable statistics of one column: null count, min/max, mean of numeric values and a K-minimum-values
+    # sketch of value hashes for the distinct count. Profiles of batches, row groups and files are merged
+    # into one, so memory does not depend on the amount of data profiled.
+    KMV_SIZE = 1024
+    HASH_SPACE = float(2 ** 64)
+
+    def __init__(self, name):
+        self.name = name
+        self.dtype = None
+        self.count = 0
+        self.nulls = 0
+        self.min = None
+        self.max = None
+        self.sum = 0.0
+        self.numeric_count = 0
+        self.hashes = np.empty(0, dtype=np.uint64)
+        self.files = 0
+
+    def update_bounds(self, minimum, maximum):
+        try:
+            if minimum is not None and (self.min is None or minimum < self.min):
+                self.min = minimum
+            if maximum is not None and (self.max is None or maximum > self.max):
+                self.max = maximum
+        except TypeError:
+            # Files disagree on the column type (e.g. CSV text and Parquet timestamps); compare as text
+            self.min = min(str(value) for value in (self.min, minimum) if value is not None)
+            self.max = max(str(value) for value in (self.max, maximum) if value is not None)
+
+    def update_sketch(self, hashes):
+        self.hashes = np.unique(np.concatenate([self.hashes, hashes]))[:self.KMV_SIZE]
+
+    def update(self, series, bounds_known=False):
+        # bounds_known: nulls and min/max were already taken from Parquet column statistics
+        self.dtype = self.dtype or str(series.dtype)
+        self.count += len(series)
+        values = series.dropna()
+        if not bounds_known:
+            self.nulls += len(series) - len(values)
+            if len(values):
+                try:
+                    self.update_bounds(values.min(), values.max())
+                except TypeError:
+                    # Mixed types in an object column; compare their text
+                    text = values.astype(str)
+                    self.update_bounds(text.min(), text.max())
+        if not len(values):
+            return
+        if pd.api.types.is_bool_dtype(values) or pd.api.types.is_numeric_dtype(values):
+            numbers = values.to_numpy(dtype=np.float64)
+            numbers = numbers[np.isfinite(numbers)]
+            self.sum += float(numbers.sum())
+            self.numeric_count += len(numbers)
+        self.update_sketch(pd.util.hash_array(values.to_numpy()))
+
+    def merge(self, other):
+        self.dtype = self.dtype or other.dtype
+        self.count += other.count
+        self.nulls += other.nulls
+        self.update_bounds(other.min, other.max)
+        self.sum += other.sum
+        self.numeric_count += other.numeric_count
+        self.update_sketch(other.hashes)
+        self.files += other.files
+
+    def get_distinct_estimate(self):
+        # Exact below KMV_SIZE distinct values, otherwise (k - 1) / (k-th smallest hash / hash space)
+        if len(self.hashes) < self.KMV_SIZE:
+            return len(self.hashes)
+        return int(round((self.KMV_SIZE - 1) / (float(self.hashes[-1]) / self.HASH_SPACE)))
+
+    def to_dict(self):
+        def plain(value):
+            if isinstance(value, (pd.Timestamp, datetime)):
+                return value.isoformat()
+            if isinstance(value, np.generic):
+                return value.item()
+            return value
+
+        return {
+            "dtype": self.dtype,
+            "files": self.files,
+            "count": self.count,
+            "nulls": self.nulls,
+            "null_ratio": self.nulls / self.count if self.count else None,
+            "min": plain(self.min),
+            "max": plain(self.max),
+            "mean": self.sum / self.numeric_count if self.numeric_count else None,
+            "distinct_estimate": self.get_distinct_estimate(),
+        }
+
+
+def profile_file(file_path, batch_rows=65536):
+    # Runs in a worker process: stream one file in batches and return its size, row count and column profiles
+    profiles = {}
+    file_format = file_path.split('.')[-1]
+    if file_format == "parquet":
+        parquet_file = pq.ParquetFile(file_path)
+        metadata = parquet_file.metadata
+        names = FileStats(file_path).get_column_names()
+        # Nulls and min/max come from the column chunk statistics when every row group has them
+        known = {}
+        for column_index in range(metadata.num_columns):
+            name = metadata.schema.column(column_index).path
+            if name not in names:
+                continue
+            chunks = [metadata.row_group(i).column(column_index).statistics for i in range(metadata.num_row_groups)]
+            if chunks and all(stats is not None and stats.has_min_max and stats.has_null_count for stats in chunks):
+                known[name] = chunks
+        for name in names:
+            profiles[name] = ColumnProfile(name)
+            for stats in known.get(name, []):
+                profiles[name].nulls += stats.null_count
+                profiles[name].update_bounds(stats.min, stats.max)
+        for batch in parquet_file.iter_batches(batch_size=batch_rows, columns=names):
+            for name, column in zip(batch.schema.names, batch.columns):
+                profiles[name].update(column.to_pandas(), bounds_known=name in known)
+        rows = metadata.num_rows
+    elif file_format == "csv":
+        rows = 0
+        for chunk in pd.read_csv(file_path, chunksize=batch_rows):
+            rows += len(chunk)
+            for name in chunk.columns:
+                profiles.setdefault(name, ColumnProfile(name)).update(chunk[name])
+    else:
+        raise ValueError(f"Unsupported file format: {file_format}")
+
+    for profile in profiles.values():
+        profile.files = 1
+    return {"file": file_path, "size": os.path.getsize(file_path), "rows": rows, "columns": profiles}
+
+
+class DatasetStats:
+    # Profiles every Parquet and CSV file under a directory (recursively, e.g. hive partitions) or matching
+    # a glob, one file per worker process, and merges the results into one dataset-level report
+    EXTENSIONS = (".parquet", ".csv")
+
+    def __init__(self, path, workers=None, logger=None):
+        self.path = path
+        self.workers = workers if workers else os.cpu_count()
+        self.logger = logger
+        self.files = self.find_files(path)
+        if not self.files:
+            raise FileNotFoundError(f"No Parquet or CSV files found at {path}.")
+
+    def find_files(self, path):
+        # Directories matched by a glob (e.g. out_* matching several output directories) are searched too
+        matches = [path] if os.path.exists(path) else glob.glob(path, recursive=True)
+        candidates = []
+        for match in matches:
+            if os.path.isdir(match):
+                candidates.extend(os.path.join(root, name) for root, _, names in os.walk(match) for name in names)
+            else:
+                candidates.append(match)
+        return sorted(set(candidate for candidate in candidates if candidate.endswith(self.EXTENSIONS)))
+
+    def profile(self):
+        columns = {}
+        report = {"path": self.path, "files": len(self.files), "size": 0, "rows": 0, "failed_files": []}
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(self.files))) as pool:
+            futures = {file_path: pool.submit(profile_file, file_path) for file_path in self.files}
+            for file_path, future in futures.items():
+                try:
+                    result = future.result()
+                except Exception as e:
+                    if self.logger:
+                        self.logger.error(f"Failed to profile {file_path}: {str(e)}")
+                    report["failed_files"].append(file_path)
+                    continue
+                report["size"] += result["size"]
+                report["rows"] += result["rows"]
+                for name, profile in result["columns"].items():
+                    if name in columns:
+                        columns[name].merge(profile)
+                    else:
+                        columns[name] = profile
+        # Columns missing from some files count those files' rows as nulls
+        for profile in columns.values():
+            profile.nulls += report["rows"] - profile.count
+            profile.count = report["rows"]
+        report["columns"] = {name: profile.to_dict() for name, profile in columns.items()}
+        return report
+
+    def print_report(self, report):
+        print(f"Dataset: {report['path']}")
+        print(f"Files: {report['files']} ({len(report['failed_files'])} failed)")
+        print(f"Size (bytes): {report['size']}")
+        print(f"Number of Rows: {report['rows']}")
+        print(f"Number of Columns: {len(report['columns'])}")
+        print(f"{'column':<48} {'dtype':<20} {'null %':>7} {'min':>14} {'max':>14} {'mean':>14} {'distinct':>9}")
+
+        def cell(value):
+            if value is None:
+                return ""
+            if isinstance(value, float):
+                return f"{value:.6g}"
+            return str(value)[:14]
+
+        for name, column in report["columns"].items():
+            null_ratio = f"{column['null_ratio'] * 100:.1f}" if column["null_ratio"] is not None else ""
+            print(f"{name:<48} {str(column['dtype']):<20} {null_ratio:>7} {cell(column['min']):>14} {cell(column['max']):>14} "
+                  f"{cell(column['mean']):>14} {column['distinct_estimate']:>9}")
+
+    def print_json(self, report):
+        print(json.dumps(report, indent=2, default=str))
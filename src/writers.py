@@ -0,0 +1,194 @@
+import os
+import time
+import logging
+from abc import ABC, abstractmethod
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from datetime import datetime, timezone
+
+def conform_table(table, schema):
+    # Reorder and cast a cycle's columns to an open file's or stream's schema, filling missing columns with nulls
+    if set(table.column_names) - set(schema.names):
+        raise pa.ArrowInvalid("Cycle has columns that are not in the current schema")
+    columns = []
+    for field in schema:
+        if field.name in table.column_names:
+            columns.append(table.column(field.name).cast(field.type))
+        else:
+            columns.append(pa.nulls(table.num_rows, type=field.type))
+    return pa.Table.from_arrays(columns, schema=schema)
+
+def evolve_schema(schema, table):
+    # Union of the current schema and the cycle's schema; the cycle's type wins on conflicts
+    fields = [table.schema.field(field.name) if field.name in table.column_names else field for field in schema]
+    fields.extend(field for field in table.schema if field.name not in schema.names)
+    return pa.schema(fields)
+
+def remove_time_range(filename, start_timestamp, end_timestamp, compression=None):
+    # Rewrite a closed output file without its rows timestamped from start to end (inclusive, in seconds), and
+    # remove it when nothing is left. Returns the number of rows dropped.
+    if filename.endswith(".csv"):
+        import pandas as pd
+        df = pd.read_csv(filename)
+        seconds = pd.to_datetime(df["timestamp"], utc=True).to_numpy(dtype="datetime64[s]").astype(np.int64)
+        keep = (seconds < start_timestamp) | (seconds > end_timestamp)
+        dropped = int((~keep).sum())
+        if dropped and keep.any():
+            df[keep].to_csv(f"{filename}.tmp", index=False)
+    else:
+        table = pq.read_table(filename)
+        seconds = table.column("timestamp").cast(pa.timestamp("s"), safe=False).cast(pa.int64()).to_numpy()
+        keep = (seconds < start_timestamp) | (seconds > end_timestamp)
+        dropped = int((~keep).sum())
+        if dropped and keep.any():
+            pq.write_table(table.filter(pa.array(keep)), f"{filename}.tmp", compression=compression if compression else "snappy")
+
+    if dropped and keep.any():
+        os.replace(f"{filename}.tmp", filename)
+    elif dropped:
+        os.remove(filename)
+    return dropped
+
+
+class AppendWriter(ABC):
+    # Keeps one output file open and appends each cycle to it. A new part file is started when a cycle
+    # cannot be appended to the current file (new columns, incompatible types) or when the rotation
+    # policy says so. With hive partitioning, files are laid out as date=YYYY-MM-DD/hour=HH/ (UTC)
+    # under the destination path.
+    extension = None
+
+    def __init__(self, destination_path, collection, timestamp, logger=None, rotation=None, partitioning=None):
+        self.destination_path = destination_path
+        self.collection = collection
+        self.timestamp = timestamp
+        self.logger = logger if logger else logging.getLogger(__name__)
+        # rotation may hold 'period' (seconds), 'max_rows' and 'max_bytes'
+        self.rotation = rotation if rotation else {}
+        self.partitioning = partitioning
+        self.part = 0
+        self.filename = None
+        self.partition_path = None
+        self.period_bucket = None
+        self.rows_written = 0
+
+    def get_partition_path(self, cycle_time):
+        if self.partitioning != "hive":
+            return self.destination_path
+        moment = datetime.fromtimestamp(cycle_time, tz=timezone.utc)
+        return os.path.join(self.destination_path, f"date={moment:%Y-%m-%d}", f"hour={moment:%H}")
+
+    def get_period_bucket(self, cycle_time):
+        period = self.rotation.get("period")
+        return int(cycle_time // period) if period else None
+
+    def next_filename(self, cycle_time):
+        self.partition_path = self.get_partition_path(cycle_time)
+        if not os.path.exists(self.partition_path):
+            os.makedirs(self.partition_path)
+        suffix = f"_part{self.part:04d}" if self.part else ""
+        self.part += 1
+        self.filename = f"{self.partition_path}/metrics_{self.collection}_{self.timestamp}{suffix}.{self.extension}"
+        self.period_bucket = self.get_period_bucket(cycle_time)
+        self.rows_written = 0
+        self.logger.debug(f"Opened {self.filename} for appending.")
+        return self.filename
+
+    def needs_rotation(self, cycle_time):
+        if self.get_partition_path(cycle_time) != self.partition_path:
+            return True
+        if self.get_period_bucket(cycle_time) != self.period_bucket:
+            return True
+        if self.rotation.get("max_rows") and self.rows_written >= self.rotation["max_rows"]:
+            return True
+        if self.rotation.get("max_bytes") and os.path.getsize(self.filename) >= self.rotation["max_bytes"]:
+            return True
+        return False
+
+    @abstractmethod
+    def write(self, df, cycle_time=None):
+        pass
+
+    @abstractmethod
+    def close(self):
+        pass
+
+
+class ParquetAppendWriter(AppendWriter):
+    extension = "parquet"
+
+    def __init__(self, destination_path, collection, timestamp, compression=None, logger=None, rotation=None, partitioning=None):
+        super().__init__(destination_path, collection, timestamp, logger, rotation, partitioning)
+        self.compression = compression if compression else "snappy"
+        self.writer = None
+        self.schema = None
+
+    def write(self, df, cycle_time=None):
+        cycle_time = cycle_time if cycle_time is not None else time.time()
+        table = pa.Table.from_pandas(df, preserve_index=False).replace_schema_metadata(None)
+
+        if self.writer is not None and self.needs_rotation(cycle_time):
+            self.close()
+
+        if self.schema is None:
+            self.schema = table.schema
+        try:
+            table = conform_table(table, self.schema)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            self.schema = evolve_schema(self.schema, table)
+            self.logger.info(f"Schema changed; rolling over to a new part file with {len(self.schema)} columns.")
+            self.close()
+            table = conform_table(table, self.schema)
+
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.next_filename(cycle_time), self.schema, compression=self.compression)
+
+        # Each cycle becomes one row group
+        self.writer.write_table(table)
+        self.rows_written += table.num_rows
+        self.logger.debug(f"Appended {table.num_rows} rows to {self.filename}.")
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            self.logger.debug(f"Closed {self.filename} after {self.rows_written} rows.")
+
+
+class CSVAppendWriter(AppendWriter):
+    extension = "csv"
+
+    def __init__(self, destination_path, collection, timestamp, logger=None, rotation=None, partitioning=None):
+        super().__init__(destination_path, collection, timestamp, logger, rotation, partitioning)
+        self.file = None
+        self.columns = None
+
+    def write(self, df, cycle_time=None):
+        cycle_time = cycle_time if cycle_time is not None else time.time()
+
+        if self.file is not None and self.needs_rotation(cycle_time):
+            self.close()
+
+        if self.columns is None:
+            self.columns = list(df.columns)
+        elif not set(df.columns) <= set(self.columns):
+            # A CSV header cannot grow, so new columns start a new part file
+            self.columns = self.columns + [column for column in df.columns if column not in self.columns]
+            self.logger.info(f"Schema changed; rolling over to a new part file with {len(self.columns)} columns.")
+            self.close()
+
+        if self.file is None:
+            self.file = open(self.next_filename(cycle_time), "w", newline="")
+            df.reindex(columns=self.columns).to_csv(self.file, index=False)
+        else:
+            df.reindex(columns=self.columns).to_csv(self.file, index=False, header=False)
+
+        self.file.flush()
+        self.rows_written += len(df)
+        self.logger.debug(f"Appended {len(df)} rows to {self.filename}.")
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.logger.debug(f"Closed {self.filename} after {self.rows_written} rows.")
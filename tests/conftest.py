@@ -0,0 +1,24 @@
+import logging
+import pytest
+from src.metrics_processor import MetricsProcessor
+
+class FakePrometheusAPI:
+    # Answers every instant query with one sample of 1
+    url = "http://prometheus:9090"
+
+    def query(self, query, evaluation_time=None, budget=None):
+        return [{"metric": {}, "value": [evaluation_time, "1"]}]
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def make_processor(tmp_path):
+    # MetricsProcessor over a one-entry query set, writing below tmp_path/out
+    def make_processor(query_mode, interval, start_time=None, end_time=None, **kwargs):
+        query_file = tmp_path / "features.yaml"
+        query_file.write_text("- name: total_qty_nodes\n  expr: count(kube_node_role)\n  type: scalar\n")
+        kwargs.setdefault("destination_path", str(tmp_path / "out"))
+        return MetricsProcessor(FakePrometheusAPI(), [{"features": [str(query_file)]}], query_mode, interval,
+                                logging.getLogger(__name__), start_time, end_time, **kwargs)
+    return make_processor
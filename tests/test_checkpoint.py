@@ -0,0 +1,104 @@
+import os
+import json
+import pytest
+from datetime import datetime
+from src.checkpoint import Checkpoint
+
+# The URL of conftest.FakePrometheusAPI
+URL = "http://prometheus:9090"
+STEP = 900
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "_metrics_combined.checkpoint.json")
+
+def open_checkpoint(path, fingerprint="plan"):
+    checkpoint = Checkpoint(path, URL, fingerprint, STEP)
+    checkpoint.load()
+    return checkpoint
+
+def test_begin_starts_and_resumes(path):
+    checkpoint = open_checkpoint(path)
+    assert checkpoint.state is None
+    checkpoint.begin(0, 86400)
+    assert checkpoint.get_next_start() == 0
+
+    checkpoint.complete_window(0, 20700, {"a": (20700, False)})
+    # A resumed run keeps the start and progress, and only moves the end
+    resumed = open_checkpoint(path)
+    resumed.begin(0, 172800)
+    assert resumed.get_next_start() == 20700 + STEP
+    assert resumed.state["start"] == 0
+    assert resumed.state["end"] == 172800
+    assert resumed.state["windows_completed"] == 1
+
+def test_complete_window_tracks_progress(path):
+    checkpoint = open_checkpoint(path)
+    checkpoint.begin(0, 86400)
+    checkpoint.complete_window(0, 20700, {"a": (20700, False), "b": (None, False)})
+    checkpoint.complete_window(21600, 42300, {"a": (42300, False), "b": (30000, True)})
+
+    state = open_checkpoint(path).state
+    assert state["completed_until"] == 42300
+    assert state["windows_completed"] == 2
+    # A failed query keeps the last timestamp of its last successful window
+    assert state["queries"] == {"a": {"last_timestamp": 42300}, "b": {"last_timestamp": None}}
+
+def test_failed_windows_are_resumed_oldest_first(path):
+    checkpoint = open_checkpoint(path)
+    checkpoint.begin(0, 86400)
+    checkpoint.complete_window(21600, 42300, {"a": (None, True)}, ["part0001.parquet"])
+    checkpoint.complete_window(0, 20700, {"a": (None, True)}, ["metrics.parquet"])
+    checkpoint.complete_window(43200, 64800, {"a": (64800, False)}, ["part0001.parquet"])
+
+    resumed = open_checkpoint(path)
+    assert resumed.get_failed_windows() == [{"start": 0, "end": 20700, "files": ["metrics.parquet"]},
+                                            {"start": 21600, "end": 42300, "files": ["part0001.parquet"]}]
+    assert resumed.get_next_start() == 64800 + STEP
+
+    # Collected again, a window that succeeds leaves the list; one that fails again is recorded with its new files
+    resumed.complete_window(0, 20700, {"a": (20700, False)}, ["part0002.parquet"])
+    resumed.complete_window(21600, 42300, {"a": (None, True)}, ["part0002.parquet"])
+    assert open_checkpoint(path).get_failed_windows() == [{"start": 21600, "end": 42300, "files": ["part0002.parquet"]}]
+    # Windows collected again do not move the resume position back
+    assert resumed.get_next_start() == 64800 + STEP
+
+def test_fail_window_replaces_earlier_entry(path):
+    checkpoint = open_checkpoint(path)
+    checkpoint.begin(0, 86400)
+    checkpoint.fail_window(0, 20700, ["b.parquet", "a.parquet"])
+    checkpoint.fail_window(0, 20700, ["c.parquet"])
+    assert checkpoint.get_failed_windows() == [{"start": 0, "end": 20700, "files": ["c.parquet"]}]
+
+def test_reads_earlier_failed_windows(path):
+    checkpoint = open_checkpoint(path)
+    checkpoint.begin(0, 86400)
+    checkpoint.state["failed_windows"] = [[0, 20700]]
+    checkpoint.save()
+    assert open_checkpoint(path).get_failed_windows() == [{"start": 0, "end": 20700, "files": []}]
+
+def test_load_rejects_other_prometheus_and_step(path):
+    open_checkpoint(path).begin(0, 86400)
+    with pytest.raises(ValueError):
+        Checkpoint(path, "http://other:9090", "plan", STEP).load()
+    with pytest.raises(ValueError):
+        Checkpoint(path, URL, "plan", 60).load()
+    # A changed query plan only warns
+    assert Checkpoint(path, URL, "other plan", STEP).load() is not None
+
+
+@pytest.mark.parametrize("resume", [False, True])
+def test_validate_leaves_checkpoint_untouched(tmp_path, make_processor, resume):
+    destination_path = str(tmp_path / "out")
+    os.makedirs(destination_path)
+    checkpoint_path = os.path.join(destination_path, "_metrics_combined.checkpoint.json")
+    state = {"version": Checkpoint.VERSION, "url": URL, "step": STEP, "start": 0, "end": 86400, "fingerprint": "plan",
+             "completed_until": 20700, "windows_completed": 1, "failed_windows": [], "queries": {}, "updated_at": "then"}
+    with open(checkpoint_path, "w") as f:
+        json.dump(state, f)
+
+    processor = make_processor("range", STEP, datetime.fromtimestamp(0), datetime.fromtimestamp(86400),
+                               destination_path=destination_path, resume=resume)
+    assert processor.validate_queries() == []
+    with open(checkpoint_path) as f:
+        assert json.load(f) == state
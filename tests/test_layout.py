@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+import pytest
+from datetime import datetime
+from src.layout import to_wide
+
+# 2023-08-16 08:00:00 UTC, collected every 15 minutes
+START = 1692172800
+STEP = 900
+
+def fill_cycle(processor):
+    # One column of each kind the handlers produce, named and described the way they do it
+    processor.reset_row_data()
+    processor.row_data["total_qty_nodes"] = "4"
+    processor.describe_column("total_qty_nodes", metric="total_qty_nodes")
+    processor.row_data["is_sno"] = False
+    processor.describe_column("is_sno", metric="is_sno")
+    for node, points in (("node1", [[START, 0.5], [START + STEP, 0.75], [START + 2 * STEP, np.nan]]),
+                         # node2 misses the second sample
+                         ("node2", [[START, 1.0], [START + 2 * STEP, np.inf]])):
+        processor.describe_column(f"{node}_cpu_usage", node=node, metric="cpu_usage")
+        processor.add_range_series(f"{node}_cpu_usage", points)
+        processor.describe_column(f"{node}_worker", node=node, metric="node_role", attribute="worker")
+        processor.add_range_series(f"{node}_worker", [[START, 1.0], [START + STEP, 1.0], [START + 2 * STEP, 1.0]])
+    processor.describe_column("pods_Running", metric="pods", attribute="Running")
+    processor.add_range_series("pods_Running", [[START + STEP, 42.0]])
+
+@pytest.mark.parametrize("cluster", [None, "east"])
+def test_to_wide_restores_the_wide_frame(make_processor, cluster):
+    def build(layout):
+        processor = make_processor("range", STEP, datetime.fromtimestamp(START), datetime.fromtimestamp(START + 2 * STEP),
+                                   layout=layout, write_mode="append", checkpoint_enabled=False, cluster=cluster)
+        fill_cycle(processor)
+        return processor.commit_to_memory()
+
+    wide = build("wide")
+    restored = to_wide(build("long"))
+
+    assert list(restored.columns) == list(wide.columns)
+    assert len(restored) == len(wide) == 3
+    pd.testing.assert_series_equal(restored["timestamp"], wide["timestamp"])
+    assert list(restored["run_id"]) == list(wide["run_id"])
+    if cluster:
+        assert list(restored["cluster"]) == [cluster] * 3
+    for column in wide.columns.drop(["run_id", "timestamp", "cluster"], errors="ignore"):
+        # Booleans come back as 0.0/1.0, and samples a series lacks as NaN
+        np.testing.assert_array_equal(restored[column].to_numpy(dtype=np.float64), wide[column].to_numpy(dtype=np.float64),
+                                      err_msg=column)
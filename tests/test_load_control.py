@@ -0,0 +1,108 @@
+import time
+import threading
+import pytest
+from src.load_control import AdaptiveLimiter, QueryBudget, QueryBudgetExceeded, CycleAborted
+
+def respond(limiter, latency=0.0, overloaded=False, measured=True):
+    # One request through the limiter that took latency seconds
+    started = limiter.acquire()
+    limiter.release(started - latency, overloaded, measured)
+
+@pytest.fixture
+def limiter():
+    # No spacing between request starts, so the tests never sleep
+    return AdaptiveLimiter(8, min_limit=2, latency_target=1, max_delay=0)
+
+def test_decreases_multiplicatively_on_overload(limiter):
+    respond(limiter, overloaded=True)
+    assert limiter.limit == 4
+    respond(limiter, overloaded=True)
+    assert limiter.limit == 2
+    # Never below min_limit
+    respond(limiter, overloaded=True)
+    assert limiter.limit == 2
+
+def test_decreases_on_slow_responses(limiter):
+    respond(limiter, latency=5)
+    assert limiter.limit == 4
+
+def test_increases_additively_up_to_max(limiter):
+    respond(limiter, overloaded=True)
+    respond(limiter, overloaded=True)
+    # About one more request in flight per round trip of the whole limit
+    respond(limiter)
+    respond(limiter)
+    assert limiter.limit == pytest.approx(2 + 1 / 2 + 1 / 2.5)
+    for _ in range(100):
+        respond(limiter)
+    assert limiter.limit == 8
+
+def test_connection_failures_leave_the_limit_alone(limiter):
+    respond(limiter, overloaded=True)
+    respond(limiter, latency=5, measured=False)
+    assert limiter.limit == 4
+    assert limiter.in_flight == 0
+
+def test_requests_in_flight_lower_the_limit_once(limiter):
+    # Requests sent before the limit was lowered answer just as slowly; they do not lower it again
+    first, second = limiter.acquire(), limiter.acquire()
+    time.sleep(0.01)
+    limiter.release(first, overloaded=True)
+    limiter.release(second, overloaded=True)
+    assert limiter.limit == 4
+
+def test_backs_off_between_request_starts():
+    limiter = AdaptiveLimiter(8, latency_target=1, max_delay=10)
+    respond(limiter, overloaded=True)
+    assert limiter.delay == pytest.approx(0.1)
+    respond(limiter, overloaded=True)
+    assert limiter.delay == pytest.approx(0.2)
+    respond(limiter)
+    assert limiter.delay == pytest.approx(0.1)
+
+def test_acquire_blocks_at_the_limit():
+    limiter = AdaptiveLimiter(1, max_delay=0)
+    started = limiter.acquire()
+    acquired = threading.Event()
+    thread = threading.Thread(target=lambda: (limiter.acquire(), acquired.set()))
+    thread.start()
+    assert not acquired.wait(0.05)
+    limiter.release(started)
+    assert acquired.wait(1)
+    thread.join()
+
+def test_budget_stops_at_the_limit():
+    budget = QueryBudget(limit=2)
+    budget.spend()
+    budget.spend()
+    with pytest.raises(QueryBudgetExceeded):
+        budget.spend()
+    with pytest.raises(QueryBudgetExceeded):
+        budget.spend()
+    assert (budget.spent, budget.refused) == (2, 2)
+
+def test_unlimited_budget():
+    budget = QueryBudget()
+    for _ in range(1000):
+        budget.spend()
+    assert budget.spent == 1000
+
+def test_aborted_budget_sends_nothing_more():
+    budget = QueryBudget(limit=10)
+    budget.spend()
+    budget.abort("Could not connect")
+    budget.abort("Later reason")
+    with pytest.raises(CycleAborted, match="Could not connect"):
+        budget.spend()
+    assert budget.aborted == "Could not connect"
+    assert budget.spent == 1
+
+def test_budget_wait_ends_when_stopping():
+    stop_event = threading.Event()
+    budget = QueryBudget(stop_event=stop_event)
+    assert not budget.stopping()
+    stop_event.set()
+    assert budget.stopping()
+    started = time.monotonic()
+    budget.wait(10)
+    assert time.monotonic() - started < 1
@@ -0,0 +1,92 @@
+import os
+import time
+import zlib
+import pickle
+import numpy as np
+import pytest
+from src.query_cache import QueryCache
+
+@pytest.fixture
+def cache(tmp_path):
+    return QueryCache(str(tmp_path / "cache"), settle_time=600)
+
+def age(cache, key, seconds):
+    # Move an entry's modification time into the past
+    filename = cache.get_filename(key)
+    mtime = time.time() - seconds
+    os.utime(filename, (mtime, mtime))
+
+def test_round_trip_keeps_float64_samples(cache):
+    values = np.array([[1.0, 0.5], [2.0, np.nan], [3.0, np.inf], [4.0, -np.inf]])
+    result = [{"metric": {"node": "a", "__name__": "x"}, "values": values},
+              {"metric": {}, "values": np.empty((0, 2))}]
+    cache.put("k", result)
+    cached = cache.get("k")
+
+    assert [series["metric"] for series in cached] == [{"node": "a", "__name__": "x"}, {}]
+    assert cached[0]["values"].dtype == np.float64
+    np.testing.assert_array_equal(cached[0]["values"], values)
+    assert cached[1]["values"].shape == (0, 2)
+    # The decoded arrays are writable copies, not views of the file's buffer
+    cached[0]["values"][0, 1] = 7.0
+
+def test_round_trip_plain_values(cache):
+    cache.put("empty", [])
+    cache.put("plan", {"queries": [{"expr": "x", "comparisons": [(">", 1.0)]}], "version": 2})
+    assert cache.get("empty") == []
+    # Tuples come back as lists
+    assert cache.get("plan") == {"queries": [{"expr": "x", "comparisons": [[">", 1.0]]}], "version": 2}
+
+def test_missing_and_unstorable_entries(cache):
+    assert cache.get("missing") is None
+    cache.put("object", [object()])
+    assert cache.get("object") is None
+
+def test_pickled_entries_are_misses(cache):
+    with open(cache.get_filename("old"), "wb") as f:
+        f.write(zlib.compress(pickle.dumps([{"metric": {}, "values": np.zeros((1, 2))}])))
+    assert cache.get("old") is None
+
+def test_refresh_ignores_entries_but_writes_them(tmp_path):
+    QueryCache(str(tmp_path)).put("k", [1])
+    refreshing = QueryCache(str(tmp_path), refresh=True)
+    assert refreshing.get("k") is None
+    refreshing.put("k", [2])
+    assert QueryCache(str(tmp_path)).get("k") == [2]
+
+def test_max_age(tmp_path):
+    cache = QueryCache(str(tmp_path), max_age=3600)
+    cache.put("fresh", [1])
+    cache.put("stale", [2])
+    age(cache, "stale", 7200)
+    assert cache.get("stale") is None
+    assert cache.get("fresh") == [1]
+    # Expired entries are removed by the next eviction, e.g. when the cache is opened again
+    QueryCache(str(tmp_path), max_age=3600)
+    assert not os.path.exists(cache.get_filename("stale"))
+    assert os.path.exists(cache.get_filename("fresh"))
+
+def test_max_size_evicts_least_recently_used(tmp_path):
+    cache = QueryCache(str(tmp_path))
+    sample = np.random.default_rng(0).random((64, 2))
+    for key, seconds in (("old", 300), ("used", 200), ("new", 100)):
+        cache.put(key, [{"metric": {}, "values": sample}])
+        age(cache, key, seconds)
+    entry_size = os.path.getsize(cache.get_filename("old"))
+    # Reading an entry makes it the most recently used
+    assert cache.get("used") is not None
+
+    cache = QueryCache(str(tmp_path), max_size=2 * entry_size)
+    assert cache.get("old") is None
+    assert cache.get("new") is not None
+    assert cache.get("used") is not None
+    assert cache.size <= cache.max_size
+
+def test_is_cacheable_near_now(cache):
+    now = time.time()
+    assert cache.is_cacheable(now - 3600)
+    assert cache.is_cacheable(now - 601)
+    # Samples within settle_time of now may still change
+    assert not cache.is_cacheable(now - 599)
+    assert not cache.is_cacheable(now)
+    assert not cache.is_cacheable(now + 60)
@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+from src.query_planner import QueryPlanner
+
+@pytest.fixture
+def planner():
+    return QueryPlanner()
+
+def handler(metric, result):
+    pass
+
+@pytest.mark.parametrize("expr, expected", [
+    ("sum(x) > bool 5", ("sum(x)", (">", 5.0))),
+    # Parentheses around the whole comparison, or around the whole base, are dropped
+    ("((sum(x) > bool 5))", ("sum(x)", (">", 5.0))),
+    ("(sum(a) or vector(0)) >= bool 0.5", ("sum(a) or vector(0)", (">=", 0.5))),
+    ("(sum(rate(x[5m])) / (sum(y) or vector(1))) > bool 0.9", ("sum(rate(x[5m])) / (sum(y) or vector(1))", (">", 0.9))),
+    # but not parentheses that only open and close the ends of the base
+    ("(a) + (b) > bool 1", ("(a) + (b)", (">", 1.0))),
+    ("sum((a)) > bool 3", ("sum((a))", (">", 3.0))),
+    # Arithmetic binds tighter than the comparison, so it stays in the base
+    ("a + b > bool 1", ("a + b", (">", 1.0))),
+    ("max(a > bool 1) < bool 2", ("max(a > bool 1)", ("<", 2.0))),
+    ('sum(x{a=~">"}) > bool 1', ('sum(x{a=~">"})', (">", 1.0))),
+    ("x > bool -1", ("x", (">", -1.0))),
+    ("x <= bool 1e3", ("x", ("<=", 1000.0))),
+    ("x != bool 0", ("x", ("!=", 0.0))),
+    ("x == bool .5", ("x", ("==", 0.5))),
+])
+def test_split_threshold(planner, expr, expected):
+    assert planner.split_threshold(expr) == expected
+
+@pytest.mark.parametrize("expr", [
+    # The comparison binds tighter than or/and/unless: it only applies to the right-hand operand
+    "a or vector(0) > bool 1",
+    "sum(a) or vector(0) > bool 1",
+    "a unless b > bool 1",
+    "a > bool 1 and b > bool 2",
+    "a > bool 1 > bool 0",
+    "(a > bool 1) + (b > bool 1)",
+    # Filters without bool, and thresholds that are not plain decimal numbers
+    "x > 5",
+    "x > bool 0x10",
+    "x > bool Inf",
+    "(a) > bool (1)",
+])
+def test_split_threshold_leaves_other_expressions(planner, expr):
+    assert planner.split_threshold(expr) is None
+
+def test_normalize_expr_keeps_string_literals(planner):
+    expr = 'sum by (node) (\n  rate(x{a="b  c"}[5m])\n)  >  bool  1'
+    assert planner.normalize_expr(expr) == 'sum by (node)(rate(x{a="b  c"}[5m])) > bool 1'
+    assert planner.normalize_expr("x{a='  ',b=`a\\`}  or  y") == "x{a='  ',b=`a\\`} or y"
+
+def test_evaluate_comparisons_instant(planner):
+    result = [{"metric": {"__name__": "x", "node": "a"}, "value": [100, "3"]},
+              {"metric": {}, "value": [100, "0"]},
+              {"metric": {"node": "n"}, "value": [100, "NaN"]}]
+    evaluated = planner.evaluate_comparisons(result, [(">", 1.0), ("==", 0.0), ("!=", 3.0), ("<=", 3.0)])
+
+    def flags(comparison):
+        return [series["value"][1] for series in evaluated[comparison]]
+
+    # Same values as Prometheus: NaN compares false except with !=
+    assert flags((">", 1.0)) == ["1", "0", "0"]
+    assert flags(("==", 0.0)) == ["0", "1", "0"]
+    assert flags(("!=", 3.0)) == ["0", "1", "1"]
+    assert flags(("<=", 3.0)) == ["1", "1", "0"]
+    # bool comparisons drop the metric name and keep the sample timestamp
+    assert evaluated[(">", 1.0)][0] == {"metric": {"node": "a"}, "value": [100, "1"]}
+
+def test_evaluate_comparisons_range(planner):
+    result = [{"metric": {"__name__": "x"}, "values": np.array([[1.0, 1.0], [2.0, 5.0]])},
+              {"metric": {"a": "b"}, "values": np.array([[1.0, 7.0]])}]
+    derived = planner.evaluate_comparisons(result, [(">=", 5.0)])[(">=", 5.0)]
+    assert [series["metric"] for series in derived] == [{}, {"a": "b"}]
+    np.testing.assert_array_equal(derived[0]["values"], [[1.0, 0.0], [2.0, 1.0]])
+    np.testing.assert_array_equal(derived[1]["values"], [[1.0, 1.0]])
+
+def test_evaluate_comparisons_empty_result(planner):
+    assert planner.evaluate_comparisons([], [(">", 1.0)]) == {(">", 1.0): []}
+
+def test_plan_shares_threshold_families(planner):
+    plan = planner.plan([({"name": "a", "expr": "x > bool 1"}, handler, "instant", None),
+                         ({"name": "b", "expr": "(x)  >= bool 2"}, handler, "instant", None),
+                         ({"name": "c", "expr": "x"}, handler, "instant", None),
+                         ({"name": "d", "expr": "y > bool 1"}, handler, "instant", None),
+                         ({"name": "e", "expr": "x > bool 1"}, handler, "range", 60)])
+    # A family of thresholds on one base fetches the base once; a lone threshold is sent as written
+    assert [(query["expr"], query["kind"], query["comparisons"]) for query in plan["queries"]] == [
+        ("x", "instant", [(">", 1.0), (">=", 2.0)]),
+        ("y > bool 1", "instant", []),
+        ("x > bool 1", "range", []),
+    ]
+    assert [(metric["name"], query_index, comparison) for metric, _, query_index, comparison in plan["entries"]] == [
+        ("a", 0, (">", 1.0)), ("b", 0, (">=", 2.0)), ("c", 0, None), ("d", 1, None), ("e", 2, None)]
@@ -0,0 +1,52 @@
+import io
+import json
+import numpy as np
+import pytest
+from src import response_decoder
+from src.response_decoder import RangeResponseDecoder
+
+class FakeResponse:
+    # Body of a requests response, readable whole (content) or streamed (raw)
+    def __init__(self, body):
+        self.content = body
+        self.raw = io.BytesIO(body)
+
+def body(result, status="success"):
+    return json.dumps({"status": status, "data": {"resultType": "matrix", "result": result}}).encode()
+
+def installed_backends():
+    return [backend for backend in RangeResponseDecoder.BACKENDS
+            if backend == "json" or getattr(response_decoder, backend) is not None]
+
+@pytest.mark.parametrize("result", [
+    [],
+    [{"metric": {"__name__": "up", "node": "a"}, "values": [[1692172800, "1"], [1692173700.5, "0.25"]]}],
+    # Prometheus writes special float values as strings
+    [{"metric": {"node": "a"}, "values": [[1692172800, "NaN"], [1692173700, "+Inf"], [1692174600, "-Inf"]]},
+     {"metric": {}, "values": []},
+     {"metric": {"node": "b", "role": "worker"}, "values": [[1692172800, "1e-3"], [1692173700, "12345678901234"]]}],
+])
+def test_backends_decode_identically(result):
+    decoded = {}
+    for backend in installed_backends():
+        series, decoded_bytes = RangeResponseDecoder(backend=backend).decode(FakeResponse(body(result)))
+        assert decoded_bytes == len(body(result))
+        decoded[backend] = series
+
+    expected = decoded.pop("json")
+    assert [series["metric"] for series in expected] == [series["metric"] for series in result]
+    for series in expected:
+        assert series["values"].dtype == np.float64 and series["values"].shape[1:] == (2,)
+    for backend, series_list in decoded.items():
+        assert [series["metric"] for series in series_list] == [series["metric"] for series in expected], backend
+        for series, expected_series in zip(series_list, expected):
+            assert series["values"].dtype == np.float64, backend
+            np.testing.assert_array_equal(series["values"], expected_series["values"], err_msg=backend)
+
+@pytest.mark.parametrize("backend", RangeResponseDecoder.BACKENDS)
+def test_error_status(backend):
+    if backend != "json":
+        pytest.importorskip(backend)
+    payload = json.dumps({"status": "error", "errorType": "bad_data", "error": "parse error"}).encode()
+    with pytest.raises(ValueError, match="parse error"):
+        RangeResponseDecoder(backend=backend).decode(FakeResponse(payload))
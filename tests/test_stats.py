@@ -0,0 +1,31 @@
+import os
+import pytest
+from src.stats import DatasetStats
+
+@pytest.fixture
+def collections(tmp_path):
+    # Two output directories, one of them hive partitioned, next to an unrelated directory
+    for relative in ("out_a/date=2023-08-16/hour=08/metrics_combined_1.parquet", "out_a/_metrics_combined.checkpoint.json",
+                     "out_b/metrics_combined_2.csv", "other/metrics_combined_3.parquet"):
+        path = tmp_path / relative
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("")
+    return tmp_path
+
+def relative(root, files):
+    return [os.path.relpath(file_path, str(root)) for file_path in files]
+
+@pytest.mark.parametrize("pattern, expected", [
+    # Directories matched by a glob are searched like a directory given directly
+    ("out_*", ["out_a/date=2023-08-16/hour=08/metrics_combined_1.parquet", "out_b/metrics_combined_2.csv"]),
+    ("out_a", ["out_a/date=2023-08-16/hour=08/metrics_combined_1.parquet"]),
+    ("**/*.parquet", ["other/metrics_combined_3.parquet", "out_a/date=2023-08-16/hour=08/metrics_combined_1.parquet"]),
+    ("out_b/metrics_combined_2.csv", ["out_b/metrics_combined_2.csv"]),
+])
+def test_find_files(collections, pattern, expected):
+    dataset = DatasetStats(os.path.join(str(collections), pattern), workers=1)
+    assert relative(collections, dataset.files) == expected
+
+def test_no_files(collections):
+    with pytest.raises(FileNotFoundError):
+        DatasetStats(os.path.join(str(collections), "missing_*"))
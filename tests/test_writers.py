@@ -0,0 +1,111 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from src.writers import ParquetAppendWriter, CSVAppendWriter, remove_time_range
+
+# 2023-08-16 08:00:00 UTC
+START = 1692172800
+
+def create_writer(writer_class, path, **kwargs):
+    return writer_class(str(path), "combined", "20230816-080000", **kwargs)
+
+def frame(timestamp, **columns):
+    df = pd.DataFrame({"timestamp": [pd.Timestamp(timestamp, unit="s", tz="UTC")], "run_id": ["20230816-080000"]})
+    for name, value in columns.items():
+        df[name] = [float(value)]
+    return df
+
+def read(filename):
+    if filename.endswith(".csv"):
+        df = pd.read_csv(filename)
+        df["timestamp"] = pd.to_datetime(df["timestamp"], utc=True)
+        return df
+    return pd.read_parquet(filename)
+
+def relative(path, filename):
+    return os.path.relpath(filename, str(path))
+
+@pytest.fixture(params=[ParquetAppendWriter, CSVAppendWriter])
+def writer_class(request):
+    return request.param
+
+def test_appends_cycles_to_one_file(tmp_path, writer_class):
+    writer = create_writer(writer_class, tmp_path)
+    writer.write(frame(START, a=1, b=2), START)
+    writer.write(frame(START + 900, b=4), START + 900)
+    writer.close()
+
+    assert os.listdir(tmp_path) == [f"metrics_combined_20230816-080000.{writer.extension}"]
+    df = read(writer.filename)
+    assert list(df.columns) == ["timestamp", "run_id", "a", "b"]
+    # Columns missing from a cycle are written as nulls
+    np.testing.assert_array_equal(df["a"], [1.0, np.nan])
+    np.testing.assert_array_equal(df["b"], [2.0, 4.0])
+
+def test_new_column_rolls_over_to_a_part_file(tmp_path, writer_class):
+    writer = create_writer(writer_class, tmp_path)
+    writer.write(frame(START, a=1), START)
+    first = writer.filename
+    writer.write(frame(START + 900, a=2, b=3), START + 900)
+    writer.write(frame(START + 1800, b=5), START + 1800)
+    writer.close()
+
+    assert relative(tmp_path, first) == f"metrics_combined_20230816-080000.{writer.extension}"
+    assert relative(tmp_path, writer.filename) == f"metrics_combined_20230816-080000_part0001.{writer.extension}"
+    assert list(read(first).columns) == ["timestamp", "run_id", "a"]
+    df = read(writer.filename)
+    assert list(df.columns) == ["timestamp", "run_id", "a", "b"]
+    np.testing.assert_array_equal(df["a"], [2.0, np.nan])
+    np.testing.assert_array_equal(df["b"], [3.0, 5.0])
+
+@pytest.mark.parametrize("rotation, parts", [
+    ({"max_rows": 2}, [2, 2, 1]),
+    # Hourly periods: cycles every 15 minutes from 08:00
+    ({"period": 3600}, [4, 1]),
+])
+def test_rotation(tmp_path, writer_class, rotation, parts):
+    writer = create_writer(writer_class, tmp_path, rotation=rotation)
+    filenames = []
+    for cycle in range(5):
+        writer.write(frame(START + cycle * 900, a=cycle), START + cycle * 900)
+        if writer.filename not in filenames:
+            filenames.append(writer.filename)
+    writer.close()
+
+    suffixes = [""] + [f"_part{part:04d}" for part in range(1, len(parts))]
+    assert [relative(tmp_path, filename) for filename in filenames] == [
+        f"metrics_combined_20230816-080000{suffix}.{writer.extension}" for suffix in suffixes]
+    assert [len(read(filename)) for filename in filenames] == parts
+    # Every cycle is written exactly once, in order
+    np.testing.assert_array_equal(pd.concat([read(filename) for filename in filenames])["a"], range(5))
+
+def test_hive_partitioning(tmp_path, writer_class):
+    writer = create_writer(writer_class, tmp_path, partitioning="hive")
+    filenames = []
+    # 08:45 and 09:00 UTC fall into different hours
+    for timestamp in (START + 2700, START + 3600, START + 4500):
+        writer.write(frame(timestamp, a=timestamp), timestamp)
+        if writer.filename not in filenames:
+            filenames.append(writer.filename)
+    writer.close()
+
+    assert [relative(tmp_path, filename) for filename in filenames] == [
+        os.path.join("date=2023-08-16", "hour=08", f"metrics_combined_20230816-080000.{writer.extension}"),
+        os.path.join("date=2023-08-16", "hour=09", f"metrics_combined_20230816-080000_part0001.{writer.extension}"),
+    ]
+    np.testing.assert_array_equal(read(filenames[0])["a"], [START + 2700])
+    np.testing.assert_array_equal(read(filenames[1])["a"], [START + 3600, START + 4500])
+
+def test_remove_time_range(tmp_path, writer_class):
+    writer = create_writer(writer_class, tmp_path)
+    for cycle in range(4):
+        writer.write(frame(START + cycle * 900, a=cycle), START + cycle * 900)
+    writer.close()
+
+    assert remove_time_range(writer.filename, START + 900, START + 1800) == 2
+    np.testing.assert_array_equal(read(writer.filename)["a"], [0.0, 3.0])
+    assert remove_time_range(writer.filename, START + 900, START + 1800) == 0
+    # A file left without rows is removed
+    assert remove_time_range(writer.filename, START, START + 2700) == 2
+    assert not os.path.exists(writer.filename)